@@ -1,56 +1,75 @@
 from __future__ import annotations
-from typing import Optional, List, Dict, Any
-import contextvars
+from concurrent.futures import Future
+from typing import Optional, List, Dict, Any, AsyncIterator
+import asyncio, contextvars, json, logging, time
 
 from langchain.agents import create_tool_calling_agent, AgentExecutor
+from langchain_core.agents import AgentAction, AgentStep
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.tools import tool
 
+from app.config import settings
 from app.services.llm import get_llm
+from app.services.attachments import get_attachment_store
+from app.services import answer_cache
+from app.services.executors import run_blocking, submit
+from app.services.metrics import histogram, register_stats, timed
+from app.services.rag import embed_query
+from app.services.session_store import WindowedHistory, get_session_store
 from app.tools.weather import get_weather
 from app.tools.rag_tool import rag_search
-from app.tools.vit import classify_crop_disease as vit_classify_direct
+from app.tools.vit import classify_image, decode_image
+from app.agents.router import Route, get_router, strip_user_context
+
+logger = logging.getLogger(__name__)
 
 _current_session_id = contextvars.ContextVar("session_id", default="default")
+# [rounds so far] for the request being run, so each AgentExecutor iteration is timed under its own label.
+_agent_round: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("agent_round", default=None)
 
-class AttachmentStore:
-    _images_b64: Dict[str, List[str]] = {}
+_STEP_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+_agent_rounds = histogram("agent_rounds", (1, 2, 3, 4, 5), "LLM planning rounds per agent run")
 
-    @classmethod
-    def put_images(cls, session_id: str, images_b64: Optional[List[str]]):
-        if images_b64 is None:
-            return
-        cls._images_b64[session_id] = images_b64
+def _step_ms(phase: str, rnd: int):
+    return histogram("agent_step_ms", _STEP_BUCKETS_MS, "AgentExecutor time per round: LLM planning or the tool calls",
+                     phase=phase, round=str(rnd))
+
+def _request_ms(path: str, started: float) -> None:
+    histogram("agent_request_ms", _STEP_BUCKETS_MS, "Agent time per request by path (cached, routed or agent)",
+              path=path).observe((time.perf_counter() - started) * 1000)
 
-    @classmethod
-    def get_image_b64(cls, session_id: str, idx: int) -> str:
-        imgs = cls._images_b64.get(session_id, [])
-        if idx < 0 or idx >= len(imgs):
-            raise ValueError(f"image_idx {idx} is out of range (have {len(imgs)})")
-        return imgs[idx]
+def _next_round() -> int:
+    rounds = _agent_round.get()
+    if rounds is None:
+        return 1
+    rounds[0] += 1
+    return rounds[0]
 
 @tool("classify_crop_disease", return_direct=False)
+@timed("tool", "classify_crop_disease")
 def classify_crop_disease_indirect(image_idx: int = 0) -> dict:
     """Classify a crop disease from an uploaded image. Pass image_idx=0 for first image."""
     session_id = _current_session_id.get()
-    b64 = AttachmentStore.get_image_b64(session_id, image_idx)
-    return vit_classify_direct.invoke({"image_base64": b64})
-
-_session_store: dict[str, ChatMessageHistory] = {}
+    try:
+        image = get_attachment_store().get_decoded(session_id, image_idx, decode_image)
+    except Exception as e:
+        return {"error": str(e)}
+    return classify_image(image)
 
 def _get_history(session_id: str) -> BaseChatMessageHistory:
-    if session_id not in _session_store:
-        _session_store[session_id] = ChatMessageHistory()
-    return _session_store[session_id]
+    # Only the last SESSION_HISTORY_WINDOW messages are loaded into the prompt.
+    return WindowedHistory(get_session_store(), session_id, settings.SESSION_HISTORY_WINDOW or None)
 
-def _prompt() -> ChatPromptTemplate:
-    return ChatPromptTemplate.from_messages(
-        [
-            ("system",
-             """You are AgriBot, a specialized AI assistant expert in the field of agriculture. Your sole purpose is to provide accurate, helpful, and science-based information related to farming, crop management, soil science, pest control, irrigation, agricultural technology, and livestock management.
+def session_stats() -> dict:
+    return get_session_store().stats()
+
+register_stats("session_store", session_stats)
+
+_SYSTEM_PROMPT = """You are AgriBot, a specialized AI assistant expert in the field of agriculture. Your sole purpose is to provide accurate, helpful, and science-based information related to farming, crop management, soil science, pest control, irrigation, agricultural technology, and livestock management.
 
 Core Rules:
 1. Strictly On-Topic: You MUST only answer questions directly related to agriculture. If a user asks about anything else (e.g., movies, politics, history, coding, general trivia), you MUST politely decline and state your purpose. Example refusal: "My expertise is limited to agriculture. I cannot answer questions about that topic. Please ask me something related to farming."
@@ -66,7 +85,12 @@ Tool Usage Policy:
 • get_weather for weather queries (always show units).
 • rag_search for factual/KB questions; cite sources briefly if available.
 • classify_crop_disease only if the user asked about an image/crop disease and at least one image is attached; when calling it, pass image_idx (0 for first image).
-Be concise and never make up citations."""),
+Be concise and never make up citations."""
+
+def _prompt() -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", _SYSTEM_PROMPT),
             MessagesPlaceholder("chat_history"),
             ("user", "{input}"),
             ("user", "Attachments available: {attachments_overview}"),
@@ -74,11 +98,63 @@ Be concise and never make up citations."""),
         ]
     )
 
-def build_independent_agent() -> AgentExecutor:
-    llm = get_llm()
+def _phrase_prompt() -> ChatPromptTemplate:
+    # The router already ran the tools; the LLM only has to word the answer.
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", _SYSTEM_PROMPT),
+            MessagesPlaceholder("chat_history"),
+            ("user", "{input}"),
+            ("user", "Attachments available: {attachments_overview}"),
+            ("user", "Tool results already fetched for this question:\n{tool_results}\n"
+                     "Answer the question using these results."),
+        ]
+    )
+
+class ConcurrentToolsExecutor(AgentExecutor):
+    """AgentExecutor whose sync path runs the tool calls of one LLM step in
+    parallel (the async path already gathers them)."""
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None) -> AgentStep:
+        perform = super()._perform_agent_action
+        fut = submit("tools", perform, name_to_tool_map, color_mapping, agent_action, run_manager)
+        return AgentStep(action=agent_action, observation=fut)
+
+    def _iter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        # The parent yields every action before performing any, and each
+        # _perform_agent_action above only submits, so all tools start at once.
+        rnd, started, planned = _next_round(), time.perf_counter(), None
+        pending = []
+        for item in super()._iter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager):
+            if planned is None:
+                planned = time.perf_counter()
+                _step_ms("plan", rnd).observe((planned - started) * 1000)
+            if isinstance(item, AgentStep) and isinstance(item.observation, Future):
+                pending.append(item.observation)
+            else:
+                yield item
+        for fut in pending:
+            yield fut.result()
+        if pending:
+            _step_ms("tools", rnd).observe((time.perf_counter() - planned) * 1000)
+
+    async def _aiter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        rnd, started, planned, acted = _next_round(), time.perf_counter(), None, False
+        async for item in super()._aiter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps,
+                                                   run_manager):
+            if planned is None:
+                planned = time.perf_counter()
+                _step_ms("plan", rnd).observe((planned - started) * 1000)
+            acted = acted or isinstance(item, AgentStep)
+            yield item
+        if acted:
+            _step_ms("tools", rnd).observe((time.perf_counter() - planned) * 1000)
+
+def build_independent_agent(llm: Optional[BaseChatModel] = None) -> AgentExecutor:
+    llm = llm or get_llm()
     tools = [get_weather, rag_search, classify_crop_disease_indirect]
     agent = create_tool_calling_agent(llm, tools, _prompt())
-    return AgentExecutor(
+    return ConcurrentToolsExecutor(
         agent=agent,
         tools=tools,
         verbose=False,
@@ -87,34 +163,211 @@ def build_independent_agent() -> AgentExecutor:
         return_intermediate_steps=True,
     )
 
+def _tool_failed(observation: Any) -> bool:
+    return isinstance(observation, dict) and "error" in observation
+
+def _invoke_tool(t, args: dict) -> Any:
+    try:
+        return t.invoke(args)
+    except Exception as e:
+        logger.warning("routed tool %s failed: %s", t.name, e)
+        return {"error": str(e)}
+
+async def _ainvoke_tool(t, args: dict) -> Any:
+    try:
+        return await t.ainvoke(args)
+    except Exception as e:
+        logger.warning("routed tool %s failed: %s", t.name, e)
+        return {"error": str(e)}
+
+def _tool_results(steps: List[tuple[AgentAction, Any]]) -> str:
+    return "\n".join(f"{a.tool}({json.dumps(a.tool_input, ensure_ascii=False)}): "
+                     f"{json.dumps(obs, default=str, ensure_ascii=False)}" for a, obs in steps)
+
 class IndependentAgent:
     def __init__(self) -> None:
-        self.executor = build_independent_agent()
+        self.llm = get_llm()
+        self.executor = build_independent_agent(self.llm)
+        self.tools = {t.name: t for t in self.executor.tools}
+        self.phraser = _phrase_prompt() | self.llm
 
-    def _with_history(self, session_id: str) -> RunnableWithMessageHistory:
+    def _with_history(self, session_id: str, runnable=None) -> RunnableWithMessageHistory:
         return RunnableWithMessageHistory(
-            self.executor,
+            runnable or self.executor,
             lambda session_id=session_id: _get_history(session_id),
             input_messages_key="input",
             history_messages_key="chat_history",
         )
 
-    def respond(self, session_id: str, user_text: str, images_base64: Optional[List[str]] = None, stream: bool = False):
-        AttachmentStore.put_images(session_id, images_base64)
-        attachments_overview = f"{len(images_base64)} image(s)" if images_base64 else "none"
+    def _route(self, session_id: str, user_text: str, images: Optional[List[bytes]]) -> Optional[Route]:
+        router = get_router()
+        if router is None:
+            return None
+        try:
+            route = router.route(user_text, len(images or []))
+        except Exception:
+            logger.exception("router failed; using the agent")
+            return None
+        if route is not None:
+            logger.info("routed session=%s intent=%s via %s tools=%s", session_id, route.intent, route.reason,
+                        [name for name, _ in route.calls])
+        return route
+
+    def _run_routed(self, route: Route) -> List[tuple[AgentAction, Any]]:
+        calls = [(AgentAction(name, args, f"routed ({route.reason})"), self.tools[name]) for name, args in route.calls]
+        if len(calls) == 1:
+            action, t = calls[0]
+            return [(action, _invoke_tool(t, action.tool_input))]
+        futures = [submit("tools", _invoke_tool, t, action.tool_input) for action, t in calls]
+        return [(action, fut.result()) for (action, _), fut in zip(calls, futures)]
+
+    def _cache_probe(self, session_id: str, user_text: str, images: Optional[List[bytes]],
+                     language: Optional[str]) -> tuple[Optional[str], Optional[tuple]]:
+        """(cached answer, store key). The key is None when the request must
+        bypass the answer cache; otherwise it is passed to _cache_store()."""
+        cache = answer_cache.get_answer_cache()
+        if cache is None:
+            return None, None
+        has_history = settings.ANSWER_CACHE_FIRST_TURN_ONLY and bool(get_session_store().get_messages(session_id, limit=1))
+        # Match on the question alone: the profile block would skew both the
+        # embedding and the script, and only its preferred language matters here.
+        question, context = strip_user_context(user_text)
+        reason = answer_cache.bypass_reason(question, bool(images), has_history)
+        if reason:
+            cache.bypass(reason)
+            return None, None
+        try:
+            vec = embed_query(question)
+        except Exception:
+            logger.exception("answer cache: embedding failed")
+            cache.bypass("error")
+            return None, None
+        lang = answer_cache.language_key(question, language or answer_cache.preferred_language(context))
+        gen = answer_cache.generation()
+        hit = cache.lookup(lang, vec, gen)
+        if hit is None:
+            return None, (lang, vec, gen, question)
+        text, score = hit
+        # Keep the transcript as if the agent had answered.
+        get_session_store().add_messages(session_id, [HumanMessage(content=user_text), AIMessage(content=text)])
+        logger.info("answer cache hit session=%s lang=%s similarity=%.3f", session_id, lang, score)
+        return text, None
+
+    def _cache_store(self, key: Optional[tuple], text: Optional[str], tools: List[str]) -> None:
+        cache = answer_cache.get_answer_cache()
+        if key is None or cache is None or not text:
+            return
+        if answer_cache.uncacheable_tools(tools):
+            cache.bypass("tool")
+            return
+        lang, vec, gen, question = key
+        cache.put(lang, vec, question, text, gen)
+
+    def respond(self, session_id: str, user_text: str, images: Optional[List[bytes]] = None, stream: bool = False,
+                language: Optional[str] = None):
+        started = time.perf_counter()
+        cached, cache_key = self._cache_probe(session_id, user_text, images, language)
+        if cached is not None:
+            _request_ms("cached", started)
+            return {"text": cached, "intermediate_steps": [], "cached": True}
+        get_attachment_store().put_images(session_id, images)
+        attachments_overview = f"{len(images)} image(s)" if images else "none"
         _current_session_id.set(session_id)
-        runnable = self._with_history(session_id)
         inputs = {"input": user_text, "attachments_overview": attachments_overview}
-        result = runnable.invoke(inputs, {"configurable": {"session_id": session_id}})
+        config = {"configurable": {"session_id": session_id}}
+        route = self._route(session_id, user_text, images)
+        if route is not None:
+            steps = self._run_routed(route)
+            if not any(_tool_failed(obs) for _, obs in steps):
+                reply = self._with_history(session_id, self.phraser).invoke({**inputs, "tool_results": _tool_results(steps)}, config)
+                text = _chunk_text(reply)
+                self._cache_store(cache_key, text, [a.tool for a, _ in steps])
+                _request_ms("routed", started)
+                return {"text": text, "intermediate_steps": steps}
+            logger.info("routed tool failed session=%s; using the agent", session_id)
+        runnable = self._with_history(session_id)
+        rounds = [0]
+        _agent_round.set(rounds)
+        result = runnable.invoke(inputs, config)
+        _agent_rounds.observe(rounds[0])
+        _request_ms("agent", started)
+        text = result.get("output") if isinstance(result, dict) else str(result)
+        steps = result.get("intermediate_steps", []) if isinstance(result, dict) else []
+        self._cache_store(cache_key, text, [getattr(action, "tool", "") for action, _ in steps])
         return {
-            "text": result.get("output") if isinstance(result, dict) else str(result),
-            "intermediate_steps": result.get("intermediate_steps", []),
+            "text": text,
+            "intermediate_steps": steps,
         }
 
-    def stream(self, session_id: str, inputs: Dict[str, Any], images_base64: Optional[List[str]] = None):
-        AttachmentStore.put_images(session_id, images_base64)
+    async def astream(self, session_id: str, user_text: str, images: Optional[List[bytes]] = None,
+                      language: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield {"event": "token"|"tool_start"|"tool_end", "data": ...} as the agent runs.
+
+        Tokens are forwarded from every LLM call as they arrive. Cancelling the
+        consumer cancels the in-flight LLM request. A cached answer arrives as
+        a single token.
+        """
+        started = time.perf_counter()
+        cached, cache_key = None, None
+        if answer_cache.get_answer_cache() is not None:
+            cached, cache_key = await run_blocking("agent", self._cache_probe, session_id, user_text, images, language)
+        if cached is not None:
+            _request_ms("cached", started)
+            yield {"event": "token", "data": cached}
+            return
+        get_attachment_store().put_images(session_id, images)
+        attachments_overview = f"{len(images)} image(s)" if images else "none"
         _current_session_id.set(session_id)
+        inputs = {"input": user_text, "attachments_overview": attachments_overview}
+        config = {"configurable": {"session_id": session_id}}
+        route = await run_blocking("agent", self._route, session_id, user_text, images) if get_router() else None
+        if route is not None:
+            actions = [AgentAction(name, args, f"routed ({route.reason})") for name, args in route.calls]
+            for a in actions:
+                yield {"event": "tool_start", "data": {"name": a.tool, "input": a.tool_input}}
+            observations = await asyncio.gather(*(_ainvoke_tool(self.tools[a.tool], a.tool_input) for a in actions))
+            steps = list(zip(actions, observations))
+            for a, obs in steps:
+                yield {"event": "tool_end", "data": {"name": a.tool, "output": obs}}
+            if not any(_tool_failed(obs) for _, obs in steps):
+                reply = []
+                phraser = self._with_history(session_id, self.phraser)
+                async for chunk in phraser.astream({**inputs, "tool_results": _tool_results(steps)}, config):
+                    text = _chunk_text(chunk)
+                    if text:
+                        reply.append(text)
+                        yield {"event": "token", "data": text}
+                self._cache_store(cache_key, "".join(reply), [a.tool for a in actions])
+                _request_ms("routed", started)
+                return
+            logger.info("routed tool failed session=%s; using the agent", session_id)
         runnable = self._with_history(session_id)
-        for chunk in runnable.stream(inputs, {"configurable": {"session_id": session_id}}):
-            if "output" in chunk:
-                yield chunk["output"]
+        rounds = [0]
+        _agent_round.set(rounds)
+        output, tools = None, []
+        async for ev in runnable.astream_events(inputs, config, version="v2"):
+            kind = ev["event"]
+            if kind == "on_chat_model_stream":
+                text = _chunk_text(ev["data"].get("chunk"))
+                if text:
+                    yield {"event": "token", "data": text}
+            elif kind == "on_tool_start":
+                tools.append(ev["name"])
+                yield {"event": "tool_start", "data": {"name": ev["name"], "input": ev["data"].get("input")}}
+            elif kind == "on_tool_end":
+                yield {"event": "tool_end", "data": {"name": ev["name"], "output": ev["data"].get("output")}}
+            elif kind == "on_chain_end" and not ev.get("parent_ids"):
+                result = ev["data"].get("output")
+                output = result.get("output") if isinstance(result, dict) else None
+        _agent_rounds.observe(rounds[0])
+        _request_ms("agent", started)
+        self._cache_store(cache_key, output, tools)
+
+def _chunk_text(chunk) -> str:
+    content = getattr(chunk, "content", None)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        # Gemini may return a list of parts
+        return "".join(p if isinstance(p, str) else p.get("text", "") for p in content if isinstance(p, (str, dict)))
+    return ""
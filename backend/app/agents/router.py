@@ -0,0 +1,185 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+import re, threading
+import numpy as np
+
+from app.config import settings
+from app.services.rag import embed_query
+
+# Picks a tool for questions whose intent is obvious, so the agent can skip the
+# tool-selection LLM call and only phrase the result. Keyword rules decide the
+# clear cases; a nearest-centroid classifier over the E5 embedding of a few
+# example questions per intent decides the rest. Anything uncertain returns
+# None and goes through the full agent.
+
+_WEATHER_WORDS = re.compile(
+    r"\b(weather|forecast|temperature|humidity|rain(?!-?fed)\w*)\b"
+    r"|मौसम|बारिश|तापमान|नमी|बरसात", re.IGNORECASE)
+# Current-conditions cues: a weather word alone also fits agronomy questions
+# ("Which wheat tolerates high temperature in Punjab?").
+_NOW_WORDS = re.compile(
+    r"\b(today|tonight|tomorrow|now|currently|current|this (?:week|morning|evening|afternoon)|next \d* ?days?|"
+    r"forecast|weather)\b|आज|कल|अभी|इस हफ्ते|मौसम", re.IGNORECASE)
+_DISEASE_WORDS = re.compile(
+    r"\b(disease|diseased|infect\w*|blight|rust|mildew|rot|spots?|lesions?|pest|fungus|fungal|yellowing|wilt\w*|"
+    r"leaf|leaves|what is (this|wrong)|identify)\b"
+    r"|रोग|बीमारी|पत्त|धब्बे|कीट|फफूंद", re.IGNORECASE)
+# \w misses Indic vowel signs (category Mc/Mn), so allow the Indic blocks explicitly.
+_WORD = r"[^\W\d][\w\u0900-\u0dff.'-]*"
+_CITY_AFTER = re.compile(
+    rf"\b(?:in|at|for|near)\s+(?!the\b|my\b|this\b|next\b|coming\b)({_WORD}(?:\s+{_WORD}){{0,2}}?)"
+    r"\s*(?=$|[?.!,;]|\s+(?:today|tomorrow|tonight|now|right now|this|next|currently|like)\b)", re.IGNORECASE)
+_CITY_BEFORE_HI = re.compile(rf"({_WORD})\s+(?:में|का|के|की)\s+(?:आज\s+|कल\s+)?(?:मौसम|तापमान|बारिश)")
+_CONTEXT_LOCATION = re.compile(r"(?:location|city|district|village|town|place)\s*[:=-]\s*([^\n,;]+)", re.IGNORECASE)
+_USER_CONTEXT = re.compile(r"^\[User context\]\n(.*?)\n\[/User context\]\n\n", re.DOTALL)
+
+_PROTOTYPES = {
+    "weather": [
+        "What is the weather in Nashik today?",
+        "Will it rain in Ludhiana tomorrow?",
+        "Current temperature and humidity in my village",
+        "Is it going to be hot this week in Nagpur?",
+        "आज पटना में मौसम कैसा है?",
+        "क्या कल बारिश होगी?",
+    ],
+    "disease": [
+        "What disease does this leaf have?",
+        "My tomato leaves have brown spots, what is wrong?",
+        "Is my crop infected? Please check the photo",
+        "Identify the problem in this plant image",
+        "इस पत्ती में कौन सा रोग है?",
+        "मेरी फसल की पत्तियां पीली हो रही हैं, क्या बीमारी है?",
+    ],
+    "kb": [
+        "What is the recommended fertilizer dose for wheat?",
+        "When should I sow mustard in Rajasthan?",
+        "How much irrigation does sugarcane need?",
+        "Which government schemes support drip irrigation?",
+        "How do I control stem borer in paddy?",
+        "What is the seed rate for soybean per acre?",
+        "धान की रोपाई का सही समय क्या है?",
+        "गेहूं में यूरिया कितनी डालनी चाहिए?",
+    ],
+    "other": [
+        "Hello, how are you?",
+        "Thank you",
+        "What about that?",
+        "Can you explain it again?",
+        "Who won the cricket match yesterday?",
+        "Tell me a joke",
+        "नमस्ते",
+        "धन्यवाद",
+    ],
+}
+
+@dataclass
+class Route:
+    intent: str
+    calls: list[tuple[str, dict]] = field(default_factory=list)  # (tool name, args), run concurrently
+    reason: str = ""
+
+def strip_user_context(text: str) -> tuple[str, str]:
+    """(question, user context) from a message built by main._with_user_context."""
+    m = _USER_CONTEXT.match(text or "")
+    if not m:
+        return text or "", ""
+    return text[m.end():], m.group(1)
+
+def extract_city(question: str, context: str = "") -> Optional[str]:
+    m = _CITY_AFTER.search(question) or _CITY_BEFORE_HI.search(question) or _CONTEXT_LOCATION.search(context)
+    if not m:
+        return None
+    city = m.group(1).strip(" .'\"")
+    return city or None
+
+def _unit(vec: np.ndarray) -> np.ndarray:
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+class IntentRouter:
+    def __init__(self, embed: Callable[[str], np.ndarray], min_similarity: float, min_margin: float) -> None:
+        self.embed = embed
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self._labels: list[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _fit(self) -> np.ndarray:
+        if self._centroids is None:
+            with self._lock:
+                if self._centroids is None:
+                    labels, rows = [], []
+                    for label, examples in _PROTOTYPES.items():
+                        labels.append(label)
+                        rows.append(_unit(np.mean([_unit(self.embed(t)) for t in examples], axis=0)))
+                    self._labels = labels
+                    self._centroids = np.stack(rows)
+        return self._centroids
+
+    def classify(self, text: str) -> tuple[str, float, float]:
+        """(intent, similarity, margin over the runner-up intent)."""
+        scores = self._fit() @ _unit(self.embed(text))
+        order = np.argsort(scores)[::-1]
+        best, second = float(scores[order[0]]), float(scores[order[1]])
+        return self._labels[int(order[0])], best, best - second
+
+    def _confident(self, text: str) -> Optional[str]:
+        intent, score, margin = self.classify(text)
+        if score >= self.min_similarity and margin >= self.min_margin:
+            return intent
+        return None
+
+    def route(self, text: str, n_images: int = 0) -> Optional[Route]:
+        question, context = strip_user_context(text)
+        weather_kw = bool(_WEATHER_WORDS.search(question))
+        if n_images:
+            if weather_kw:
+                return None
+            if _DISEASE_WORDS.search(question):
+                reason = "keywords"
+            elif self._confident(question) == "disease":
+                reason = "classifier"
+            else:
+                return None
+            return Route("disease", [("classify_crop_disease", {"image_idx": i}) for i in range(n_images)], reason)
+        if weather_kw:
+            city = extract_city(question, context)
+            if city is None or _DISEASE_WORDS.search(question):
+                return None
+            intent = self._confident(question)
+            if intent == "weather":
+                return Route("weather", [("get_weather", {"city": city})], "classifier")
+            if intent is None and _NOW_WORDS.search(question):
+                return Route("weather", [("get_weather", {"city": city})], "keywords")
+            return None
+        if len(question.split()) < 3:
+            return None  # greetings and follow-ups ("and for wheat?") need the conversation
+        intent = self._confident(question)
+        if intent == "weather":
+            city = extract_city(question, context)
+            return Route("weather", [("get_weather", {"city": city})], "classifier") if city else None
+        if intent == "kb":
+            return Route("kb", [("rag_search", {"query": question})], "classifier")
+        return None
+
+_router: Optional[IntentRouter] = None
+_router_lock = threading.Lock()
+
+def get_router() -> Optional[IntentRouter]:
+    """The process-wide router, or None when ROUTER_ENABLED is off."""
+    global _router
+    if not settings.ROUTER_ENABLED:
+        return None
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = IntentRouter(embed_query, settings.ROUTER_MIN_SIMILARITY, settings.ROUTER_MIN_MARGIN)
+    return _router
+
+def warm_up() -> None:
+    router = get_router()
+    if router is not None:
+        router._fit()
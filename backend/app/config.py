@@ -1,13 +1,25 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-import os
+import os, tempfile
 
 class Settings(BaseSettings):
     # LLM
-    USE_LLM: str = os.getenv("USE_LLM", "gemini")
+    USE_LLM: str = os.getenv("USE_LLM", "gemini")  # gemini|ollama|fake (offline, for load tests)
     GEMINI_API_KEY: str | None = os.getenv("GEMINI_API_KEY")
     GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
     OLLAMA_BASE_URL: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
     OLLAMA_MODEL: str = os.getenv("OLLAMA_MODEL", "llama3.1")
+    OLLAMA_KEEP_ALIVE: str = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # keep the model loaded between calls
+    GEMINI_CONCURRENCY: int = int(os.getenv("GEMINI_CONCURRENCY", "8"))  # in-flight calls per provider
+    OLLAMA_CONCURRENCY: int = int(os.getenv("OLLAMA_CONCURRENCY", "2"))
+    LLM_TIMEOUT_S: float = float(os.getenv("LLM_TIMEOUT_S", "60"))
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "3"))  # on 429/5xx/timeouts, before any token is streamed
+    LLM_RETRY_BASE_S: float = float(os.getenv("LLM_RETRY_BASE_S", "0.5"))
+    LLM_RETRY_MAX_S: float = float(os.getenv("LLM_RETRY_MAX_S", "8"))
+    LLM_SINGLEFLIGHT: bool = os.getenv("LLM_SINGLEFLIGHT", "true").lower() in ("1","true","yes")  # share identical in-flight calls
+    FAKE_LLM_LATENCY_MS: float = float(os.getenv("FAKE_LLM_LATENCY_MS", "300"))  # before the first token
+    FAKE_LLM_TOKENS_PER_S: float = float(os.getenv("FAKE_LLM_TOKENS_PER_S", "50"))
+    FAKE_LLM_ANSWER_TOKENS: int = int(os.getenv("FAKE_LLM_ANSWER_TOKENS", "60"))
+    FAKE_LLM_CONCURRENCY: int = int(os.getenv("FAKE_LLM_CONCURRENCY", "64"))
 
     # Pinecone
     PINECONE_API_KEY: str | None = os.getenv("PINECONE_API_KEY")
@@ -16,8 +28,29 @@ class Settings(BaseSettings):
     PINECONE_CLOUD: str = os.getenv("PINECONE_CLOUD", "aws")  # aws|gcp|azure
     PINECONE_REGION: str = os.getenv("PINECONE_REGION", "us-east-1")
 
+    # Vector store backend: pinecone | local (memory-mapped index on disk)
+    VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "pinecone")
+    LOCAL_INDEX_DIR: str = os.getenv("LOCAL_INDEX_DIR", "./data/local_index")
+    LOCAL_INDEX_DTYPE: str = os.getenv("LOCAL_INDEX_DTYPE", "float32")  # float32|int8
+
     # Embeddings
     EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "intfloat/multilingual-e5-base")
+    EMBEDDING_ENGINE: str = os.getenv("EMBEDDING_ENGINE", "eager")  # eager|int8|torchscript, or hf (sentence-transformers wrapper)
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))  # documents per forward pass
+    EMBEDDING_MAX_LENGTH: int = int(os.getenv("EMBEDDING_MAX_LENGTH", "512"))  # tokens
+    # E5 prefixes ("query: " / "passage: "); off by default to match indexes built without them
+    EMBEDDING_QUERY_PREFIX: str = os.getenv("EMBEDDING_QUERY_PREFIX", "")
+    EMBEDDING_PASSAGE_PREFIX: str = os.getenv("EMBEDDING_PASSAGE_PREFIX", "")
+    EMBEDDING_QUERY_BATCH_MAX_SIZE: int = int(os.getenv("EMBEDDING_QUERY_BATCH_MAX_SIZE", "16"))  # 1 disables
+    EMBEDDING_QUERY_BATCH_MAX_WAIT_MS: float = float(os.getenv("EMBEDDING_QUERY_BATCH_MAX_WAIT_MS", "2"))
+    RAG_WARM_ON_STARTUP: bool = os.getenv("RAG_WARM_ON_STARTUP", "true").lower() in ("1","true","yes")
+
+    # RAG caches (query -> embedding, (query, k, namespace) -> matches)
+    RAG_QUERY_CACHE_SIZE: int = int(os.getenv("RAG_QUERY_CACHE_SIZE", "4096"))
+    RAG_QUERY_CACHE_TTL_S: float = float(os.getenv("RAG_QUERY_CACHE_TTL_S", "86400"))
+    RAG_RESULT_CACHE_SIZE: int = int(os.getenv("RAG_RESULT_CACHE_SIZE", "2048"))
+    RAG_RESULT_CACHE_TTL_S: float = float(os.getenv("RAG_RESULT_CACHE_TTL_S", "3600"))
+    RAG_CACHE_DIR: str = os.getenv("RAG_CACHE_DIR", os.path.join(tempfile.gettempdir(), "krishisevak-rag-cache"))
 
     # Weather
     WEATHER_PROVIDER: str = os.getenv("WEATHER_PROVIDER", "open-meteo")
@@ -25,10 +58,24 @@ class Settings(BaseSettings):
     # Speech
     WHISPER_CPP_BIN: str = os.getenv("WHISPER_CPP_BIN", "/opt/whisper.cpp/build/bin/whisper-cli")
     WHISPER_MODEL_PATH: str = os.getenv("WHISPER_MODEL_PATH", "/opt/whisper.cpp/models/ggml-base.en.bin")
+    WHISPER_SERVER_BIN: str = os.getenv("WHISPER_SERVER_BIN", "/opt/whisper.cpp/build/bin/whisper-server")
+    STT_WORKERS: int = int(os.getenv("STT_WORKERS", "2"))  # resident whisper-server processes; 0 = whisper-cli per request
+    STT_WORKER_BASE_PORT: int = int(os.getenv("STT_WORKER_BASE_PORT", "0"))  # 0 = any free port
+    STT_WORKER_THREADS: int = int(os.getenv("STT_WORKER_THREADS", "4"))
+    STT_WORKER_START_TIMEOUT_S: float = float(os.getenv("STT_WORKER_START_TIMEOUT_S", "60"))
+    VAD_MODE: str = os.getenv("VAD_MODE", "energy")  # energy|webrtc (needs webrtcvad)
+    VAD_AGGRESSIVENESS: int = int(os.getenv("VAD_AGGRESSIVENESS", "2"))  # webrtc 0-3
+    VAD_ENERGY_THRESHOLD_DB: float = float(os.getenv("VAD_ENERGY_THRESHOLD_DB", "-45"))
+    VAD_SEGMENT_SILENCE_MS: int = int(os.getenv("VAD_SEGMENT_SILENCE_MS", "300"))  # pause that flushes a partial
+    VAD_END_SILENCE_MS: int = int(os.getenv("VAD_END_SILENCE_MS", "900"))  # silence that ends the utterance
+    VAD_MAX_SEGMENT_MS: int = int(os.getenv("VAD_MAX_SEGMENT_MS", "8000"))
     FFMPEG_BIN: str = os.getenv("FFMPEG_BIN", "ffmpeg")
     ESPEAK_BIN: str = os.getenv("ESPEAK_BIN", "espeak-ng")
     TTS_VOICE: str = os.getenv("TTS_VOICE", "en-us")
     TTS_SPEED_WPM: int = int(os.getenv("TTS_SPEED_WPM", "170"))
+    VOICE_STREAM_TTS_PARALLEL: int = int(os.getenv("VOICE_STREAM_TTS_PARALLEL", "3"))  # sentences synthesized at once per reply
+    TTS_CACHE_DIR: str = os.getenv("TTS_CACHE_DIR", "./data/tts_cache")
+    TTS_CACHE_MAX_BYTES: int = int(os.getenv("TTS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
 
     # Online STT/TTS providers
     STT_PROVIDER: str = os.getenv("STT_PROVIDER", "local")  # local|openai
@@ -45,6 +92,80 @@ class Settings(BaseSettings):
     # ViT
     VIT_MODEL_DIR: str = os.getenv("VIT_MODEL_DIR", "./models/vit-crop-disease")
     VIT_LABELS_JSON: str = os.getenv("VIT_LABELS_JSON", "./models/vit-crop-disease/labels.json")
+    VIT_ENGINE: str = os.getenv("VIT_ENGINE", "eager")  # eager|int8|torchscript (see app.vit_convert)
+    VIT_NUM_THREADS: int = int(os.getenv("VIT_NUM_THREADS", "0"))  # intra-op; 0 = torch default
+    VIT_INTEROP_THREADS: int = int(os.getenv("VIT_INTEROP_THREADS", "0"))
+    # Dynamic micro-batching of concurrent classifications (1 disables)
+    VIT_BATCH_MAX_SIZE: int = int(os.getenv("VIT_BATCH_MAX_SIZE", "8"))
+    VIT_BATCH_MAX_WAIT_MS: float = float(os.getenv("VIT_BATCH_MAX_WAIT_MS", "5"))
+
+    # Chat session history: memory (per-process LRU+TTL) | sqlite (shared, WAL)
+    SESSION_STORE: str = os.getenv("SESSION_STORE", "memory")
+    SESSION_HISTORY_WINDOW: int = int(os.getenv("SESSION_HISTORY_WINDOW", "20"))  # messages fed to the LLM; 0 = all
+    SESSION_TTL_S: float = float(os.getenv("SESSION_TTL_S", "86400"))
+    SESSION_MAX_SESSIONS: int = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+    SESSION_MAX_BYTES: int = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+    SESSION_MAX_MESSAGES: int = int(os.getenv("SESSION_MAX_MESSAGES", "200"))  # per session, memory store
+    SESSION_SQLITE_PATH: str = os.getenv("SESSION_SQLITE_PATH", "./data/sessions.db")
+    SESSION_FLUSH_INTERVAL_MS: float = float(os.getenv("SESSION_FLUSH_INTERVAL_MS", "200"))
+
+    # Chat image attachments
+    ATTACHMENT_MAX_BYTES: int = int(os.getenv("ATTACHMENT_MAX_BYTES", str(256 * 1024 * 1024)))
+    ATTACHMENT_TTL_S: float = float(os.getenv("ATTACHMENT_TTL_S", "1800"))
+    ATTACHMENT_SPILL: bool = os.getenv("ATTACHMENT_SPILL", "false").lower() in ("1","true","yes")
+    ATTACHMENT_SPILL_MAX_BYTES: int = int(os.getenv("ATTACHMENT_SPILL_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+    # Web ingestion (python -m app.ingest)
+    INGEST_MANIFEST_PATH: str = os.getenv("INGEST_MANIFEST_PATH", "./data/ingest_manifest.json")
+    INGEST_FETCH_CONCURRENCY: int = int(os.getenv("INGEST_FETCH_CONCURRENCY", "8"))
+    INGEST_EMBED_BATCH: int = int(os.getenv("INGEST_EMBED_BATCH", "64"))
+
+    # Weather tool (Open-Meteo)
+    WEATHER_GEOCODE_URL: str = os.getenv("WEATHER_GEOCODE_URL", "https://geocoding-api.open-meteo.com/v1/search")
+    WEATHER_FORECAST_URL: str = os.getenv("WEATHER_FORECAST_URL", "https://api.open-meteo.com/v1/forecast")
+    WEATHER_GEOCODE_CACHE_PATH: str = os.getenv("WEATHER_GEOCODE_CACHE_PATH", "./data/geocode.db")
+    WEATHER_FORECAST_TTL_S: float = float(os.getenv("WEATHER_FORECAST_TTL_S", "900"))
+    WEATHER_COORD_PRECISION: int = int(os.getenv("WEATHER_COORD_PRECISION", "2"))  # decimals; 2 ~ 1 km
+    WEATHER_PREFETCH_INTERVAL_S: float = float(os.getenv("WEATHER_PREFETCH_INTERVAL_S", "600"))  # 0 disables
+    WEATHER_PREFETCH_TOP_N: int = int(os.getenv("WEATHER_PREFETCH_TOP_N", "50"))
+    WEATHER_PREFETCH_BATCH: int = int(os.getenv("WEATHER_PREFETCH_BATCH", "25"))  # coordinates per request
+
+    # Intent router: call an obvious tool directly, one LLM call to phrase the result
+    ROUTER_ENABLED: bool = os.getenv("ROUTER_ENABLED", "true").lower() in ("1","true","yes")
+    ROUTER_MIN_SIMILARITY: float = float(os.getenv("ROUTER_MIN_SIMILARITY", "0.80"))  # to the intent centroid
+    ROUTER_MIN_MARGIN: float = float(os.getenv("ROUTER_MIN_MARGIN", "0.03"))  # over the runner-up intent
+
+    # Semantic answer cache in front of the agent (session-independent answers only)
+    ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() in ("1","true","yes")
+    ANSWER_CACHE_SIZE: int = int(os.getenv("ANSWER_CACHE_SIZE", "2048"))
+    ANSWER_CACHE_TTL_S: float = float(os.getenv("ANSWER_CACHE_TTL_S", "86400"))
+    ANSWER_CACHE_THRESHOLD: float = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # cosine similarity
+    ANSWER_CACHE_BYPASS_TOOLS: str = os.getenv("ANSWER_CACHE_BYPASS_TOOLS", "get_weather,classify_crop_disease")
+    ANSWER_CACHE_BYPASS_PATTERN: str = os.getenv(
+        "ANSWER_CACHE_BYPASS_PATTERN",
+        r"\b(today|tonight|tomorrow|yesterday|now|this week|weather|forecast|rain|temperature|price|rate)\b"
+        r"|आज|कल|अभी|मौसम|बारिश|तापमान|भाव")
+    ANSWER_CACHE_FIRST_TURN_ONLY: bool = os.getenv("ANSWER_CACHE_FIRST_TURN_ONLY", "true").lower() in ("1","true","yes")
+
+    # Start-up warm-up (components: rag, router, agent, vit, stt); /v1/ready turns 200 when done
+    WARMUP_COMPONENTS: str = os.getenv("WARMUP_COMPONENTS", "rag,router,agent,vit,stt")
+    WARMUP_CONCURRENCY: int = int(os.getenv("WARMUP_CONCURRENCY", "4"))  # components warmed in parallel
+    WARMUP_BLOCKING: bool = os.getenv("WARMUP_BLOCKING", "false").lower() in ("1","true","yes")  # hold startup until warm
+    # Models the gunicorn master loads before forking workers (gunicorn_conf.py): vit, embeddings
+    PRELOAD_MODELS: str = os.getenv("PRELOAD_MODELS", "vit,embeddings")
+
+    # Concurrency limits for blocking work offloaded from the event loop
+    AGENT_CONCURRENCY: int = int(os.getenv("AGENT_CONCURRENCY", "16"))
+    STT_CONCURRENCY: int = int(os.getenv("STT_CONCURRENCY", "2"))
+    TTS_CONCURRENCY: int = int(os.getenv("TTS_CONCURRENCY", "4"))
+    VIT_CONCURRENCY: int = int(os.getenv("VIT_CONCURRENCY", "8"))
+    TOOL_CONCURRENCY: int = int(os.getenv("TOOL_CONCURRENCY", "8"))  # tool calls of one agent step run in parallel
+
+    # Observability: Prometheus text on /v1/metrics, trace IDs in logs
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() in ("1","true","yes")
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    TRACE_ID_HEADER: str = os.getenv("TRACE_ID_HEADER", "X-Request-ID")  # reused when the client sends one
+    SLOW_REQUEST_MS: float = float(os.getenv("SLOW_REQUEST_MS", "5000"))  # log a stage breakdown; 0 disables
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
@@ -1,38 +1,197 @@
 from __future__ import annotations
-import argparse
-from langchain_community.document_loaders import AsyncHtmlLoader, PlaywrightURLLoader
+import argparse, asyncio, hashlib, json, os, re, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import httpx
+from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from app.services.rag import _embeddings, ensure_index_exists
-from langchain_pinecone import PineconeVectorStore
+from app.services.rag import (commit_writes, delete_ids, embed_documents, embedding_fingerprint, ensure_index_exists,
+                              upsert_vectors)
 from app.config import settings
 
-def ingest(urls: list[str], use_playwright: bool = False):
+# The manifest remembers, per target index/namespace and URL, the validators
+# from the last fetch and the ids of the chunks we stored, so reruns only
+# embed new or changed chunks and delete the ones that disappeared:
+#   {"<backend>:<index>:<namespace>[:<embedding>]": {"<url>": {"etag", "last_modified", "chunks": [...]}}}
+# The embedding fingerprint (model, precision, E5 prefixes) is part of the key:
+# after changing any of them the target starts empty, every page is fetched and
+# re-embedded, and chunks only listed under the old key are deleted.
+
+def _target_key(namespace: str) -> str:
+    backend = settings.VECTOR_BACKEND.lower()
+    where = settings.LOCAL_INDEX_DIR if backend == "local" else settings.PINECONE_INDEX
+    fingerprint = embedding_fingerprint()
+    return f"{backend}:{where}:{namespace}" + (f":{fingerprint}" if fingerprint else "")
+
+def _stale_targets(manifest: dict, namespace: str) -> list[str]:
+    """Keys for the same index and namespace written with another embedding."""
+    backend = settings.VECTOR_BACKEND.lower()
+    where = settings.LOCAL_INDEX_DIR if backend == "local" else settings.PINECONE_INDEX
+    same_target = re.compile(re.escape(f"{backend}:{where}:{namespace}") + r"(:[0-9a-f]{12})?")
+    current = _target_key(namespace)
+    return [k for k in manifest if k != current and same_target.fullmatch(k)]
+
+def load_manifest(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_manifest(path: str, manifest: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+def chunk_id(source: str, text: str) -> str:
+    """Stable id from the page and the chunk's content: unchanged chunks keep
+    their id across runs, so re-upserting one is a no-op."""
+    return hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()[:40]
+
+async def _fetch_one(client: httpx.AsyncClient, sem: asyncio.Semaphore, url: str, prev: dict) -> tuple[str, Optional[Document], dict]:
+    headers = {}
+    if prev.get("etag"):
+        headers["If-None-Match"] = prev["etag"]
+    if prev.get("last_modified"):
+        headers["If-Modified-Since"] = prev["last_modified"]
+    async with sem:
+        try:
+            r = await client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            return "error", None, {"error": str(e)}
+    if r.status_code == 304:
+        return "not_modified", None, {}
+    if r.status_code >= 400:
+        return "error", None, {"error": f"HTTP {r.status_code}"}
+    validators = {"etag": r.headers.get("etag"), "last_modified": r.headers.get("last-modified")}
+    return "ok", Document(page_content=r.text, metadata={"source": url}), validators
+
+async def fetch_all(urls: list[str], manifest_entries: dict, concurrency: int) -> list[tuple[str, str, Optional[Document], dict]]:
+    sem = asyncio.Semaphore(max(1, concurrency))
+    limits = httpx.Limits(max_connections=max(1, concurrency))
+    async with httpx.AsyncClient(timeout=30.0, follow_redirects=True, limits=limits) as client:
+        results = await asyncio.gather(*(_fetch_one(client, sem, u, manifest_entries.get(u, {})) for u in urls))
+    return [(u, *res) for u, res in zip(urls, results)]
+
+def _fetch_playwright(urls: list[str]) -> list[tuple[str, str, Optional[Document], dict]]:
+    from langchain_community.document_loaders import PlaywrightURLLoader
+    docs = {d.metadata.get("source"): d for d in PlaywrightURLLoader(urls=urls).load()}
+    return [(u, "ok", docs[u], {}) if u in docs else (u, "error", None, {"error": "not loaded"}) for u in urls]
+
+def _write_batches(items: list[tuple[str, Document]], namespace: str, batch_size: int) -> None:
+    # Embed batch N+1 while batch N is being upserted. Passages of similar length
+    # go in the same batch, so the embedder pads each batch to little beyond its texts.
+    items = sorted(items, key=lambda item: len(item[1].page_content))
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-upsert") as upserter:
+        inflight = None
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            texts = [d.page_content for _, d in batch]
+            vecs = embed_documents(texts)
+            if inflight is not None:
+                inflight.result()
+            inflight = upserter.submit(upsert_vectors, [i for i, _ in batch], vecs, texts,
+                                       [d.metadata for _, d in batch], namespace)
+        if inflight is not None:
+            inflight.result()
+
+def ingest(urls: list[str], use_playwright: bool = False, dry_run: bool = False, prune: bool = False,
+           concurrency: Optional[int] = None, batch_size: Optional[int] = None,
+           manifest_path: Optional[str] = None, namespace: Optional[str] = None) -> dict:
+    ns = namespace or settings.PINECONE_NAMESPACE
+    manifest_path = manifest_path or settings.INGEST_MANIFEST_PATH
+    concurrency = concurrency or settings.INGEST_FETCH_CONCURRENCY
+    batch_size = batch_size or settings.INGEST_EMBED_BATCH
+    manifest = load_manifest(manifest_path)
+    entries: dict = manifest.setdefault(_target_key(ns), {})
+    stale = _stale_targets(manifest, ns)
+    t0 = time.perf_counter()
+
     # Load docs
     if use_playwright:
-        loader = PlaywrightURLLoader(urls=urls)
-        docs = loader.load()
+        fetched = _fetch_playwright(urls)
     else:
-        loader = AsyncHtmlLoader(urls)
-        docs = loader.load()
+        fetched = asyncio.run(fetch_all(urls, entries, concurrency))
 
-    # Split
+    # Split, and diff chunk ids against the manifest
     splitter = RecursiveCharacterTextSplitter(chunk_size=1200, chunk_overlap=150)
-    chunks = splitter.split_documents(docs)
-
-    # Ensure index exists and upsert
-    ensure_index_exists()
-    emb = _embeddings()
-    PineconeVectorStore.from_documents(
-        documents=chunks,
-        embedding=emb,
-        index_name=settings.PINECONE_INDEX,
-        namespace=settings.PINECONE_NAMESPACE,
-    )
-    print(f"Ingested {len(chunks)} chunks into Pinecone index '{settings.PINECONE_INDEX}' namespace '{settings.PINECONE_NAMESPACE}'.")
+    to_write: list[tuple[str, Document]] = []
+    to_delete: list[str] = []
+    new_entries: dict[str, dict] = {}
+    report = {"unchanged_pages": 0, "failed_pages": 0, "new_chunks": 0, "kept_chunks": 0, "deleted_chunks": 0, "pages": {}}
+    for url, status, doc, validators in fetched:
+        if status != "ok":
+            key = "unchanged_pages" if status == "not_modified" else "failed_pages"
+            report[key] += 1
+            report["pages"][url] = validators.get("error", status)
+            continue
+        old_ids = set(entries.get(url, {}).get("chunks", []))
+        ids: list[str] = []
+        for chunk in splitter.split_documents([doc]):
+            cid = chunk_id(url, chunk.page_content)
+            if cid in ids:
+                continue
+            ids.append(cid)
+            if cid not in old_ids:
+                to_write.append((cid, chunk))
+        gone = sorted(old_ids - set(ids))
+        to_delete += gone
+        for key in stale:
+            # Re-embedded under the current embedding: drop what the old one stored.
+            prev = manifest[key].pop(url, None)
+            if prev:
+                to_delete += sorted(set(prev.get("chunks", [])) - set(ids) - set(gone))
+        added = sum(1 for i in ids if i not in old_ids)
+        report["new_chunks"] += added
+        report["kept_chunks"] += len(ids) - added
+        report["pages"][url] = f"+{added} -{len(gone)} ={len(ids) - added}"
+        new_entries[url] = {**validators, "chunks": ids}
+    if prune:
+        for url in sorted(set(entries) - set(urls)):
+            to_delete += entries[url].get("chunks", [])
+            report["pages"][url] = f"pruned -{len(entries[url].get('chunks', []))}"
+        for key in stale:
+            for url in sorted(set(manifest[key]) - set(urls)):
+                to_delete += manifest[key].pop(url).get("chunks", [])
+    report["deleted_chunks"] = len(to_delete)
+
+    if not dry_run and (to_write or to_delete):
+        ensure_index_exists()
+        _write_batches(to_write, ns, batch_size)
+        if to_delete:
+            delete_ids(to_delete, ns)
+        commit_writes(ns)
+    if not dry_run:
+        entries.update(new_entries)
+        if prune:
+            for url in set(entries) - set(urls):
+                del entries[url]
+        for key in stale:
+            if not manifest[key]:
+                del manifest[key]
+        save_manifest(manifest_path, manifest)
+    report["seconds"] = round(time.perf_counter() - t0, 2)
+    return report
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--urls", nargs="+", required=True)
     parser.add_argument("--playwright", action="store_true")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--prune", action="store_true", help="delete chunks of manifest URLs not given in --urls")
+    parser.add_argument("--concurrency", type=int, default=None, help="parallel fetches (INGEST_FETCH_CONCURRENCY)")
+    parser.add_argument("--batch-size", type=int, default=None, help="chunks per embedding batch (INGEST_EMBED_BATCH)")
+    parser.add_argument("--manifest", default=None, help="manifest path (INGEST_MANIFEST_PATH)")
     args = parser.parse_args()
-    ingest(args.urls, use_playwright=args.playwright)
+    report = ingest(args.urls, use_playwright=args.playwright, dry_run=args.dry_run, prune=args.prune,
+                    concurrency=args.concurrency, batch_size=args.batch_size, manifest_path=args.manifest)
+    for url, change in report.pop("pages").items():
+        print(f"  {change:>16}  {url}")
+    target = settings.LOCAL_INDEX_DIR if settings.VECTOR_BACKEND.lower() == "local" else f"Pinecone index '{settings.PINECONE_INDEX}'"
+    would = "would be " if args.dry_run else ""
+    print(f"{report['new_chunks']} chunks {would}embedded, {report['deleted_chunks']} {would}deleted, "
+          f"{report['kept_chunks']} unchanged ({report['unchanged_pages']} pages not modified, "
+          f"{report['failed_pages']} failed) in {target} namespace '{settings.PINECONE_NAMESPACE}' "
+          f"[{report['seconds']}s].")
@@ -1,15 +1,35 @@
 from __future__ import annotations
-import base64, os, tempfile
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import base64, logging, threading, json, time, asyncio, weakref
+from typing import TYPE_CHECKING, AsyncIterator
+from urllib.parse import quote
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from sse_starlette.sse import EventSourceResponse
 
+from app.config import settings
 from app.schemas import ChatRequest, ChatResponse, ImageClassifyResponse
-from app.agents.independent_agent import IndependentAgent
-from app.services.stt import transcribe
-from app.services.tts import synthesize_to_wav
-from app.tools.vit import classify_crop_disease as classify_crop_disease_direct
+from app.agents import router
+from app.services import rag
+from app.services.executors import run_blocking, iterate_blocking, limiter, shutdown as shutdown_executors
+from app.services import metrics
+from app.services.metrics import histogram
+from app.services.tracing import TracingMiddleware, setup_logging
+from app.services.stt import SAMPLE_RATE, spawn_pcm_decoder, transcribe_pcm, transcribe_timed
+from app.services.vad import SpeechSegmenter
+from app.services import warmup, whisper_pool
+from app.services.tts import SentenceSplitter, read_wav, streaming_wav_header, synthesize_bytes, synthesize_stream
+from app.tools.vit import classify_image, load_weights as load_vit_weights, warm_up as warm_up_vit
+from app.tools import weather
+
+if TYPE_CHECKING:
+    # Imported in get_agent(): langchain.agents alone takes seconds to import.
+    from app.agents.independent_agent import IndependentAgent
 
 app = FastAPI(title="Agentic AI Backend (Pinecone)", version="0.3.0")
 
@@ -19,90 +39,425 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[settings.TRACE_ID_HEADER],
 )
+# Outermost, so the trace ID and timings cover CORS handling too.
+app.add_middleware(TracingMiddleware)
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+def _start_stt_workers() -> None:
+    # Load the whisper model(s) now rather than on the first voice request.
+    if (settings.STT_PROVIDER or "local").lower() == "local" or settings.STT_FALLBACK_LOCAL_ON_ERROR:
+        whisper_pool.get_whisper_pool()
+
+warmup.register("rag", rag.warm_up)  # E5 model + index handle
+warmup.register("router", router.warm_up, after=("rag",))
+warmup.register("agent", lambda: get_agent())  # langchain agent stack + LLM client
+warmup.register("vit", warm_up_vit)
+warmup.register("stt", _start_stt_workers)
+warmup.register_preload("vit", load_vit_weights)
+warmup.register_preload("embeddings", rag.load_embeddings)
+
+def _warmup_components() -> list[str]:
+    names = [n.strip() for n in settings.WARMUP_COMPONENTS.split(",") if n.strip()]
+    if not settings.RAG_WARM_ON_STARTUP:
+        names = [n for n in names if n not in ("rag", "router")]
+    return names
+
+_warmup_task: asyncio.Task | None = None
+
+@app.on_event("startup")
+async def _warm_up():
+    # Every component also initialises lazily, so serving can start before
+    # warm-up ends; /v1/ready tells the load balancer when it has.
+    global _warmup_task
+    _warmup_task = asyncio.create_task(warmup.run(_warmup_components(), settings.WARMUP_CONCURRENCY))
+    if settings.WARMUP_BLOCKING:
+        await _warmup_task
+
+@app.on_event("startup")
+async def _start_weather_prefetch():
+    weather.start_prefetcher()
+
+@app.on_event("shutdown")
+async def _shutdown_pools():
+    warmup.stopping()
+    weather.stop_prefetcher()
+    whisper_pool.shutdown()
+    shutdown_executors()
 
 _agent: IndependentAgent | None = None
+_agent_lock = threading.Lock()
 
 def get_agent() -> IndependentAgent:
     global _agent
     if _agent is None:
-        _agent = IndependentAgent()
+        with _agent_lock:
+            if _agent is None:
+                from app.agents.independent_agent import IndependentAgent
+                _agent = IndependentAgent()
     return _agent
 
+def _respond(**kwargs) -> dict:
+    return get_agent().respond(**kwargs)
+
+_ttfa_ms = histogram("voice_stream_ttfa_ms", (250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+                     "Time from /v1/voice/stream request to the first audio byte")
+_ttft_ms = histogram("chat_stream_ttft_ms", (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+                     "Time from /v1/chat stream request to first LLM token")
+
+def _with_user_context(message: str, user_context: str | None) -> str:
+    # Prepend one-time user context to first message in a session
+    if user_context:
+        return f"[User context]\n{user_context}\n[/User context]\n\n{message}"
+    return message
+
 @app.get("/v1/health")
-def health():
+async def health():
     return {"status":"ok"}
 
-@app.post("/v1/chat")
-async def chat(req: ChatRequest):
+@app.get("/v1/ready")
+async def ready():
+    # Liveness is /v1/health; this one is for readiness probes and load balancers.
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+if settings.METRICS_ENABLED:
+    @app.get("/v1/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        # Collectors read component stats() under short locks; render off the loop anyway.
+        body = await run_in_threadpool(metrics.render)
+        return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+_CHAT_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": ChatRequest.model_json_schema()},
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["message"],
+                    "properties": {
+                        "session_id": {"type": "string", "default": "default"},
+                        "message": {"type": "string"},
+                        "stream": {"type": "boolean", "default": False},
+                        "user_context": {"type": "string"},
+                        "images": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                    },
+                }
+            },
+        },
+    }
+}
+
+def _form_bool(value) -> bool:
+    return str(value or "").strip().lower() in ("1", "true", "yes", "on")
+
+async def _read_chat_request(request: Request) -> tuple[ChatRequest, list[bytes]]:
+    """Parse a JSON body (base64 images) or a multipart form (binary image parts)."""
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await request.form()
+            req = ChatRequest(
+                session_id=form.get("session_id") or "default",
+                message=form.get("message"),
+                stream=_form_bool(form.get("stream")),
+                user_context=form.get("user_context") or None,
+            )
+            images = [await f.read() for f in form.getlist("images") if isinstance(f, StarletteUploadFile)]
+        else:
+            req = ChatRequest.model_validate_json(await request.body())
+            images = [base64.b64decode(b) for b in req.images_base64 or []]
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid chat request: {e}")
+    return req, images
+
+@app.post("/v1/chat", openapi_extra=_CHAT_OPENAPI)
+async def chat(request: Request):
+    req, images = await _read_chat_request(request)
+    user_text = _with_user_context(req.message, req.user_context)
     if req.stream:
+        started = time.perf_counter()
+
         async def event_gen():
-            inputs = {"input": req.message, "attachments_overview": f"{len(req.images_base64)} image(s)" if req.images_base64 else "none"}
-            for token in get_agent().stream(session_id=req.session_id, inputs=inputs, images_base64=req.images_base64):
-                yield {"event": "token", "data": token}
-            yield {"event": "done", "data": ""}
+            ttft, tokens = None, 0
+            try:
+                async with limiter("agent"):
+                    agent = await run_blocking("agent", get_agent)
+                    async for ev in agent.astream(session_id=req.session_id, user_text=user_text, images=images or None):
+                        if ev["event"] == "token":
+                            if ttft is None:
+                                ttft = (time.perf_counter() - started) * 1000
+                                _ttft_ms.observe(ttft)
+                            tokens += 1
+                            yield {"event": "token", "data": ev["data"]}
+                        else:
+                            yield {"event": ev["event"], "data": json.dumps(ev["data"], default=str, ensure_ascii=False)}
+                yield {"event": "done", "data": ""}
+            except asyncio.CancelledError:
+                # Client went away; sse-starlette cancels us, which cancels the LLM call.
+                logger.info("chat stream cancelled session=%s after %d tokens", req.session_id, tokens)
+                raise
+            finally:
+                logger.info("chat stream session=%s ttft_ms=%s total_ms=%.1f tokens=%d", req.session_id,
+                            f"{ttft:.1f}" if ttft is not None else "-", (time.perf_counter() - started) * 1000, tokens)
         return EventSourceResponse(event_gen())
     else:
-        # Prepend one-time user context to first message in a session
-        user_text = req.message
-        if req.user_context:
-            user_text = f"[User context]\n{req.user_context}\n[/User context]\n\n{req.message}"
-        result = get_agent().respond(
+        result = await run_blocking(
+            "agent", _respond,
             session_id=req.session_id,
             user_text=user_text,
-            images_base64=req.images_base64,
+            images=images or None,
             stream=False
         )
         return ChatResponse(text=result["text"], tool_calls=result.get("intermediate_steps"))
 
+def _server_timing(timings: dict) -> str:
+    return ", ".join(f"stt-{k[:-3]};dur={v:.1f}" for k, v in timings.items() if k.endswith("_ms"))
+
+async def _audio_response(text: str, language: str | None, stem: str, headers: dict | None = None) -> StreamingResponse:
+    # Audio is sent as the provider produces it (or straight from the TTS cache).
+    # Each response holds a TTS slot until it is done, so TTS_CONCURRENCY caps
+    # live syntheses (espeak processes, ElevenLabs connections) and not just
+    # the next() calls that slow clients spread out over time.
+    slot = limiter("tts")
+    await slot.acquire()
+    try:
+        media, chunks = await run_blocking("tts", synthesize_stream, text, language=language)
+    except BaseException:
+        slot.release()
+        raise
+    ext = ".mp3" if media == "audio/mpeg" else ".wav"
+    headers = {**(headers or {}), "Content-Disposition": f'attachment; filename="{stem}{ext}"'}
+    return StreamingResponse(_holding(slot, iterate_blocking("tts", chunks)), media_type=media, headers=headers)
+
+def _holding(slot: asyncio.Semaphore, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """chunks, releasing slot when they are exhausted or closed, or when the
+    response is dropped without ever being iterated."""
+    loop = asyncio.get_running_loop()
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+            release()
+
+    gen = body()
+    release = weakref.finalize(gen, loop.call_soon_threadsafe, slot.release)
+    release.atexit = False
+    return gen
+
 @app.post("/v1/voice")
 async def voice_to_chat(session_id: str = Form("default"),
                         tts: bool = Form(True),
                         language: str | None = Form(None),
                         audio: UploadFile = File(...)):
-    suffix = os.path.splitext(audio.filename or "audio.wav")[1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as f:
-        raw_path = f.name
-        f.write(await audio.read())
-    try:
-        text = transcribe(raw_path, language=language)
-        if not text.strip():
-            if tts:
-                out_path = synthesize_to_wav("Sorry, I couldn't hear anything. Please try again.", language=language)
-                ext = os.path.splitext(out_path)[1].lower()
-                media = "audio/mpeg" if ext == ".mp3" else "audio/wav"
-                fname = "reply.mp3" if ext == ".mp3" else "reply.wav"
-                return FileResponse(out_path, media_type=media, filename=fname)
-            return JSONResponse({"error": "empty_transcript", "transcript": text}, status_code=400)
-
-        result = get_agent().respond(session_id=session_id, user_text=text, stream=False)
-        reply = result["text"]
+    data = await audio.read()
+    text, timings = await run_blocking("stt", transcribe_timed, data=data, language=language)
+    headers = {"Server-Timing": _server_timing(timings)}
+    if not text.strip():
         if tts:
-            out_path = synthesize_to_wav(reply, language=language)
-            # Decide media type by extension
-            ext = os.path.splitext(out_path)[1].lower()
-            media = "audio/mpeg" if ext == ".mp3" else "audio/wav"
-            fname = "reply.mp3" if ext == ".mp3" else "reply.wav"
-            return FileResponse(out_path, media_type=media, filename=fname)
-        else:
-            return JSONResponse({"transcript": text, "reply": reply, "tool_calls": result.get("intermediate_steps")})
+            return await _audio_response("Sorry, I couldn't hear anything. Please try again.", language, "reply", headers)
+        return JSONResponse({"error": "empty_transcript", "transcript": text}, status_code=400, headers=headers)
+
+    result = await run_blocking("agent", _respond, session_id=session_id, user_text=text, stream=False,
+                                language=language)
+    reply = result["text"]
+    if tts:
+        return await _audio_response(reply, language, "reply", headers)
+    else:
+        return JSONResponse({"transcript": text, "reply": reply, "tool_calls": jsonable_encoder(result.get("intermediate_steps")),
+                             "stt_timings": timings}, headers=headers)
+
+async def _spoken_reply(session_id: str, text: str, language: str | None, started: float) -> AsyncIterator[bytes]:
+    """Agent reply as one audio stream: sentences are synthesized (with bounded
+    parallelism) while the LLM is still generating, and sent in order."""
+    sem = asyncio.Semaphore(max(1, settings.VOICE_STREAM_TTS_PARALLEL))
+    pending: asyncio.Queue[asyncio.Task | None] = asyncio.Queue()
+
+    async def speak(sentence: str) -> tuple[str, bytes]:
+        async with sem:
+            return await run_blocking("tts", synthesize_bytes, sentence, language=language)
+
+    async def produce() -> None:
+        splitter = SentenceSplitter()
+        try:
+            async with limiter("agent"):
+                agent = await run_blocking("agent", get_agent)
+                async for ev in agent.astream(session_id=session_id, user_text=text, language=language):
+                    if ev["event"] == "token":
+                        for sentence in splitter.feed(ev["data"]):
+                            pending.put_nowait(asyncio.create_task(speak(sentence)))
+            for sentence in splitter.flush():
+                pending.put_nowait(asyncio.create_task(speak(sentence)))
+        finally:
+            pending.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    wav_header_sent, first = False, True
+    try:
+        while (task := await pending.get()) is not None:
+            try:
+                media, chunk = await task
+                if media == "audio/wav":
+                    params, chunk = read_wav(chunk)
+            except Exception:
+                logger.exception("voice stream session=%s: TTS failed for one sentence", session_id)
+                continue
+            if media == "audio/wav" and not wav_header_sent:
+                # One header for the whole reply; every segment is raw PCM after it.
+                chunk = streaming_wav_header(*params) + chunk
+                wav_header_sent = True
+            # MP3 frames can simply be concatenated.
+            if first:
+                first = False
+                ttfa = (time.perf_counter() - started) * 1000
+                _ttfa_ms.observe(ttfa)
+                logger.info("voice stream session=%s ttfa_ms=%.1f", session_id, ttfa)
+            yield chunk
+        await producer
+    finally:
+        producer.cancel()
+        while not pending.empty():
+            task = pending.get_nowait()
+            if task is not None:
+                task.cancel()
+
+@app.post("/v1/voice/stream")
+async def voice_stream_reply(session_id: str = Form("default"),
+                             language: str | None = Form(None),
+                             audio: UploadFile = File(...)):
+    """Like /v1/voice with tts=true, but the spoken reply starts playing after
+    the first sentence instead of after the whole answer."""
+    started = time.perf_counter()
+    data = await audio.read()
+    text, timings = await run_blocking("stt", transcribe_timed, data=data, language=language)
+    headers = {"Server-Timing": _server_timing(timings)}
+    if not text.strip():
+        return await _audio_response("Sorry, I couldn't hear anything. Please try again.", language, "reply", headers)
+    headers["X-Transcript"] = quote(text)
+    media = "audio/mpeg" if (settings.TTS_PROVIDER or "espeak").lower() == "elevenlabs" else "audio/wav"
+    return StreamingResponse(_spoken_reply(session_id, text, language, started), media_type=media, headers=headers)
+
+@app.websocket("/v1/voice/ws")
+async def voice_stream(ws: WebSocket, session_id: str = "default", language: str | None = None,
+                       format: str = "pcm16", sample_rate: int = SAMPLE_RATE):
+    """Streaming voice chat.
+
+    The client sends binary frames as it records: raw PCM16 mono at
+    `sample_rate` (format=pcm16) or an Ogg/WebM Opus stream (format=opus), and
+    may send {"type": "end"} when the user stops recording. Speech is cut into
+    segments by VAD and transcribed while the user keeps talking; the server
+    sends {"type": "partial", "text"} per segment, {"type": "final", "text"} at
+    end of speech (and on every "end", with "" if nothing was said), then the
+    agent's answer as {"type": "token", "text"} events and one
+    {"type": "reply", "text"}.
+    """
+    await ws.accept()
+    if format not in ("pcm16", "opus") or not 8000 <= sample_rate <= 48000:
+        await ws.send_json({"type": "error", "error": "format must be pcm16 (8-48 kHz) or opus"})
+        await ws.close(code=1003)
+        return
+    rate = sample_rate if format == "pcm16" else SAMPLE_RATE
+    segmenter = SpeechSegmenter(rate, settings.VAD_SEGMENT_SILENCE_MS, settings.VAD_END_SILENCE_MS,
+                                settings.VAD_MAX_SEGMENT_MS)
+    segments: asyncio.Queue[tuple[str, bytes]] = asyncio.Queue()
+
+    def feed(pcm: bytes) -> None:
+        for ev in segmenter.feed(pcm):
+            segments.put_nowait(ev)
+
+    async def pump(proc) -> None:
+        while chunk := await proc.stdout.read(4096):
+            feed(chunk)
+
+    async def answer(text: str) -> None:
+        reply = []
+        async with limiter("agent"):
+            agent = await run_blocking("agent", get_agent)
+            async for ev in agent.astream(session_id=session_id, user_text=text, language=language):
+                if ev["event"] == "token":
+                    reply.append(ev["data"])
+                    await ws.send_json({"type": "token", "text": ev["data"]})
+        await ws.send_json({"type": "reply", "text": "".join(reply)})
+
+    async def transcriber() -> None:
+        # Only this task sends, so messages stay in order.
+        parts: list[str] = []
+        while True:
+            kind, pcm = await segments.get()
+            try:
+                if pcm:
+                    text = await run_blocking("stt", transcribe_pcm, pcm, rate, language)
+                    if text:
+                        parts.append(text)
+                        await ws.send_json({"type": "partial", "text": " ".join(parts)})
+                if kind == "end":
+                    final, parts = " ".join(parts).strip(), []
+                    await ws.send_json({"type": "final", "text": final})
+                    if final:
+                        await answer(final)
+            except WebSocketDisconnect:
+                return
+            except Exception as e:
+                logger.exception("voice stream session=%s failed", session_id)
+                parts = []
+                await ws.send_json({"type": "error", "error": str(e)})
+
+    worker = asyncio.create_task(transcriber())
+    decoder = await spawn_pcm_decoder() if format == "opus" else None
+    pumping = asyncio.create_task(pump(decoder)) if decoder else None
+    try:
+        while not worker.done():
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect":
+                break
+            if msg.get("bytes"):
+                if decoder is None:
+                    feed(msg["bytes"])
+                else:
+                    decoder.stdin.write(msg["bytes"])
+                    await decoder.stdin.drain()
+            elif msg.get("text"):
+                try:
+                    ctrl = json.loads(msg["text"])
+                except ValueError:
+                    continue
+                if isinstance(ctrl, dict) and ctrl.get("type") == "end":
+                    if decoder is not None:
+                        # Drain what ffmpeg still holds; the next recording is a new stream.
+                        decoder.stdin.close()
+                        await pumping
+                        await decoder.wait()
+                        decoder = await spawn_pcm_decoder()
+                        pumping = asyncio.create_task(pump(decoder))
+                    # Always answer an explicit end with a final, empty if nothing was said.
+                    for ev in segmenter.flush() or [("end", b"")]:
+                        segments.put_nowait(ev)
+    except WebSocketDisconnect:
+        pass
     finally:
-        try: os.remove(raw_path)
-        except Exception: pass
+        worker.cancel()
+        if pumping is not None:
+            pumping.cancel()
+        if decoder is not None and decoder.returncode is None:
+            decoder.kill()
 
 @app.post("/v1/image/classify", response_model=ImageClassifyResponse)
 async def image_classify(file: UploadFile = File(...)):
     b = await file.read()
-    b64 = base64.b64encode(b).decode("utf-8")
-    res = classify_crop_disease_direct.invoke({"image_base64": b64})
+    res = await run_blocking("vit", classify_image, b)
     if "error" in res:
         raise HTTPException(status_code=400, detail=res["error"])
     return ImageClassifyResponse(**res)
 
 @app.post("/v1/tts")
 async def tts(text: str = Form(...), language: str | None = Form(None)):
-    out_path = synthesize_to_wav(text, language=language)
-    ext = os.path.splitext(out_path)[1].lower()
-    media = "audio/mpeg" if ext == ".mp3" else "audio/wav"
-    fname = "speech.mp3" if ext == ".mp3" else "speech.wav"
-    return FileResponse(out_path, media_type=media, filename=fname)
+    return await _audio_response(text, language, "speech")
@@ -0,0 +1,209 @@
+from __future__ import annotations
+from collections import Counter, OrderedDict
+from typing import Iterable, Optional
+import re, threading, time, unicodedata
+import numpy as np
+
+from app.config import settings
+from app.services.cache import read_generation
+from app.services.metrics import histogram, register_stats
+
+# Final answers to FAQ-style questions, looked up by query embedding within a
+# language. Only answers that don't depend on the session are stored: no
+# images, no time-sensitive tools (see ANSWER_CACHE_BYPASS_*). Entries are
+# dropped when the KB namespace generation changes, since the answer may
+# quote passages that were re-ingested.
+
+class _Entry:
+    __slots__ = ("vec", "text", "query", "expires", "generation")
+
+    def __init__(self, vec: np.ndarray, text: str, query: str, expires: float, generation: int) -> None:
+        self.vec = vec
+        self.text = text
+        self.query = query
+        self.expires = expires
+        self.generation = generation
+
+class SemanticAnswerCache:
+    """Size-bounded LRU of answers with TTL; lookup is a cosine nearest
+    neighbour within the request's language, accepted above `threshold`."""
+
+    def __init__(self, maxsize: int, ttl: float, threshold: float) -> None:
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = float(ttl)
+        self.threshold = float(threshold)
+        self._entries: OrderedDict[int, tuple[str, _Entry]] = OrderedDict()  # id -> (language, entry), LRU order
+        self._by_lang: dict[str, dict[int, _Entry]] = {}
+        self._matrix: dict[str, tuple[list[int], np.ndarray]] = {}  # stacked vectors, rebuilt after writes
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expired = 0
+        self.bypassed: Counter[str] = Counter()
+        self.similarity = histogram("answer_cache_similarity", (0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.99),
+                                    "Best cosine similarity found by answer cache lookups")
+
+    @staticmethod
+    def _unit(vec: np.ndarray) -> np.ndarray:
+        vec = np.asarray(vec, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
+
+    def _remove(self, entry_id: int) -> None:
+        lang, _ = self._entries.pop(entry_id)
+        shelf = self._by_lang[lang]
+        del shelf[entry_id]
+        if not shelf:
+            del self._by_lang[lang]
+        self._matrix.pop(lang, None)
+
+    def _stacked(self, lang: str) -> Optional[tuple[list[int], np.ndarray]]:
+        stacked = self._matrix.get(lang)
+        if stacked is None:
+            shelf = self._by_lang.get(lang)
+            if not shelf:
+                return None
+            ids = list(shelf)
+            stacked = self._matrix[lang] = (ids, np.stack([shelf[i].vec for i in ids]))
+        return stacked
+
+    def lookup(self, language: str, vec: np.ndarray, generation: int = 0) -> Optional[tuple[str, float]]:
+        """(answer, similarity) of the closest live entry, or None."""
+        q = self._unit(vec)
+        now = time.monotonic()
+        with self._lock:
+            while True:
+                stacked = self._stacked(language)
+                if stacked is None:
+                    self.misses += 1
+                    return None
+                ids, matrix = stacked
+                scores = matrix @ q
+                best = int(np.argmax(scores))
+                entry = self._by_lang[language][ids[best]]
+                if entry.expires >= now and entry.generation == generation:
+                    break
+                # Stale best match: drop it and look again.
+                self._remove(ids[best])
+                self.expired += 1
+            score = float(scores[best])
+            self.similarity.observe(score)
+            if score < self.threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(ids[best])
+            self.hits += 1
+            return entry.text, score
+
+    def put(self, language: str, vec: np.ndarray, query: str, text: str, generation: int = 0) -> None:
+        if self.maxsize == 0 or not text:
+            return
+        entry = _Entry(self._unit(vec), text, query, time.monotonic() + self.ttl, generation)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (language, entry)
+            self._by_lang.setdefault(language, {})[entry_id] = entry
+            self._matrix.pop(language, None)
+            self.stores += 1
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def bypass(self, reason: str) -> None:
+        with self._lock:
+            self.bypassed[reason] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_lang.clear()
+            self._matrix.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "languages": {lang: len(shelf) for lang, shelf in self._by_lang.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "bypassed": dict(self.bypassed),
+            "hit_ratio": (self.hits / total) if total else 0.0,
+        }
+
+_cache: Optional[SemanticAnswerCache] = None
+_lock = threading.Lock()
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """The process-wide cache, or None when ANSWER_CACHE_ENABLED is off."""
+    global _cache
+    if not settings.ANSWER_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = SemanticAnswerCache(settings.ANSWER_CACHE_SIZE, settings.ANSWER_CACHE_TTL_S,
+                                             settings.ANSWER_CACHE_THRESHOLD)
+    return _cache
+
+def cache_stats() -> dict:
+    cache = get_answer_cache()
+    return cache.stats() if cache else {}
+
+register_stats("answer_cache", cache_stats)
+
+def _csv(value: str) -> set[str]:
+    return {v.strip() for v in (value or "").split(",") if v.strip()}
+
+_bypass_re: Optional[re.Pattern] = None
+
+def _bypass_pattern() -> Optional[re.Pattern]:
+    global _bypass_re
+    if _bypass_re is None and settings.ANSWER_CACHE_BYPASS_PATTERN:
+        _bypass_re = re.compile(settings.ANSWER_CACHE_BYPASS_PATTERN, re.IGNORECASE)
+    return _bypass_re
+
+def bypass_reason(text: str, has_images: bool, has_history: bool) -> Optional[str]:
+    """Why a request must not be served from (or stored in) the cache, if it must not."""
+    if has_images:
+        return "images"
+    if has_history and settings.ANSWER_CACHE_FIRST_TURN_ONLY:
+        return "history"
+    pattern = _bypass_pattern()
+    if pattern is not None and pattern.search(text or ""):
+        return "time_sensitive"
+    return None
+
+def uncacheable_tools(tool_names: Iterable[str]) -> set[str]:
+    """Tools used for an answer that make it unsafe to reuse."""
+    return set(tool_names) & _csv(settings.ANSWER_CACHE_BYPASS_TOOLS)
+
+_PREFERRED_LANGUAGE = re.compile(r"preferred\s+language\s*[:=-]\s*([^\n,;]+)", re.IGNORECASE)
+
+def preferred_language(user_context: str) -> Optional[str]:
+    """The language named in a user-context block ("Preferred Language: Hindi"), if any."""
+    m = _PREFERRED_LANGUAGE.search(user_context or "")
+    return (m.group(1).strip() or None) if m else None
+
+def language_key(text: str, language: Optional[str] = None) -> str:
+    """Explicit language when known, else the dominant Unicode script of the text."""
+    if language:
+        return language.strip().lower().split("-")[0]
+    scripts: Counter[str] = Counter()
+    for ch in text or "":
+        if ch.isalpha():
+            try:
+                scripts[unicodedata.name(ch).split(" ")[0]] += 1
+            except ValueError:
+                pass
+    return f"script:{scripts.most_common(1)[0][0].lower()}" if scripts else "script:none"
+
+def generation() -> int:
+    return read_generation(settings.PINECONE_NAMESPACE)
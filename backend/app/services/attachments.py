@@ -0,0 +1,198 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+import atexit, os, shutil, tempfile, threading, time, uuid
+
+from app.config import settings
+from app.services.metrics import register_stats
+
+class _Attachment:
+    __slots__ = ("data", "path", "size", "decoded", "decoded_size")
+
+    def __init__(self, data: bytes) -> None:
+        self.data: Optional[bytes] = data
+        self.path: Optional[str] = None  # set once spilled to disk
+        self.size = len(data)
+        self.decoded: Any = None
+        self.decoded_size = 0
+
+    @property
+    def resident_bytes(self) -> int:
+        return (self.size if self.data is not None else 0) + self.decoded_size
+
+class _Session:
+    __slots__ = ("items", "expires")
+
+    def __init__(self, items: List[_Attachment], expires: float) -> None:
+        self.items = items
+        self.expires = expires
+
+def _decoded_nbytes(obj: Any) -> int:
+    # PIL images and tensors/arrays; used only for budgeting.
+    if hasattr(obj, "nbytes"):
+        return int(obj.nbytes)
+    if hasattr(obj, "size") and hasattr(obj, "getbands"):
+        w, h = obj.size
+        return w * h * len(obj.getbands())
+    return 0
+
+class AttachmentStore:
+    """Raw image bytes per session, with TTL, LRU eviction under a global byte
+    budget, optional spill to temp files, and a cache of the decoded image so
+    repeated tool calls on the same image_idx skip decoding."""
+
+    def __init__(self, max_bytes: int, ttl: float, spill: bool = False, spill_max_bytes: int = 0) -> None:
+        self.max_bytes = max(1, max_bytes)
+        self.ttl = ttl
+        self.spill_max_bytes = spill_max_bytes if spill else 0
+        self._spill_dir: Optional[str] = None
+        self._sessions: OrderedDict[str, _Session] = OrderedDict()
+        self._resident = 0
+        self._spilled = 0
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.spills = 0
+        self.decode_hits = 0
+        self.decode_misses = 0
+
+    # ---- public API ----------------------------------------------------
+    def put_images(self, session_id: str, images: Optional[List[bytes]]) -> None:
+        if images is None:
+            return
+        items = [_Attachment(bytes(b)) for b in images]
+        with self._lock:
+            self._drop(session_id)
+            self._sessions[session_id] = _Session(items, time.monotonic() + self.ttl)
+            self._resident += sum(a.size for a in items)
+            self._enforce_budget(protect=session_id)
+
+    def get_image(self, session_id: str, idx: int) -> bytes:
+        with self._lock:
+            att = self._get(session_id, idx)
+            data, path = att.data, att.path
+        if data is not None:
+            return data
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ValueError(f"image_idx {idx} has expired")
+
+    def get_decoded(self, session_id: str, idx: int, decode: Callable[[bytes], Any]) -> Any:
+        with self._lock:
+            att = self._get(session_id, idx)
+            if att.decoded is not None:
+                self.decode_hits += 1
+                return att.decoded
+            self.decode_misses += 1
+        decoded = decode(self.get_image(session_id, idx))
+        with self._lock:
+            sess = self._sessions.get(session_id)
+            if sess is not None and idx < len(sess.items) and sess.items[idx] is att and att.decoded is None:
+                att.decoded = decoded
+                att.decoded_size = _decoded_nbytes(decoded)
+                self._resident += att.decoded_size
+                self._enforce_budget(protect=session_id)
+        return decoded
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "resident_bytes": self._resident,
+                "max_bytes": self.max_bytes,
+                "spilled_bytes": self._spilled,
+                "evicted_sessions": self.evicted,
+                "spills": self.spills,
+                "decode_hits": self.decode_hits,
+                "decode_misses": self.decode_misses,
+            }
+
+    # ---- internals (call with the lock held) ---------------------------
+    def _get(self, session_id: str, idx: int) -> _Attachment:
+        sess = self._sessions.get(session_id)
+        if sess is not None and sess.expires < time.monotonic():
+            self._drop(session_id)
+            self.evicted += 1
+            sess = None
+        items = sess.items if sess else []
+        if idx < 0 or idx >= len(items):
+            raise ValueError(f"image_idx {idx} is out of range (have {len(items)})")
+        self._sessions.move_to_end(session_id)
+        return items[idx]
+
+    def _drop(self, session_id: str) -> None:
+        sess = self._sessions.pop(session_id, None)
+        if sess is None:
+            return
+        for att in sess.items:
+            self._resident -= att.resident_bytes
+            if att.path:
+                self._spilled -= att.size
+                try:
+                    os.remove(att.path)
+                except OSError:
+                    pass
+
+    def _spill(self, att: _Attachment) -> bool:
+        if att.data is None or self._spilled + att.size > self.spill_max_bytes:
+            return False
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="attachments-")
+            atexit.register(shutil.rmtree, self._spill_dir, True)
+        path = os.path.join(self._spill_dir, uuid.uuid4().hex)
+        with open(path, "wb") as f:
+            f.write(att.data)
+        self._resident -= att.resident_bytes
+        att.data, att.path = None, path
+        att.decoded, att.decoded_size = None, 0
+        self._spilled += att.size
+        self.spills += 1
+        return True
+
+    def _enforce_budget(self, protect: str) -> None:
+        now = time.monotonic()
+        for sid in [sid for sid, s in self._sessions.items() if s.expires < now and sid != protect]:
+            self._drop(sid)
+            self.evicted += 1
+        if self._resident <= self.max_bytes:
+            return
+        # Least recently used first. Decoded caches go first, across all
+        # sessions; only if that is not enough are raw bytes spilled (if
+        # enabled) and, failing that, whole sessions evicted.
+        others = [(sid, sess) for sid, sess in self._sessions.items() if sid != protect]
+        for _, sess in others:
+            for att in sess.items:
+                if att.decoded is not None:
+                    self._resident -= att.decoded_size
+                    att.decoded, att.decoded_size = None, 0
+                if self._resident <= self.max_bytes:
+                    return
+        for sid, sess in others:
+            if self.spill_max_bytes:
+                for att in sess.items:
+                    if self._resident <= self.max_bytes:
+                        return
+                    if att.data is not None and not self._spill(att):
+                        break
+                if all(att.data is None for att in sess.items):
+                    continue
+            if self._resident <= self.max_bytes:
+                return
+            self._drop(sid)
+            self.evicted += 1
+
+_store: Optional[AttachmentStore] = None
+_store_lock = threading.Lock()
+
+def get_attachment_store() -> AttachmentStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = AttachmentStore(settings.ATTACHMENT_MAX_BYTES, settings.ATTACHMENT_TTL_S,
+                                         spill=settings.ATTACHMENT_SPILL,
+                                         spill_max_bytes=settings.ATTACHMENT_SPILL_MAX_BYTES)
+    return _store
+
+register_stats("attachments", lambda: get_attachment_store().stats())
@@ -0,0 +1,88 @@
+from __future__ import annotations
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Sequence
+import asyncio, queue, threading, time
+
+from app.services.metrics import histogram
+
+_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+_WAIT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+@dataclass
+class _Item:
+    payload: Any
+    future: Future = field(default_factory=Future)
+    enqueued: float = field(default_factory=time.monotonic)
+
+class MicroBatcher:
+    """Collect concurrent calls into one batched call of `fn`.
+
+    A batch is dispatched once it holds `max_batch` items or `max_wait_ms` after
+    its first item was queued, whichever comes first. `fn` receives a list of
+    payloads and must return one result per payload, in order.
+    """
+
+    def __init__(self, fn: Callable[[list], Sequence], max_batch: int, max_wait_ms: float, name: str) -> None:
+        self.fn = fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self.batch_size = histogram(f"{name}_batch_size", _BATCH_BUCKETS, "Items per dispatched batch")
+        self.queue_wait_ms = histogram(f"{name}_queue_wait_ms", _WAIT_BUCKETS_MS, "Time from submit to dispatch")
+        self._queue: queue.SimpleQueue[_Item] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self) -> None:
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, payload: Any) -> Future:
+        self._ensure_worker()
+        item = _Item(payload)
+        self._queue.put(item)
+        return item.future
+
+    def __call__(self, payload: Any, timeout: float | None = None) -> Any:
+        return self.submit(payload).result(timeout)
+
+    async def acall(self, payload: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(payload))
+
+    def _collect(self) -> list[_Item]:
+        first = self._queue.get()
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                # Past the deadline only take what is already queued.
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            now = time.monotonic()
+            self.batch_size.observe(len(batch))
+            for item in batch:
+                self.queue_wait_ms.observe((now - item.enqueued) * 1000)
+            try:
+                results = self.fn([item.payload for item in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: batch fn returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+            for item, res in zip(batch, results):
+                item.future.set_result(res)
+
+    def stats(self) -> dict:
+        return {"batch_size": self.batch_size.snapshot(), "queue_wait_ms": self.queue_wait_ms.snapshot()}
@@ -0,0 +1,206 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+import os, tempfile, threading, time
+
+from app.config import settings
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry time-to-live and hit/miss counters."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = float(ttl)
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+        }
+
+class _BlobWriter:
+    """Streams one cache entry to a temp file in the cache directory; commit()
+    publishes it atomically, abort() removes it."""
+
+    def __init__(self, cache: "DiskLRUCache", key: str) -> None:
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        fd, self.tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=cache.root)
+        self._f = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> None:
+        self._f.write(data)
+        self.size += len(data)
+
+    def commit(self, finalize: Optional[Callable[[str], None]] = None) -> str:
+        self._f.close()
+        if finalize is not None:
+            finalize(self.tmp_path)
+        path = self.cache.path(self.key)
+        os.replace(self.tmp_path, path)
+        self.cache._added(self.size, protect=path)
+        return path
+
+    def abort(self) -> None:
+        self._f.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+class DiskLRUCache:
+    """Size-bounded directory of immutable files named by key.
+
+    Recency is the file mtime, refreshed on every hit, so worker processes can
+    share one directory. Each process keeps a running size estimate and
+    rescans the directory once it crosses the budget.
+    """
+
+    _STALE_TMP_S = 3600
+
+    def __init__(self, root: str, max_bytes: int, suffix: str = "") -> None:
+        self.root = root
+        self.max_bytes = max(0, int(max_bytes))
+        self.suffix = suffix
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._approx_bytes = sum(size for _, _, size in self._scan())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key + self.suffix)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def writer(self, key: str) -> _BlobWriter:
+        return _BlobWriter(self, key)
+
+    def _scan(self) -> list[tuple[float, str, int]]:
+        out = []
+        now = time.time()
+        with os.scandir(self.root) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith(".tmp-"):
+                    # Left behind by a crashed writer.
+                    if now - st.st_mtime > self._STALE_TMP_S:
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            pass
+                    continue
+                out.append((st.st_mtime, entry.path, st.st_size))
+        return out
+
+    def _added(self, size: int, protect: str) -> None:
+        with self._lock:
+            self._approx_bytes += size
+            if self._approx_bytes <= self.max_bytes:
+                return
+            entries = sorted(self._scan())
+            total = sum(size for _, _, size in entries)
+            for _, path, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == protect:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+            self._approx_bytes = total
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "bytes": self._approx_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+        }
+
+# Generation markers let separate processes (ingest scripts, other workers)
+# invalidate caches keyed on a name: bumping rewrites a small file whose
+# mtime becomes part of the cache key.
+
+def _generation_path(name: str) -> str:
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in name) or "default"
+    return os.path.join(settings.RAG_CACHE_DIR, f"{safe}.gen")
+
+def read_generation(name: str) -> int:
+    try:
+        return os.stat(_generation_path(name)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def bump_generation(name: str) -> None:
+    path = _generation_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    now = time.time_ns()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(str(now))
+    # Set the mtime explicitly; some filesystems only keep coarse timestamps.
+    os.utime(path, ns=(now, now))
@@ -0,0 +1,108 @@
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator
+import asyncio, contextvars, functools, threading, time
+
+from app.config import settings
+from app.services.metrics import gauge, histogram
+
+# One bounded pool per resource class, so a burst of slow Gemini calls cannot
+# starve STT/TTS/ViT work (or the event loop serving /v1/health).
+_pools: dict[str, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+def _limit(resource: str) -> int:
+    limits = {
+        "agent": settings.AGENT_CONCURRENCY,
+        "stt": settings.STT_CONCURRENCY,
+        "tts": settings.TTS_CONCURRENCY,
+        "vit": settings.VIT_CONCURRENCY,
+        "tools": settings.TOOL_CONCURRENCY,
+    }
+    if resource not in limits:
+        raise ValueError(f"Unknown resource pool '{resource}'")
+    return max(1, limits[resource])
+
+def _pool(resource: str) -> ThreadPoolExecutor:
+    pool = _pools.get(resource)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(resource)
+            if pool is None:
+                pool = _pools[resource] = ThreadPoolExecutor(max_workers=_limit(resource), thread_name_prefix=f"{resource}-pool")
+    return pool
+
+_WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+@functools.lru_cache(maxsize=None)
+def _pool_metrics(resource: str):
+    return (gauge("executor_in_flight", "Calls queued or running on a resource pool", resource=resource),
+            histogram("executor_queue_wait_ms", _WAIT_BUCKETS_MS, "Time from submit to a pool thread picking the call up",
+                      resource=resource))
+
+def _tracked(resource: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+    # Queued-or-running count and time spent waiting for a pool thread.
+    in_flight, wait_ms = _pool_metrics(resource)
+    in_flight.inc()
+    queued = time.perf_counter()
+
+    def run(*args, **kwargs):
+        wait_ms.observe((time.perf_counter() - queued) * 1000)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            in_flight.dec()
+    return run
+
+async def run_blocking(resource: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking call on the resource's pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_pool(resource), functools.partial(ctx.run, _tracked(resource, fn), *args, **kwargs))
+
+def submit(resource: str, fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """Start a blocking call on the resource's pool from synchronous code."""
+    ctx = contextvars.copy_context()
+    return _pool(resource).submit(ctx.run, _tracked(resource, fn), *args, **kwargs)
+
+async def iterate_blocking(resource: str, iterator: Iterator[Any]) -> AsyncIterator[Any]:
+    """Async view of a blocking iterator; each next() runs on the resource's pool.
+
+    The iterator is closed when the consumer stops early (e.g. the client
+    disconnected), after any in-flight next() finishes.
+    """
+    pool = _pool(resource)
+    ctx = contextvars.copy_context()
+    done = object()
+    fut = None
+    try:
+        while True:
+            fut = pool.submit(ctx.run, next, iterator, done)
+            item = await asyncio.wrap_future(fut)
+            if item is done:
+                break
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            if fut is not None and not fut.done():
+                fut.add_done_callback(lambda _: close())
+            else:
+                close()
+
+_semaphores: dict[str, asyncio.Semaphore] = {}
+
+def limiter(resource: str) -> asyncio.Semaphore:
+    """Async concurrency limit for work that runs on the event loop itself
+    (e.g. async LLM streaming), sized like the resource's thread pool."""
+    sem = _semaphores.get(resource)
+    if sem is None:
+        sem = _semaphores[resource] = asyncio.Semaphore(_limit(resource))
+    return sem
+
+def shutdown() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
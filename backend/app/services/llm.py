@@ -1,25 +1,553 @@
 from __future__ import annotations
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_ollama import ChatOllama
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional
+import asyncio, hashlib, json, logging, random, re, threading, time
+
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage, message_to_dict
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import ConfigDict
+
 from app.config import settings
+from app.services.metrics import histogram, register_stats
 
-def get_llm() -> BaseChatModel:
-    provider = settings.USE_LLM.lower()
+logger = logging.getLogger(__name__)
+
+# ---- per-provider concurrency gate -------------------------------------------
+class _Gate:
+    """Counting semaphore shared by threads (AgentExecutor.invoke) and
+    coroutines (astream), so both paths respect one per-provider limit."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self._sem = threading.BoundedSemaphore(self.limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+
+    def _enter(self) -> None:
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+
+    def _exit(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        self._sem.release()
+
+    @contextmanager
+    def hold(self) -> Iterator[None]:
+        with self._lock:
+            self.waiting += 1
+        self._sem.acquire()
+        self._enter()
+        try:
+            yield
+        finally:
+            self._exit()
+
+    @asynccontextmanager
+    async def ahold(self) -> AsyncIterator[None]:
+        with self._lock:
+            self.waiting += 1
+        delay = 0.002
+        try:
+            # Poll rather than park a thread per waiting coroutine.
+            while not self._sem.acquire(blocking=False):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        except BaseException:
+            with self._lock:
+                self.waiting -= 1
+            raise
+        self._enter()
+        try:
+            yield
+        finally:
+            self._exit()
+
+_gates: dict[str, _Gate] = {}
+_gates_lock = threading.Lock()
+
+def _gate(provider: str) -> _Gate:
+    gate = _gates.get(provider)
+    if gate is None:
+        with _gates_lock:
+            gate = _gates.get(provider)
+            if gate is None:
+                limits = {"gemini": settings.GEMINI_CONCURRENCY, "ollama": settings.OLLAMA_CONCURRENCY,
+                          "fake": settings.FAKE_LLM_CONCURRENCY}
+                gate = _gates[provider] = _Gate(limits.get(provider, 4))
+    return gate
+
+# ---- singleflight ----------------------------------------------------------------
+class _Abandoned(Exception):
+    """The leading call stopped early (consumer went away); followers call themselves."""
+
+_flights: dict[str, Future] = {}
+_flights_lock = threading.Lock()
+
+def _join(key: Optional[str]) -> tuple[Optional[Future], bool]:
+    """(flight, is_leader). Identical prompts in flight share the leader's result."""
+    if key is None:
+        return None, True
+    with _flights_lock:
+        fut = _flights.get(key)
+        if fut is not None:
+            return fut, False
+        fut = _flights[key] = Future()
+        fut.set_running_or_notify_cancel()  # followers can't cancel it
+        return fut, True
+
+def _land(key: Optional[str], fut: Optional[Future], result: Optional[ChatResult] = None,
+          exc: Optional[BaseException] = None) -> None:
+    if fut is None:
+        return
+    with _flights_lock:
+        if _flights.get(key) is fut:
+            del _flights[key]
+    if exc is not None:
+        fut.set_exception(exc if isinstance(exc, Exception) else _Abandoned())
+    else:
+        fut.set_result(result)
+
+def _as_chunk(result: ChatResult) -> ChatGenerationChunk:
+    msg = result.generations[0].message
+    chunk = AIMessageChunk(
+        content=msg.content,
+        additional_kwargs=msg.additional_kwargs,
+        response_metadata=msg.response_metadata,
+        usage_metadata=getattr(msg, "usage_metadata", None),
+        tool_call_chunks=[{"name": tc["name"], "args": json.dumps(tc["args"]), "id": tc.get("id"), "index": i}
+                          for i, tc in enumerate(getattr(msg, "tool_calls", None) or [])],
+    )
+    return ChatGenerationChunk(message=chunk)
+
+def _to_result(aggregated: Optional[ChatGenerationChunk]) -> ChatResult:
+    chunk = aggregated.message if aggregated is not None else AIMessageChunk(content="")
+    msg = AIMessage(content=chunk.content, additional_kwargs=chunk.additional_kwargs,
+                    response_metadata=chunk.response_metadata, usage_metadata=chunk.usage_metadata,
+                    tool_calls=chunk.tool_calls, id=chunk.id)
+    return ChatResult(generations=[ChatGeneration(message=msg)])
+
+# ---- retries -----------------------------------------------------------------------
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_NAMES = ("ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "TooManyRequests",
+                    "RateLimit", "Timeout", "ConnectError", "RemoteProtocolError", "InternalServerError")
+_RETRYABLE_TEXT = re.compile(r"\b(429|503|RESOURCE_EXHAUSTED|UNAVAILABLE|rate.?limit|overloaded)\b", re.IGNORECASE)
+
+def _status(e: BaseException) -> Optional[int]:
+    for obj in (e, getattr(e, "response", None)):
+        for attr in ("status_code", "code"):
+            value = getattr(obj, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+def _is_retryable(e: BaseException) -> bool:
+    if _status(e) in _RETRYABLE_STATUS:
+        return True
+    if any(n in type(e).__name__ for n in _RETRYABLE_NAMES):
+        return True
+    return bool(_RETRYABLE_TEXT.search(str(e)))
+
+def _backoff(attempt: int, e: BaseException) -> float:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        retry_after = float(headers.get("retry-after"))
+    except (TypeError, ValueError, AttributeError):
+        retry_after = None
+    if retry_after is not None:
+        return min(retry_after, settings.LLM_RETRY_MAX_S)
+    # Exponential with jitter, so a burst of 429s doesn't retry in lockstep.
+    return min(settings.LLM_RETRY_MAX_S, settings.LLM_RETRY_BASE_S * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def _retry(attempt: int, e: BaseException, yielded: bool) -> Optional[float]:
+    """Seconds to wait before trying again, or None to give up."""
+    if yielded or attempt >= settings.LLM_MAX_RETRIES or not _is_retryable(e):
+        return None
+    return _backoff(attempt, e)
+
+# ---- accounting ---------------------------------------------------------------------
+_call_ms = histogram("llm_call_ms", (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000),
+                     "LLM call latency including retries")
+_ttft_ms = histogram("llm_ttft_ms", (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000),
+                     "Time to first streamed chunk of an LLM call")
+_output_tokens = histogram("llm_output_tokens", (16, 32, 64, 128, 256, 512, 1024, 2048, 4096),
+                           "Output tokens per LLM call")
+
+class _Usage:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def record(self, provider: str, model: str, started: float, ttft: Optional[float], result: Optional[ChatResult],
+               retries: int, error: Optional[BaseException] = None) -> None:
+        ms = (time.perf_counter() - started) * 1000
+        usage = {}
+        if result is not None:
+            usage = getattr(result.generations[0].message, "usage_metadata", None) or {}
+        tokens_in, tokens_out = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        with self._lock:
+            self.calls += 1
+            self.retries += retries
+            self.errors += error is not None
+            self.input_tokens += tokens_in
+            self.output_tokens += tokens_out
+        _call_ms.observe(ms)
+        if ttft is not None:
+            _ttft_ms.observe(ttft)
+        if result is not None:
+            _output_tokens.observe(tokens_out)
+        logger.info("llm call provider=%s model=%s ms=%.1f ttft_ms=%s in=%d out=%d retries=%d%s", provider, model, ms,
+                    f"{ttft:.1f}" if ttft is not None else "-", tokens_in, tokens_out, retries,
+                    f" error={type(error).__name__}" if error is not None else "")
+
+    def joined(self) -> None:
+        with self._lock:
+            self.coalesced += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "errors": self.errors, "retries": self.retries, "coalesced": self.coalesced,
+                    "input_tokens": self.input_tokens, "output_tokens": self.output_tokens}
+
+_usage: dict[str, _Usage] = {}
+
+def _usage_for(provider: str) -> _Usage:
+    with _gates_lock:
+        return _usage.setdefault(provider, _Usage())
+
+def stats() -> dict:
+    with _gates_lock:
+        providers = list(_usage)
+    return {p: {**_usage_for(p).stats(), "in_flight": _gate(p).in_flight, "waiting": _gate(p).waiting,
+                "limit": _gate(p).limit} for p in providers}
+
+register_stats("llm_usage", stats, label="provider")
+
+# ---- managed model --------------------------------------------------------------------
+class ManagedChatModel(BaseChatModel):
+    """A provider chat model behind a per-provider concurrency gate, with
+    retry/backoff on rate limits and transient errors, singleflight for
+    identical in-flight prompts, and per-call latency/token accounting."""
+
+    provider: str
+    inner: BaseChatModel
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"managed-{self.provider}"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"provider": self.provider, **self.inner._identifying_params}
+
+    @property
+    def _model_name(self) -> str:
+        return str(getattr(self.inner, "model", None) or getattr(self.inner, "model_name", None) or self.provider)
+
+    def bind_tools(self, tools, **kwargs):
+        # Let the provider format the tools, then bind the result to us.
+        return self.bind(**self.inner.bind_tools(tools, **kwargs).kwargs)
+
+    def _key(self, messages: list[BaseMessage], stop: Optional[list[str]], kwargs: dict) -> Optional[str]:
+        if not settings.LLM_SINGLEFLIGHT:
+            return None
+        payload = json.dumps([self.provider, self._model_name, [message_to_dict(m) for m in messages], stop, kwargs],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = self._key(messages, stop, kwargs)
+        fut, leader = _join(key)
+        if not leader:
+            try:
+                result = fut.result()
+                _usage_for(self.provider).joined()
+                return result
+            except _Abandoned:
+                fut, key = None, None
+        started, attempt = time.perf_counter(), 0
+        try:
+            while True:
+                try:
+                    with _gate(self.provider).hold():
+                        result = self.inner._generate(messages, stop=stop, **kwargs)
+                    break
+                except Exception as e:
+                    delay = _retry(attempt, e, False)
+                    if delay is None:
+                        raise
+                    logger.warning("llm %s retry %d in %.2fs: %s", self.provider, attempt + 1, delay, e)
+                    time.sleep(delay)
+                    attempt += 1
+        except BaseException as e:
+            _land(key, fut, exc=e)
+            _usage_for(self.provider).record(self.provider, self._model_name, started, None, None, attempt, e)
+            raise
+        _land(key, fut, result=result)
+        _usage_for(self.provider).record(self.provider, self._model_name, started, None, result, attempt)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = self._key(messages, stop, kwargs)
+        fut, leader = _join(key)
+        if not leader:
+            try:
+                result = await asyncio.shield(asyncio.wrap_future(fut))
+                _usage_for(self.provider).joined()
+                return result
+            except _Abandoned:
+                fut, key = None, None
+        started, attempt = time.perf_counter(), 0
+        try:
+            while True:
+                try:
+                    async with _gate(self.provider).ahold():
+                        result = await self.inner._agenerate(messages, stop=stop, **kwargs)
+                    break
+                except Exception as e:
+                    delay = _retry(attempt, e, False)
+                    if delay is None:
+                        raise
+                    logger.warning("llm %s retry %d in %.2fs: %s", self.provider, attempt + 1, delay, e)
+                    await asyncio.sleep(delay)
+                    attempt += 1
+        except BaseException as e:
+            _land(key, fut, exc=e)
+            _usage_for(self.provider).record(self.provider, self._model_name, started, None, None, attempt, e)
+            raise
+        _land(key, fut, result=result)
+        _usage_for(self.provider).record(self.provider, self._model_name, started, None, result, attempt)
+        return result
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        key = self._key(messages, stop, kwargs)
+        fut, leader = _join(key)
+        if not leader:
+            try:
+                result = fut.result()
+                _usage_for(self.provider).joined()
+                yield _as_chunk(result)
+                return
+            except _Abandoned:
+                fut, key = None, None
+        started, attempt, ttft, aggregated = time.perf_counter(), 0, None, None
+        try:
+            while True:
+                try:
+                    with _gate(self.provider).hold():
+                        for chunk in self.inner._stream(messages, stop=stop, **kwargs):
+                            if ttft is None:
+                                ttft = (time.perf_counter() - started) * 1000
+                            aggregated = chunk if aggregated is None else aggregated + chunk
+                            yield chunk
+                    break
+                except Exception as e:
+                    # Once chunks reached the caller a retry would repeat them.
+                    delay = _retry(attempt, e, aggregated is not None)
+                    if delay is None:
+                        raise
+                    logger.warning("llm %s retry %d in %.2fs: %s", self.provider, attempt + 1, delay, e)
+                    time.sleep(delay)
+                    attempt += 1
+        except BaseException as e:
+            _land(key, fut, exc=e)
+            _usage_for(self.provider).record(self.provider, self._model_name, started, ttft, None, attempt,
+                                             e if isinstance(e, Exception) else None)
+            raise
+        result = _to_result(aggregated)
+        _land(key, fut, result=result)
+        _usage_for(self.provider).record(self.provider, self._model_name, started, ttft, result, attempt)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        key = self._key(messages, stop, kwargs)
+        fut, leader = _join(key)
+        if not leader:
+            try:
+                result = await asyncio.shield(asyncio.wrap_future(fut))
+                _usage_for(self.provider).joined()
+                yield _as_chunk(result)
+                return
+            except _Abandoned:
+                fut, key = None, None
+        started, attempt, ttft, aggregated = time.perf_counter(), 0, None, None
+        try:
+            while True:
+                try:
+                    async with _gate(self.provider).ahold():
+                        async for chunk in self.inner._astream(messages, stop=stop, **kwargs):
+                            if ttft is None:
+                                ttft = (time.perf_counter() - started) * 1000
+                            aggregated = chunk if aggregated is None else aggregated + chunk
+                            yield chunk
+                    break
+                except Exception as e:
+                    delay = _retry(attempt, e, aggregated is not None)
+                    if delay is None:
+                        raise
+                    logger.warning("llm %s retry %d in %.2fs: %s", self.provider, attempt + 1, delay, e)
+                    await asyncio.sleep(delay)
+                    attempt += 1
+        except BaseException as e:
+            _land(key, fut, exc=e)
+            _usage_for(self.provider).record(self.provider, self._model_name, started, ttft, None, attempt,
+                                             e if isinstance(e, Exception) else None)
+            raise
+        result = _to_result(aggregated)
+        _land(key, fut, result=result)
+        _usage_for(self.provider).record(self.provider, self._model_name, started, ttft, result, attempt)
+
+# ---- offline fake provider ----------------------------------------------------------------
+_FAKE_WEATHER = re.compile(r"\b(weather|rain\w*|forecast|temperature|humidity)\b|मौसम|बारिश|तापमान", re.IGNORECASE)
+_FAKE_CITY = re.compile(r"\b(?:in|at|for)\s+([A-Za-z][\w-]*(?:\s+[A-Z][\w-]*)?)")
+_FAKE_FILLER = ("Keep the field well drained and scout the crop every week. Follow the dose on the label and "
+                "avoid spraying before rain. Consult the local extension office if symptoms spread.").split()
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic stand-in for load tests without a model or network.
+
+    Waits `latency_ms` before the first token, then emits words at
+    `tokens_per_s`. With tools bound, the first turn asks for one tool
+    (classify_crop_disease if images are attached, get_weather for weather
+    words, rag_search otherwise); once tool output is present it answers.
+    The same prompt always gives the same reply.
+    """
+
+    latency_ms: float = 300.0
+    tokens_per_s: float = 50.0
+    answer_tokens: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": "fake", "latency_ms": self.latency_ms, "tokens_per_s": self.tokens_per_s}
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    @staticmethod
+    def _text(m: BaseMessage) -> str:
+        return m.content if isinstance(m.content, str) else json.dumps(m.content, default=str)
+
+    def _reply(self, messages: list[BaseMessage], tools: Optional[list]) -> AIMessage:
+        humans = [self._text(m) for m in messages if isinstance(m, HumanMessage)]
+        question = next((h for h in reversed(humans) if not h.startswith(("Attachments available", "Tool results"))), "")
+        last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+        observed = [self._text(m) for m in messages[last_human + 1:] if isinstance(m, ToolMessage)]
+        digest = hashlib.sha256("\n".join(self._text(m) for m in messages).encode("utf-8")).hexdigest()
+        names = {t["function"]["name"] for t in tools or []}
+        n_in = sum(len(self._text(m).split()) for m in messages)
+        if names and not observed:
+            images = any(h.startswith("Attachments available") and "image" in h for h in humans[-1:])
+            if images and "classify_crop_disease" in names:
+                call = {"name": "classify_crop_disease", "args": {"image_idx": 0}}
+            elif _FAKE_WEATHER.search(question) and "get_weather" in names:
+                m = _FAKE_CITY.search(question)
+                call = {"name": "get_weather", "args": {"city": m.group(1) if m else "Delhi"}}
+            elif "rag_search" in names:
+                call = {"name": "rag_search", "args": {"query": question}}
+            else:
+                call = None
+            if call is not None:
+                return AIMessage(content="", tool_calls=[{**call, "id": f"call_{digest[:12]}"}],
+                                 usage_metadata=UsageMetadata(input_tokens=n_in, output_tokens=8, total_tokens=n_in + 8))
+        start = int(digest[:8], 16) % len(_FAKE_FILLER)
+        words = [f"(fake answer to: {question[:60]})"] + [
+            _FAKE_FILLER[(start + i) % len(_FAKE_FILLER)] for i in range(max(0, self.answer_tokens - 1))]
+        if observed:
+            words.insert(1, f"[{len(observed)} tool result(s), {sum(len(o) for o in observed)} chars]")
+        return AIMessage(content=" ".join(words),
+                         usage_metadata=UsageMetadata(input_tokens=n_in, output_tokens=len(words), total_tokens=n_in + len(words)))
+
+    def _pieces(self, msg: AIMessage) -> list[ChatGenerationChunk]:
+        if msg.tool_calls:
+            return [_as_chunk(ChatResult(generations=[ChatGeneration(message=msg)]))]
+        words = msg.content.split(" ")
+        pieces = [ChatGenerationChunk(message=AIMessageChunk(content=w if i == 0 else " " + w)) for i, w in enumerate(words)]
+        pieces[-1].message.usage_metadata = msg.usage_metadata
+        return pieces
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+
+    def _generate(self, messages, stop=None, run_manager=None, tools=None, **kwargs) -> ChatResult:
+        msg = self._reply(messages, tools)
+        time.sleep(self.latency_ms / 1000 + self._token_delay() * max(0, len(self._pieces(msg)) - 1))
+        return ChatResult(generations=[ChatGeneration(message=msg)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, **kwargs) -> ChatResult:
+        msg = self._reply(messages, tools)
+        await asyncio.sleep(self.latency_ms / 1000 + self._token_delay() * max(0, len(self._pieces(msg)) - 1))
+        return ChatResult(generations=[ChatGeneration(message=msg)])
+
+    def _stream(self, messages, stop=None, run_manager=None, tools=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency_ms / 1000)
+        for i, piece in enumerate(self._pieces(self._reply(messages, tools))):
+            if i:
+                time.sleep(self._token_delay())
+            yield piece
+
+    async def _astream(self, messages, stop=None, run_manager=None, tools=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        for i, piece in enumerate(self._pieces(self._reply(messages, tools))):
+            if i:
+                await asyncio.sleep(self._token_delay())
+            yield piece
+
+# ---- factory --------------------------------------------------------------------------------
+def _provider_model(provider: str) -> BaseChatModel:
+    # Provider SDKs are imported here, so only the selected one is loaded.
     if provider == "gemini":
         if not settings.GEMINI_API_KEY:
             raise RuntimeError("GEMINI_API_KEY not set")
+        from langchain_google_genai import ChatGoogleGenerativeAI
         return ChatGoogleGenerativeAI(
             model=settings.GEMINI_MODEL,
             google_api_key=settings.GEMINI_API_KEY,
             temperature=0.2,
+            max_retries=1,  # retries happen in ManagedChatModel, with backoff
+            timeout=settings.LLM_TIMEOUT_S,
         )
     elif provider == "ollama":
+        from langchain_ollama import ChatOllama
         return ChatOllama(
             base_url=settings.OLLAMA_BASE_URL,
             model=settings.OLLAMA_MODEL,
             temperature=0.2,
             stream=True,
+            keep_alive=settings.OLLAMA_KEEP_ALIVE,
+            client_kwargs={"timeout": settings.LLM_TIMEOUT_S},
         )
+    elif provider == "fake":
+        return FakeChatModel(latency_ms=settings.FAKE_LLM_LATENCY_MS, tokens_per_s=settings.FAKE_LLM_TOKENS_PER_S,
+                             answer_tokens=settings.FAKE_LLM_ANSWER_TOKENS)
     else:
         raise ValueError(f"Unknown USE_LLM={provider}")
+
+_llms: dict[str, ManagedChatModel] = {}
+_llms_lock = threading.Lock()
+
+def get_llm() -> BaseChatModel:
+    """Process-wide model for USE_LLM; one client (and connection pool) per provider."""
+    provider = settings.USE_LLM.lower()
+    llm = _llms.get(provider)
+    if llm is None:
+        with _llms_lock:
+            llm = _llms.get(provider)
+            if llm is None:
+                llm = _llms[provider] = ManagedChatModel(provider=provider, inner=_provider_model(provider))
+    return llm
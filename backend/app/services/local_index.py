@@ -0,0 +1,251 @@
+from __future__ import annotations
+from typing import Iterable, Optional, Sequence
+import json, os, shutil, threading, time
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-writer only
+    fcntl = None
+
+# On-disk layout of one index (one directory per namespace):
+#   CURRENT              name of the live generation directory
+#   gen-*/header.json    {"dim", "dtype", "count"}
+#   gen-*/vectors.bin    row-major float32 or int8 matrix, rows L2-normalized
+#   gen-*/scales.bin     float32 per-row dequantization scale (int8 only)
+#   gen-*/meta.jsonl     sidecar {"id", "text", "metadata"} per row
+#   gen-*/meta.idx       uint64 byte offsets into meta.jsonl (count + 1)
+# Every commit writes a fresh generation and swaps CURRENT atomically, so
+# readers never see a half-written file. All files are opened with np.memmap
+# (read-only, shared mapping), so every worker on the host reads the same
+# pages from the OS page cache instead of holding a private copy. Nothing is
+# closed explicitly: a search still holding an old snapshot keeps its
+# mappings until the snapshot is garbage-collected.
+
+_BLOCK_ROWS = 65536
+_DTYPES = {"float32": np.float32, "int8": np.int8}
+
+def _normalize_rows(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+def _quantize(mat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    scales = np.abs(mat).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(mat / scales[:, None]), -127, 127).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+class _Snapshot:
+    """Read-only view of one committed generation."""
+
+    def __init__(self, path: str) -> None:
+        with open(os.path.join(path, "header.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        self.path = path
+        self.dim: int = header["dim"]
+        self.dtype: str = header["dtype"]
+        self.count: int = header["count"]
+        self.vectors = self.scales = self.offsets = self.meta = None
+        if self.count:
+            shape = (self.count, self.dim)
+            self.vectors = np.memmap(os.path.join(path, "vectors.bin"), dtype=_DTYPES[self.dtype], mode="r", shape=shape)
+            if self.dtype == "int8":
+                self.scales = np.memmap(os.path.join(path, "scales.bin"), dtype=np.float32, mode="r", shape=(self.count,))
+            self.offsets = np.memmap(os.path.join(path, "meta.idx"), dtype=np.uint64, mode="r", shape=(self.count + 1,))
+            self.meta = np.memmap(os.path.join(path, "meta.jsonl"), dtype=np.uint8, mode="r")
+
+    def record(self, row: int) -> dict:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self.meta[start:end].tobytes())
+
+    def records(self) -> Iterable[dict]:
+        if not self.count:
+            return
+        with open(os.path.join(self.path, "meta.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def rows_float32(self, start: int, end: int) -> np.ndarray:
+        block = np.asarray(self.vectors[start:end], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[start:end, None]
+        return block
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        out = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, _BLOCK_ROWS):
+            end = min(start + _BLOCK_ROWS, self.count)
+            block = self.vectors[start:end]
+            if self.scales is None:
+                out[start:end] = block @ query
+            else:
+                out[start:end] = (block.astype(np.float32) @ query) * self.scales[start:end]
+        return out
+
+class LocalVectorIndex:
+    """Cosine top-k index over memory-mapped float32 or int8 vectors.
+
+    Writes are buffered with upsert()/delete() and published by commit().
+    """
+
+    def __init__(self, root: str, dtype: str = "float32") -> None:
+        if dtype not in _DTYPES:
+            raise ValueError(f"Unknown local index dtype={dtype} (float32|int8)")
+        self.root = root
+        self.dtype = dtype
+        self._lock = threading.Lock()
+        self._snap: Optional[_Snapshot] = None
+        self._snap_key: Optional[tuple] = None
+        self._pending: dict[str, tuple[np.ndarray, str, dict]] = {}
+        self._deleted: set[str] = set()
+
+    # ---- reading -------------------------------------------------------
+    def _current_path(self) -> tuple[Optional[str], Optional[tuple]]:
+        marker = os.path.join(self.root, "CURRENT")
+        try:
+            st = os.stat(marker)
+            with open(marker, "r", encoding="utf-8") as f:
+                gen = f.read().strip()
+        except FileNotFoundError:
+            return None, None
+        return os.path.join(self.root, gen), (st.st_ino, st.st_mtime_ns, gen)
+
+    def snapshot(self) -> Optional[_Snapshot]:
+        while True:
+            path, key = self._current_path()
+            if key is None:
+                return None
+            with self._lock:
+                if key == self._snap_key:
+                    return self._snap
+                try:
+                    self._snap, self._snap_key = _Snapshot(path), key
+                    return self._snap
+                except FileNotFoundError:
+                    continue  # pruned by commits since we read CURRENT: read it again
+
+    def __len__(self) -> int:
+        snap = self.snapshot()
+        return snap.count if snap else 0
+
+    def search(self, query: Sequence[float] | np.ndarray, k: int = 4) -> list[tuple[dict, float]]:
+        snap = self.snapshot()
+        if snap is None or snap.count == 0:
+            return []
+        q = np.asarray(query, dtype=np.float32).ravel()
+        if q.shape[0] != snap.dim:
+            raise ValueError(f"query dim {q.shape[0]} != index dim {snap.dim}")
+        norm = float(np.linalg.norm(q))
+        if norm:
+            q = q / norm
+        scores = snap.scores(q)
+        k = min(k, snap.count)
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(snap.record(int(i)), float(scores[i])) for i in top]
+
+    # ---- writing -------------------------------------------------------
+    def upsert(self, ids: Sequence[str], vectors: Sequence[Sequence[float]] | np.ndarray,
+               texts: Sequence[str], metadatas: Optional[Sequence[dict]] = None) -> None:
+        mat = np.asarray(vectors, dtype=np.float32)
+        if mat.ndim != 2 or mat.shape[0] != len(ids) or len(texts) != len(ids):
+            raise ValueError("ids, vectors and texts must have the same length")
+        metadatas = metadatas or [{} for _ in ids]
+        for i, doc_id in enumerate(ids):
+            self._deleted.discard(doc_id)
+            self._pending[doc_id] = (mat[i], texts[i], dict(metadatas[i] or {}))
+
+    def delete(self, ids: Iterable[str]) -> None:
+        for doc_id in ids:
+            self._pending.pop(doc_id, None)
+            self._deleted.add(doc_id)
+
+    def commit(self) -> int:
+        """Publish buffered writes as a new generation; returns the new row count."""
+        if not self._pending and not self._deleted:
+            return len(self)
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            count = self._write_generation()
+        self._pending.clear()
+        self._deleted.clear()
+        return count
+
+    def _write_generation(self) -> int:
+        old = self.snapshot()
+        replaced = self._deleted | set(self._pending)
+        keep: list[tuple[int, dict]] = []
+        if old is not None:
+            keep = [(row, rec) for row, rec in enumerate(old.records()) if rec["id"] not in replaced]
+        new = list(self._pending.items())
+        dims = {v.shape[0] for _, (v, _, _) in new}
+        if old is not None and old.count:
+            dims.add(old.dim)
+        if len(dims) > 1:
+            raise ValueError(f"vector dimension mismatch: {sorted(dims)}")
+        dim = dims.pop() if dims else (old.dim if old else 0)
+        count = len(keep) + len(new)
+
+        gen = f"gen-{time.time_ns()}"
+        path = os.path.join(self.root, gen)
+        os.makedirs(path)
+        if count:
+            vec_out = np.memmap(os.path.join(path, "vectors.bin"), dtype=_DTYPES[self.dtype], mode="w+", shape=(count, dim))
+            scale_out = None
+            if self.dtype == "int8":
+                scale_out = np.memmap(os.path.join(path, "scales.bin"), dtype=np.float32, mode="w+", shape=(count,))
+            offsets = np.zeros(count + 1, dtype=np.uint64)
+            row_out = row_meta = 0
+
+            def write_rows(mat: np.ndarray) -> None:
+                nonlocal row_out
+                mat = _normalize_rows(mat)
+                end = row_out + mat.shape[0]
+                if scale_out is None:
+                    vec_out[row_out:end] = mat
+                else:
+                    vec_out[row_out:end], scale_out[row_out:end] = _quantize(mat)
+                row_out = end
+
+            with open(os.path.join(path, "meta.jsonl"), "wb") as meta:
+                for start in range(0, len(keep), _BLOCK_ROWS):
+                    chunk = keep[start:start + _BLOCK_ROWS]
+                    write_rows(np.concatenate([old.rows_float32(row, row + 1) for row, _ in chunk]))
+                    for _, rec in chunk:
+                        meta.write(json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n")
+                        offsets[row_meta + 1] = meta.tell()
+                        row_meta += 1
+                for start in range(0, len(new), _BLOCK_ROWS):
+                    chunk = new[start:start + _BLOCK_ROWS]
+                    write_rows(np.stack([v for _, (v, _, _) in chunk]))
+                    for doc_id, (_, text, md) in chunk:
+                        rec = {"id": doc_id, "text": text, "metadata": md}
+                        meta.write(json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n")
+                        offsets[row_meta + 1] = meta.tell()
+                        row_meta += 1
+            offsets.tofile(os.path.join(path, "meta.idx"))
+            vec_out.flush()
+            if scale_out is not None:
+                scale_out.flush()
+            del vec_out, scale_out
+        with open(os.path.join(path, "header.json"), "w", encoding="utf-8") as f:
+            json.dump({"dim": dim, "dtype": self.dtype, "count": count}, f)
+
+        marker_tmp = os.path.join(self.root, "CURRENT.tmp")
+        with open(marker_tmp, "w", encoding="utf-8") as f:
+            f.write(gen)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(marker_tmp, os.path.join(self.root, "CURRENT"))
+        self._prune(keep_names={gen, os.path.basename(old.path) if old else gen})
+        return count
+
+    def _prune(self, keep_names: set[str]) -> None:
+        # Readers still mapping an unlinked generation keep working until they
+        # notice CURRENT changed; the previous generation is kept as a grace period.
+        for name in os.listdir(self.root):
+            if name.startswith("gen-") and name not in keep_names:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
@@ -0,0 +1,247 @@
+from __future__ import annotations
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, Sequence
+import contextvars, functools, inspect, logging, re, threading, time
+
+logger = logging.getLogger(__name__)
+
+# Timings observed while a request is being traced (see app.services.tracing),
+# so a slow request can be broken down by stage in its log line.
+_spans: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("metric_spans", default=None)
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+class Histogram:
+    """Cumulative-bucket histogram, safe to observe from any thread."""
+
+    def __init__(self, name: str, buckets: Sequence[float], help: str = "", labels: Optional[dict] = None) -> None:
+        self.name = name
+        self.help = help
+        self.labels = dict(labels or {})
+        self.key = _key(name, self.labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+        self._timing = name.endswith("_ms")
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+        if self._timing:
+            spans = _spans.get()
+            if spans is not None:
+                spans.append((self.key, value))
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the duration of the block in milliseconds."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - t0) * 1000)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts, total, n = list(self._counts), self._sum, self._count
+        cumulative, running = {}, 0
+        for le, c in zip(list(self.buckets) + [float("inf")], counts):
+            running += c
+            cumulative[le] = running
+        return {"buckets": cumulative, "sum": total, "count": n}
+
+class Counter:
+    def __init__(self, name: str, help: str = "", labels: Optional[dict] = None) -> None:
+        self.name = name
+        self.help = help
+        self.labels = dict(labels or {})
+        self.key = _key(name, self.labels)
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+class Gauge(Counter):
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """Count the block as in flight."""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+_registry: dict[str, Histogram] = {}
+_counters: dict[str, Counter] = {}
+_collectors: list[tuple[str, Callable[[], dict], Optional[str]]] = []
+_registry_lock = threading.Lock()
+
+def histogram(name: str, buckets: Sequence[float], help: str = "", **labels) -> Histogram:
+    """Return the process-wide histogram called `name` (with these labels), creating it on first use."""
+    key = _key(name, labels)
+    with _registry_lock:
+        h = _registry.get(key)
+        if h is None:
+            h = _registry[key] = Histogram(name, buckets, help, labels)
+        return h
+
+def _metric(cls, name: str, help: str, labels: dict):
+    key = _key(name, labels)
+    with _registry_lock:
+        m = _counters.get(key)
+        if m is None:
+            m = _counters[key] = cls(name, help, labels)
+        return m
+
+def counter(name: str, help: str = "", **labels) -> Counter:
+    return _metric(Counter, name, help, labels)
+
+def gauge(name: str, help: str = "", **labels) -> Gauge:
+    return _metric(Gauge, name, help, labels)
+
+def register_stats(prefix: str, fn: Callable[[], dict], label: Optional[str] = None) -> None:
+    """Export the numbers of a component's stats() dict as gauges at scrape time.
+
+    With `label`, top-level keys are label values ({"geocode": {"hits": 3}} ->
+    prefix_hits{label="geocode"}); otherwise nested dicts become
+    prefix_<key>{key="<inner key>"}.
+    """
+    with _registry_lock:
+        if not any(p == prefix for p, _, _ in _collectors):
+            _collectors.append((prefix, fn, label))
+
+_NUMBER = (int, float)
+_BAD_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+
+def _flatten(prefix: str, stats: dict, label: Optional[str]) -> Iterator[tuple[str, dict, float]]:
+    for k, v in stats.items():
+        if isinstance(v, _NUMBER):
+            yield _BAD_CHARS.sub("_", f"{prefix}_{k}"), {}, float(v)
+        elif isinstance(v, dict):
+            for k2, v2 in v.items():
+                if not isinstance(v2, _NUMBER):
+                    continue
+                if label:
+                    yield _BAD_CHARS.sub("_", f"{prefix}_{k2}"), {label: k}, float(v2)
+                else:
+                    yield _BAD_CHARS.sub("_", f"{prefix}_{k}"), {"key": k2}, float(v2)
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+def timed(kind: str, name: str, buckets: Sequence[float] = LATENCY_BUCKETS_MS) -> Callable:
+    """Decorator recording <kind>_ms, <kind>_in_flight and <kind>_errors_total
+    with label {kind: name}. A returned {"error": ...} dict counts as an error."""
+    def wrap(fn: Callable) -> Callable:
+        hist = histogram(f"{kind}_ms", buckets, f"{kind} call duration", **{kind: name})
+        in_flight = gauge(f"{kind}_in_flight", f"{kind} calls running", **{kind: name})
+        errors = counter(f"{kind}_errors_total", f"{kind} calls that raised or returned an error", **{kind: name})
+
+        def check(result):
+            if isinstance(result, dict) and "error" in result:
+                errors.inc()
+            return result
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def ainner(*args, **kwargs):
+                with hist.time(), in_flight.track():
+                    try:
+                        return check(await fn(*args, **kwargs))
+                    except Exception:
+                        errors.inc()
+                        raise
+            return ainner
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with hist.time(), in_flight.track():
+                try:
+                    return check(fn(*args, **kwargs))
+                except Exception:
+                    errors.inc()
+                    raise
+        return inner
+    return wrap
+
+@contextmanager
+def collect_spans() -> Iterator[list]:
+    """Collect (metric, ms) for every *_ms histogram observed in this context,
+    including work handed to pools via executors.run_blocking/submit."""
+    spans: list = []
+    token = _spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _spans.reset(token)
+
+def snapshot() -> dict[str, dict]:
+    with _registry_lock:
+        items = list(_registry.items())
+    return {key: h.snapshot() for key, h in items}
+
+def _num(v: float) -> str:
+    if v != v:
+        return "NaN"
+    if v in (float("inf"), float("-inf")):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _registry_lock:
+        hists = list(_registry.values())
+        counters = list(_counters.values())
+        collectors = list(_collectors)
+    families: dict[str, tuple[str, str, list[str]]] = {}
+
+    def family(name: str, kind: str, help: str) -> list[str]:
+        if name not in families:
+            families[name] = (kind, help, [])
+        return families[name][2]
+
+    for h in hists:
+        snap = h.snapshot()
+        lines = family(h.name, "histogram", h.help)
+        for le, c in snap["buckets"].items():
+            lines.append(f"{_key(h.name + '_bucket', {**h.labels, 'le': _num(le)})} {c}")
+        lines.append(f"{_key(h.name + '_sum', h.labels)} {_num(snap['sum'])}")
+        lines.append(f"{_key(h.name + '_count', h.labels)} {snap['count']}")
+    for m in counters:
+        family(m.name, "gauge" if isinstance(m, Gauge) else "counter", m.help).append(f"{m.key} {_num(m.value)}")
+    for prefix, fn, label in collectors:
+        try:
+            stats = fn() or {}
+        except Exception:
+            logger.debug("metrics collector %s failed", prefix, exc_info=True)
+            continue
+        for name, labels, value in _flatten(prefix, stats, label):
+            family(name, "gauge", f"{prefix} stats").append(f"{_key(name, labels)} {_num(value)}")
+
+    out = []
+    for name, (kind, help, lines) in families.items():
+        if help:
+            out.append(f"# HELP {name} {help}")
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
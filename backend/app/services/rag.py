@@ -1,22 +1,204 @@
 from __future__ import annotations
-from typing import Optional
-import re
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from typing import TYPE_CHECKING, Optional
+import hashlib, os, re, threading, unicodedata, uuid, warnings
+import numpy as np
+from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
-from langchain_pinecone import PineconeVectorStore
-
-from pinecone import Pinecone, ServerlessSpec, CloudProvider, AwsRegion, GcpRegion, AzureRegion, Metric
 
 from app.config import settings
+from app.services.cache import TTLCache, bump_generation, read_generation
+from app.services.batching import MicroBatcher
+from app.services.local_index import LocalVectorIndex
+from app.services.metrics import histogram, register_stats
+
+# The Pinecone SDK, langchain_pinecone and the HF embedding stack are imported
+# where first used: the local backend never needs Pinecone, and the E5 load
+# belongs to warm_up() rather than to `import app.main`.
+if TYPE_CHECKING:
+    import torch
+    from langchain_pinecone import PineconeVectorStore
+    from pinecone import Pinecone
+
+# One embedding model, Pinecone client and vector store per process.
+_lock = threading.RLock()
+_emb: Embeddings | None = None
+_client: Pinecone | None = None
+_vectorstore: PineconeVectorStore | None = None
+_local_indexes: dict[str, LocalVectorIndex] = {}
+_index_ready = False
+
+_STAGE_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+_embed_ms = histogram("rag_stage_ms", _STAGE_BUCKETS_MS, "RAG time per stage (cache misses only)", stage="embed")
+_retrieve_ms = histogram("rag_stage_ms", _STAGE_BUCKETS_MS, "RAG time per stage (cache misses only)", stage="retrieve")
+
+# normalized query -> float32 vector; (query, k, namespace, generation) -> matches
+_query_cache = TTLCache(settings.RAG_QUERY_CACHE_SIZE, settings.RAG_QUERY_CACHE_TTL_S)
+_result_cache = TTLCache(settings.RAG_RESULT_CACHE_SIZE, settings.RAG_RESULT_CACHE_TTL_S)
+
+EMBEDDING_ENGINES = ("eager", "int8", "torchscript", "hf")
+
+def _last_hidden_state(model: torch.nn.Module) -> torch.nn.Module:
+    """(input_ids, attention_mask) -> last_hidden_state, so eager and traced engines share one call signature."""
+    import torch
+
+    class _Encoder(torch.nn.Module):
+        def __init__(self, model: torch.nn.Module) -> None:
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+    return _Encoder(model)
+
+class E5Embeddings(Embeddings):
+    """E5 encoder run on transformers directly: "query: " / "passage: " prefixes,
+    mean pooling and L2 normalisation, as the model card prescribes.
+
+    Documents are sorted by token length and padded per batch, so a batch of
+    short passages does not pay for the longest one. Concurrent embed_query
+    calls are coalesced by a MicroBatcher. Engines: eager (fp32), int8 (dynamic
+    quantization of the Linear layers) and torchscript (traced and frozen),
+    both converted at load time.
+    """
+
+    def __init__(self, model_name: str, engine: str = "eager", batch_size: int = 32, max_length: int = 512,
+                 query_prefix: str = "query: ", passage_prefix: str = "passage: ",
+                 query_batch_max_size: int = 16, query_batch_max_wait_ms: float = 2.0) -> None:
+        from transformers import AutoModel, AutoTokenizer
+        if engine not in ("eager", "int8", "torchscript"):
+            raise ValueError(f"Unknown E5 engine={engine} (eager|int8|torchscript)")
+        self.engine = engine
+        self.batch_size = max(1, batch_size)
+        self.query_prefix = query_prefix
+        self.passage_prefix = passage_prefix
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.max_length = min(max_length, self.tokenizer.model_max_length)
+        self.pad_id = self.tokenizer.pad_token_id or 0
+        model = _last_hidden_state(AutoModel.from_pretrained(model_name)).eval()
+        self.model = self._convert(model, engine) if engine != "eager" else model
+        self._batcher = (MicroBatcher(self._encode_rows, query_batch_max_size, query_batch_max_wait_ms, name="embed_query")
+                         if query_batch_max_size > 1 else None)
+
+    @staticmethod
+    def _convert(model: torch.nn.Module, engine: str) -> torch.nn.Module:
+        import torch
+        # Single-threaded: this may run in a pre-fork master (gunicorn_conf.py),
+        # and an OpenMP pool started before fork() hangs the children.
+        threads = torch.get_num_threads()
+        torch.set_num_threads(1)
+        try:
+            if engine == "int8":
+                return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            example = (torch.ones((2, 16), dtype=torch.long), torch.ones((2, 16), dtype=torch.long))
+            with torch.no_grad(), warnings.catch_warnings():
+                warnings.simplefilter("ignore", torch.jit.TracerWarning)
+                return torch.jit.freeze(torch.jit.trace(model, example, strict=False))
+        finally:
+            torch.set_num_threads(threads)
+
+    def encode(self, texts: list[str], prefix: str = "") -> np.ndarray:
+        """Normalised float32 vectors, one row per text, in input order."""
+        import torch
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        ids = self.tokenizer([prefix + t for t in texts], truncation=True, max_length=self.max_length,
+                             add_special_tokens=True, return_attention_mask=False)["input_ids"]
+        order = sorted(range(len(ids)), key=lambda i: len(ids[i]))
+        out: np.ndarray | None = None
+        for start in range(0, len(order), self.batch_size):
+            chunk = order[start:start + self.batch_size]
+            width = max(len(ids[i]) for i in chunk)
+            input_ids = torch.full((len(chunk), width), self.pad_id, dtype=torch.long)
+            mask = torch.zeros((len(chunk), width), dtype=torch.long)
+            for row, i in enumerate(chunk):
+                input_ids[row, :len(ids[i])] = torch.tensor(ids[i])
+                mask[row, :len(ids[i])] = 1
+            with torch.inference_mode():
+                hidden = self.model(input_ids, mask)
+                m = mask.unsqueeze(-1).to(hidden.dtype)
+                pooled = torch.nn.functional.normalize((hidden * m).sum(1) / m.sum(1).clamp(min=1.0), dim=-1)
+            if out is None:
+                out = np.empty((len(texts), pooled.shape[-1]), dtype=np.float32)
+            out[chunk] = pooled.numpy()
+        return out
+
+    def _encode_rows(self, texts: list[str]) -> list[np.ndarray]:
+        return list(self.encode(texts))
+
+    def encode_query(self, text: str) -> np.ndarray:
+        text = self.query_prefix + text
+        return self._batcher(text) if self._batcher else self.encode([text])[0]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.encode_query(text).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.encode(texts, self.passage_prefix).tolist()
 
 def _embeddings() -> Embeddings:
-    # Multilingual E5-base (dim=768) by default
-    return HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL)
+    global _emb
+    if _emb is None:
+        with _lock:
+            if _emb is None:
+                # Multilingual E5-base (dim=768) by default
+                engine = (settings.EMBEDDING_ENGINE or "eager").lower()
+                if engine not in EMBEDDING_ENGINES:
+                    raise ValueError(f"Unknown EMBEDDING_ENGINE={engine} ({'|'.join(EMBEDDING_ENGINES)})")
+                if engine == "hf":
+                    # Generic sentence-transformers wrapper: no E5 prefixes or query batching.
+                    from langchain_community.embeddings import HuggingFaceEmbeddings
+                    _emb = HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL)
+                else:
+                    _emb = E5Embeddings(settings.EMBEDDING_MODEL, engine=engine,
+                                        batch_size=settings.EMBEDDING_BATCH_SIZE,
+                                        max_length=settings.EMBEDDING_MAX_LENGTH,
+                                        query_prefix=settings.EMBEDDING_QUERY_PREFIX,
+                                        passage_prefix=settings.EMBEDDING_PASSAGE_PREFIX,
+                                        query_batch_max_size=settings.EMBEDDING_QUERY_BATCH_MAX_SIZE,
+                                        query_batch_max_wait_ms=settings.EMBEDDING_QUERY_BATCH_MAX_WAIT_MS)
+    return _emb
+
+def embedding_fingerprint() -> str:
+    """Identifies the vector space stored vectors were embedded in: model,
+    precision and E5 prefixes. Empty for the default model without prefixes
+    in fp32, the space every index was built in before prefixes existed."""
+    engine = (settings.EMBEDDING_ENGINE or "eager").lower()
+    if engine == "hf":
+        parts = (settings.EMBEDDING_MODEL, "fp32", "", "")
+    else:
+        parts = (settings.EMBEDDING_MODEL, "int8" if engine == "int8" else "fp32",
+                 settings.EMBEDDING_QUERY_PREFIX, settings.EMBEDDING_PASSAGE_PREFIX)
+    if parts == ("intfloat/multilingual-e5-base", "fp32", "", ""):
+        return ""
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:12]
 
 def _pc() -> Pinecone:
-    if not settings.PINECONE_API_KEY:
-        raise RuntimeError("PINECONE_API_KEY not set")
-    return Pinecone(api_key=settings.PINECONE_API_KEY)
+    global _client
+    if _client is None:
+        if not settings.PINECONE_API_KEY:
+            raise RuntimeError("PINECONE_API_KEY not set")
+        with _lock:
+            if _client is None:
+                from pinecone import Pinecone
+                _client = Pinecone(api_key=settings.PINECONE_API_KEY)
+    return _client
+
+def _backend() -> str:
+    backend = (settings.VECTOR_BACKEND or "pinecone").lower()
+    if backend not in ("pinecone", "local"):
+        raise ValueError(f"Unknown VECTOR_BACKEND={backend}")
+    return backend
+
+def local_index(namespace: str | None = None) -> LocalVectorIndex:
+    ns = namespace or settings.PINECONE_NAMESPACE
+    idx = _local_indexes.get(ns)
+    if idx is None:
+        with _lock:
+            idx = _local_indexes.get(ns)
+            if idx is None:
+                root = os.path.join(settings.LOCAL_INDEX_DIR, ns)
+                idx = _local_indexes[ns] = LocalVectorIndex(root, dtype=settings.LOCAL_INDEX_DTYPE)
+    return idx
 
 def _normalized_index_name(raw_name: str) -> str:
     name = (raw_name or "default-index").lower()
@@ -25,6 +207,7 @@ def _normalized_index_name(raw_name: str) -> str:
     return name or "default-index"
 
 def _cloud_provider(s: str):
+    from pinecone import CloudProvider
     s = (s or "aws").lower()
     if s == "aws":
         return CloudProvider.AWS
@@ -36,6 +219,7 @@ def _cloud_provider(s: str):
 
 def _region_enum(cloud: str, region: str):
     # best-effort conversion to Enum; fall back to raw string if not matched
+    from pinecone import AwsRegion, AzureRegion, GcpRegion
     key = (region or "").upper().replace("-", "_")
     try:
         if cloud == "aws":
@@ -48,11 +232,16 @@ def _region_enum(cloud: str, region: str):
         pass
     return region  # let SDK handle string
 
-def ensure_index_exists() -> None:
+def ensure_index_exists(force: bool = False) -> None:
+    """Create the index if missing. The answer is cached for the process lifetime."""
+    global _index_ready
+    if (_index_ready and not force) or _backend() == "local":
+        return
     pc = _pc()
     idx = _normalized_index_name(settings.PINECONE_INDEX)
     names = pc.list_indexes().names()
     if idx not in names:
+        from pinecone import Metric, ServerlessSpec
         emb = _embeddings()
         dim = len(emb.embed_query("dimension probe"))
         cloud = settings.PINECONE_CLOUD.lower()
@@ -66,14 +255,123 @@ def ensure_index_exists() -> None:
                 region=_region_enum(cloud, region)
             )
         )
+    _index_ready = True
+
+def get_vectorstore() -> PineconeVectorStore:
+    global _vectorstore
+    if _vectorstore is None:
+        ensure_index_exists()
+        emb = _embeddings()
+        with _lock:
+            if _vectorstore is None:
+                from langchain_pinecone import PineconeVectorStore
+                name = _normalized_index_name(settings.PINECONE_INDEX)
+                _vectorstore = PineconeVectorStore(
+                    index=_pc().Index(name),
+                    embedding=emb,
+                    namespace=settings.PINECONE_NAMESPACE,
+                )
+    return _vectorstore
 
 def load_retriever(k: int = 4):
+    return get_vectorstore().as_retriever(search_kwargs={"k": k})
+
+def _normalize_query(text: str) -> str:
+    # Also what gets embedded, so case is kept: the E5 tokenizer is cased.
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split())
+
+def embed_query(text: str) -> np.ndarray:
+    key = _normalize_query(text)
+    vec = _query_cache.get(key)
+    if vec is None:
+        with _embed_ms.time():
+            emb = _embeddings()
+            if isinstance(emb, E5Embeddings):
+                vec = emb.encode_query(key)
+            else:
+                vec = np.asarray(emb.embed_query(key), dtype=np.float32)
+        vec.setflags(write=False)
+        _query_cache.put(key, vec)
+    return vec
+
+def search(query: str, k: int = 4, namespace: str | None = None) -> list[dict]:
+    """Top-k passages for a query, served from cache when the namespace is unchanged."""
+    ns = namespace or settings.PINECONE_NAMESPACE
+    key = (_normalize_query(query), k, ns, read_generation(ns))
+    matches = _result_cache.get(key)
+    if matches is None:
+        vec = embed_query(query)
+        with _retrieve_ms.time():
+            if _backend() == "local":
+                hits = [(rec["text"], rec["metadata"], score) for rec, score in local_index(ns).search(vec, k=k)]
+            else:
+                docs = get_vectorstore().similarity_search_by_vector_with_score(vec.tolist(), k=k, namespace=ns)
+                hits = [(d.page_content, d.metadata, score) for d, score in docs]
+        matches = [{"text": text[:1200], "metadata": md, "score": float(score)} for text, md, score in hits]
+        _result_cache.put(key, matches)
+    return matches
+
+def embed_documents(texts: list[str]) -> np.ndarray:
     emb = _embeddings()
-    # Assumes ensure_index_exists has been called
-    vs = PineconeVectorStore(
-        index_name=_normalized_index_name(settings.PINECONE_INDEX),
-        embedding=emb,
-        namespace=settings.PINECONE_NAMESPACE,
-        pinecone_api_key=settings.PINECONE_API_KEY,
-    )
-    return vs.as_retriever(search_kwargs={"k": k})
+    if isinstance(emb, E5Embeddings):
+        return emb.encode(texts, emb.passage_prefix)
+    return np.asarray(emb.embed_documents(texts), dtype=np.float32)
+
+def upsert_vectors(ids: list[str], vectors: np.ndarray, texts: list[str], metadatas: list[dict],
+                   namespace: str | None = None) -> None:
+    """Write pre-computed vectors. Local writes are buffered until commit_writes()."""
+    ns = namespace or settings.PINECONE_NAMESPACE
+    if _backend() == "local":
+        local_index(ns).upsert(ids, vectors, texts, metadatas)
+        return
+    # Same layout as PineconeVectorStore: the passage text lives in metadata["text"].
+    rows = [{"id": i, "values": v.tolist(), "metadata": {**md, "text": t}}
+            for i, v, t, md in zip(ids, vectors, texts, metadatas)]
+    get_vectorstore().index.upsert(vectors=rows, namespace=ns)
+
+def delete_ids(ids: list[str], namespace: str | None = None, batch_size: int = 1000) -> None:
+    ns = namespace or settings.PINECONE_NAMESPACE
+    if _backend() == "local":
+        local_index(ns).delete(ids)
+        return
+    index = get_vectorstore().index
+    for start in range(0, len(ids), batch_size):
+        index.delete(ids=ids[start:start + batch_size], namespace=ns)
+
+def commit_writes(namespace: str | None = None) -> None:
+    """Publish buffered local writes and invalidate cached results everywhere."""
+    ns = namespace or settings.PINECONE_NAMESPACE
+    if _backend() == "local":
+        local_index(ns).commit()
+    invalidate_namespace(ns)
+
+def add_documents(docs: list[Document], ids: list[str] | None = None, namespace: str | None = None) -> int:
+    """Embed and write documents to the configured vector backend."""
+    ns = namespace or settings.PINECONE_NAMESPACE
+    ids = ids or [str(uuid.uuid4()) for _ in docs]
+    texts = [d.page_content for d in docs]
+    upsert_vectors(ids, embed_documents(texts), texts, [d.metadata for d in docs], namespace=ns)
+    commit_writes(ns)
+    return len(docs)
+
+def invalidate_namespace(namespace: str | None = None) -> None:
+    """Drop cached matches for a namespace here and in every other process."""
+    bump_generation(namespace or settings.PINECONE_NAMESPACE)
+    _result_cache.clear()
+
+def cache_stats() -> dict:
+    return {"query_embedding": _query_cache.stats(), "retrieval": _result_cache.stats()}
+
+register_stats("rag_cache", cache_stats, label="cache")
+
+def load_embeddings() -> None:
+    _embeddings()
+
+def warm_up() -> None:
+    """Load the embedding model and open the index handle ahead of the first query."""
+    _embeddings().embed_query("warm up")
+    if _backend() == "local":
+        local_index().snapshot()
+    else:
+        get_vectorstore()
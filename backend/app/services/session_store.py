@@ -0,0 +1,331 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, Sequence
+import atexit, json, os, sqlite3, threading, time
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from app.config import settings
+
+class SessionStore(ABC):
+    """Chat transcripts keyed by session id."""
+
+    @abstractmethod
+    def get_messages(self, session_id: str, limit: Optional[int] = None) -> list[BaseMessage]:
+        """Return the last `limit` messages (all when None), oldest first."""
+
+    @abstractmethod
+    def add_messages(self, session_id: str, messages: Sequence[BaseMessage]) -> None: ...
+
+    @abstractmethod
+    def clear(self, session_id: str) -> None: ...
+
+    @abstractmethod
+    def stats(self) -> dict: ...
+
+def _encode(message: BaseMessage) -> str:
+    return json.dumps(message_to_dict(message), ensure_ascii=False)
+
+def _decode(rows: Sequence[str]) -> list[BaseMessage]:
+    return messages_from_dict([json.loads(r) for r in rows])
+
+class _Session:
+    __slots__ = ("messages", "nbytes", "expires")
+
+    def __init__(self) -> None:
+        self.messages: list[str] = []
+        self.nbytes = 0
+        self.expires = 0.0
+
+class MemorySessionStore(SessionStore):
+    """In-process LRU store with per-session TTL and a global byte budget.
+
+    Messages are held JSON-encoded, so the budget counts real payload bytes
+    rather than Python object overhead.
+    """
+
+    def __init__(self, max_sessions: int, max_bytes: int, ttl: float, max_messages: int) -> None:
+        self.max_sessions = max(1, max_sessions)
+        self.max_bytes = max(1, max_bytes)
+        self.ttl = ttl
+        self.max_messages = max(1, max_messages)
+        self._sessions: OrderedDict[str, _Session] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evicted_lru = 0
+        self.evicted_ttl = 0
+
+    def _drop(self, session_id: str) -> None:
+        sess = self._sessions.pop(session_id, None)
+        if sess is not None:
+            self._bytes -= sess.nbytes
+
+    def _live(self, session_id: str, now: float) -> Optional[_Session]:
+        sess = self._sessions.get(session_id)
+        if sess is not None and sess.expires < now:
+            self._drop(session_id)
+            self.evicted_ttl += 1
+            return None
+        return sess
+
+    def get_messages(self, session_id: str, limit: Optional[int] = None) -> list[BaseMessage]:
+        with self._lock:
+            sess = self._live(session_id, time.monotonic())
+            if sess is None:
+                return []
+            self._sessions.move_to_end(session_id)
+            rows = sess.messages[-limit:] if limit else list(sess.messages)
+        return _decode(rows)
+
+    def add_messages(self, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        encoded = [_encode(m) for m in messages]
+        now = time.monotonic()
+        with self._lock:
+            sess = self._live(session_id, now)
+            if sess is None:
+                sess = self._sessions[session_id] = _Session()
+            self._sessions.move_to_end(session_id)
+            sess.expires = now + self.ttl
+            for row in encoded:
+                sess.messages.append(row)
+                sess.nbytes += len(row)
+                self._bytes += len(row)
+            overflow = len(sess.messages) - self.max_messages
+            if overflow > 0:
+                trimmed = sum(len(r) for r in sess.messages[:overflow])
+                del sess.messages[:overflow]
+                sess.nbytes -= trimmed
+                self._bytes -= trimmed
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        # Expired sessions first (oldest-used are at the front), then plain LRU.
+        for sid in list(self._sessions):
+            if self._sessions[sid].expires >= now:
+                break
+            self._drop(sid)
+            self.evicted_ttl += 1
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            sid = next(iter(self._sessions))
+            self._drop(sid)
+            self.evicted_lru += 1
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._drop(session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evicted_lru": self.evicted_lru,
+                "evicted_ttl": self.evicted_ttl,
+            }
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite (WAL) store shared by every worker on the host.
+
+    Appends are buffered and written in one transaction per flush interval;
+    this process reads its own unflushed messages from the buffer, other
+    workers see them after the next flush.
+    """
+
+    def __init__(self, path: str, ttl: float, flush_interval_ms: float, max_pending: int = 256) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000.0
+        self.max_pending = max_pending
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._pending: list[tuple[str, float, str]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.flushes = 0
+        self.evicted_ttl = 0
+        self._last_sweep = 0.0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                created REAL NOT NULL,
+                body TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, seq);
+            CREATE INDEX IF NOT EXISTS messages_created ON messages (created);
+            """
+        )
+        threading.Thread(target=self._flush_loop, name="session-store-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_messages(self, session_id: str, limit: Optional[int] = None) -> list[BaseMessage]:
+        now = time.time()
+        with self._lock:
+            pending = [(created, body) for sid, created, body in self._pending if sid == session_id]
+        if pending and pending[-1][0] < now - self.ttl:
+            return []  # expired before the next flush got to it
+        rows: list[str] = []
+        need = None if limit is None else limit - len(pending)
+        # Rows on disk belong to this session only if they were still live
+        # when the oldest buffered message arrived (or now, if none is buffered).
+        if (need is None or need > 0) and self._active(session_id, pending[0][0] if pending else now):
+            sql = "SELECT body FROM messages WHERE session_id = ? ORDER BY seq DESC"
+            params: tuple = (session_id,)
+            if need is not None:
+                sql += " LIMIT ?"
+                params += (need,)
+            rows = [r[0] for r in self._conn().execute(sql, params)]
+            rows.reverse()
+        rows += [body for _, body in pending]
+        return _decode(rows[-limit:] if limit else rows)
+
+    def _active(self, session_id: str, at: float) -> bool:
+        # Sliding TTL, as in MemorySessionStore: a session lives until `ttl`
+        # after its last message, and then expires as a whole.
+        row = self._conn().execute("SELECT created FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT 1",
+                                   (session_id,)).fetchone()
+        return row is not None and row[0] >= at - self.ttl
+
+    def add_messages(self, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        now = time.time()
+        with self._lock:
+            last = max((created for sid, created, _ in self._pending if sid == session_id), default=now)
+        if last < now - self.ttl:
+            # Still buffered but already expired: the session starts over.
+            with self._flush_lock, self._lock:
+                self._pending = [p for p in self._pending if p[0] != session_id]
+            self.evicted_ttl += 1
+        with self._lock:
+            self._pending.extend((session_id, now, _encode(m)) for m in messages)
+            full = len(self._pending) >= self.max_pending
+        if full or self.flush_interval == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+            if not batch:
+                return
+            conn = self._conn()
+            first: dict[str, float] = {}
+            for sid, created, _ in batch:
+                first.setdefault(sid, created)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # A session that expired before its new message arrived starts
+                # over, even if the sweep has not deleted its rows yet.
+                expired = sum(conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND "
+                    "(SELECT MAX(created) FROM messages WHERE session_id = ?) < ?",
+                    (sid, sid, created - self.ttl)).rowcount > 0 for sid, created in first.items())
+                conn.executemany("INSERT INTO messages (session_id, created, body) VALUES (?, ?, ?)", batch)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self.evicted_ttl += expired
+            # Drop the batch from the buffer only once it is readable from disk.
+            with self._lock:
+                del self._pending[:len(batch)]
+            self.flushes += 1
+
+    def _sweep(self) -> None:
+        expired = "SELECT session_id FROM messages GROUP BY session_id HAVING MAX(created) < ?"
+        cutoff = time.time() - self.ttl
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            sessions = conn.execute(f"SELECT COUNT(*) FROM ({expired})", (cutoff,)).fetchone()[0]
+            conn.execute(f"DELETE FROM messages WHERE session_id IN ({expired})", (cutoff,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.evicted_ttl += sessions
+
+    def _flush_loop(self) -> None:
+        interval = self.flush_interval or 1.0
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+                if time.monotonic() - self._last_sweep > 60:
+                    self._last_sweep = time.monotonic()
+                    self._sweep()
+            except sqlite3.Error:
+                # Retried on the next tick; the batch is still buffered.
+                pass
+
+    def clear(self, session_id: str) -> None:
+        with self._flush_lock, self._lock:
+            self._pending = [p for p in self._pending if p[0] != session_id]
+        self._conn().execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+
+    def stats(self) -> dict:
+        sessions, rows, nbytes = self._conn().execute(
+            "SELECT COUNT(DISTINCT session_id), COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM messages"
+        ).fetchone()
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "messages": rows,
+            "bytes": nbytes,
+            "pending": pending,
+            "flushes": self.flushes,
+            "evicted_ttl": self.evicted_ttl,
+        }
+
+class WindowedHistory(BaseChatMessageHistory):
+    """Chat history view that only loads the last `window` messages."""
+
+    def __init__(self, store: SessionStore, session_id: str, window: Optional[int]) -> None:
+        self.store = store
+        self.session_id = session_id
+        self.window = window
+
+    @property
+    def messages(self) -> list[BaseMessage]:  # type: ignore[override]
+        return self.store.get_messages(self.session_id, limit=self.window)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store.add_messages(self.session_id, messages)
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+def get_session_store() -> SessionStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = (settings.SESSION_STORE or "memory").lower()
+                if backend == "sqlite":
+                    _store = SQLiteSessionStore(settings.SESSION_SQLITE_PATH, settings.SESSION_TTL_S,
+                                                settings.SESSION_FLUSH_INTERVAL_MS)
+                elif backend == "memory":
+                    _store = MemorySessionStore(settings.SESSION_MAX_SESSIONS, settings.SESSION_MAX_BYTES,
+                                                settings.SESSION_TTL_S, settings.SESSION_MAX_MESSAGES)
+                else:
+                    raise ValueError(f"Unknown SESSION_STORE={backend}")
+    return _store
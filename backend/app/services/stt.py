@@ -1,15 +1,85 @@
 from __future__ import annotations
-import subprocess, tempfile, os
+import asyncio, io, logging, subprocess, tempfile, time, wave
 from typing import Optional
 from app.config import settings
+from app.services.metrics import histogram
+from app.services.whisper_pool import get_whisper_pool
 import httpx
 
-def _convert_to_wav(src_path: str) -> str:
-    ffmpeg = settings.FFMPEG_BIN
-    wav_path = src_path + ".wav"
-    cmd = [ffmpeg, "-y", "-i", src_path, "-ar", "16000", "-ac", "1", "-c:a", "pcm_s16le", wav_path]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return wav_path
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+_STAGE_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+_stage_ms = {
+    stage: histogram(f"stt_{stage}", _STAGE_BUCKETS_MS, f"STT {stage.split('_')[0]} time")
+    for stage in ("decode_ms", "queue_ms", "inference_ms", "total_ms")
+}
+
+def pcm_to_wav(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(pcm)
+    return buf.getvalue()
+
+def _is_whisper_wav(data: bytes) -> bool:
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return False
+    try:
+        with wave.open(io.BytesIO(data), "rb") as w:
+            return w.getnchannels() == 1 and w.getsampwidth() == 2 and w.getframerate() == SAMPLE_RATE
+    except (wave.Error, EOFError):
+        return False
+
+def _ffmpeg_cmd(src: str, stdin: bool, live: bool = False) -> list[str]:
+    cmd = [settings.FFMPEG_BIN, "-hide_banner", "-loglevel", "error"]
+    if not stdin:
+        cmd.append("-nostdin")
+    if live:
+        # Start decoding after the first few packets instead of probing megabytes.
+        cmd += ["-fflags", "nobuffer", "-probesize", "4096", "-analyzeduration", "0"]
+    cmd += ["-i", src, "-ar", str(SAMPLE_RATE), "-ac", "1", "-f", "s16le", "-c:a", "pcm_s16le"]
+    if live:
+        cmd += ["-flush_packets", "1"]
+    return cmd + ["pipe:1"]
+
+async def spawn_pcm_decoder() -> asyncio.subprocess.Process:
+    """ffmpeg reading a compressed stream (Ogg/WebM Opus, ...) on stdin and
+    writing 16 kHz mono PCM16 on stdout as it decodes."""
+    return await asyncio.create_subprocess_exec(
+        *_ffmpeg_cmd("pipe:0", True, live=True),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+    )
+
+def _ffmpeg_pcm(src: str, stdin: Optional[bytes]) -> bytes:
+    cmd = _ffmpeg_cmd(src, stdin is not None)
+    out = subprocess.run(cmd, input=stdin, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return out.stdout
+
+def decode_audio(data: Optional[bytes] = None, path: Optional[str] = None) -> bytes:
+    """Any ffmpeg-readable audio -> 16 kHz mono PCM16 WAV bytes, via pipes."""
+    if data is None:
+        if path is None:
+            raise ValueError("decode_audio needs data or path")
+        if path.lower().endswith(".wav"):
+            with open(path, "rb") as f:
+                data = f.read()
+            if _is_whisper_wav(data):
+                return data
+        return pcm_to_wav(_ffmpeg_pcm(path, None))
+    if _is_whisper_wav(data):
+        return data
+    try:
+        return pcm_to_wav(_ffmpeg_pcm("pipe:0", data))
+    except subprocess.CalledProcessError:
+        # Containers that need seeking (MP4/M4A with the index at the end)
+        # cannot be demuxed from a pipe.
+        with tempfile.NamedTemporaryFile(suffix=".audio") as f:
+            f.write(data)
+            f.flush()
+            return pcm_to_wav(_ffmpeg_pcm(f.name, None))
 
 def _parse_transcript(stdout: str) -> str:
     texts = []
@@ -25,51 +95,88 @@ def _parse_transcript(stdout: str) -> str:
     non_empty = [ln.strip() for ln in stdout.splitlines() if ln.strip()]
     return non_empty[-1] if non_empty else ""
 
-def _transcribe_local(audio_path: str, language: Optional[str]) -> str:
-    wav_path = audio_path if audio_path.lower().endswith(".wav") else _convert_to_wav(audio_path)
-    whisper_bin = settings.WHISPER_CPP_BIN
-    model_path = settings.WHISPER_MODEL_PATH
-    cmd = [whisper_bin, "-m", model_path, "-f", wav_path]
-    if language: cmd += ["-l", language]
-    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+def _transcribe_cli(wav: bytes, language: Optional[str], timings: dict) -> str:
+    # whisper-cli only reads files; this loads the model on every call.
+    t0 = time.perf_counter()
+    with tempfile.NamedTemporaryFile(suffix=".wav") as f:
+        f.write(wav)
+        f.flush()
+        cmd = [settings.WHISPER_CPP_BIN, "-m", settings.WHISPER_MODEL_PATH, "-f", f.name]
+        if language: cmd += ["-l", language]
+        out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    timings["inference_ms"] = (time.perf_counter() - t0) * 1000
     return _parse_transcript(out.stdout).strip()
 
-def _transcribe_openai(audio_path: str, language: Optional[str]) -> str:
+def _transcribe_local(wav: bytes, language: Optional[str], timings: dict) -> str:
+    pool = get_whisper_pool()
+    if pool is not None:
+        try:
+            text = pool.transcribe(wav, language, timings)
+            timings["backend"] = "whisper-server"
+            return text
+        except Exception:
+            logger.exception("whisper-server request failed; falling back to whisper-cli")
+    timings["backend"] = "whisper-cli"
+    return _transcribe_cli(wav, language, timings)
+
+def _transcribe_openai(wav: bytes, language: Optional[str], timings: dict) -> str:
     api_key = settings.OPENAI_API_KEY
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY not set")
-    wav_path = audio_path if audio_path.lower().endswith(".wav") else _convert_to_wav(audio_path)
     base = settings.OPENAI_BASE_URL.rstrip("/")
     url = f"{base}/v1/audio/transcriptions"
     headers = {"Authorization": f"Bearer {api_key}"}
     files = {
-        "file": (os.path.basename(wav_path), open(wav_path, "rb"), "audio/wav"),
+        "file": ("audio.wav", wav, "audio/wav"),
         "model": (None, settings.OPENAI_WHISPER_MODEL),
     }
     if language:
         files["language"] = (None, language)
+    t0 = time.perf_counter()
     with httpx.Client(timeout=60) as client:
         r = client.post(url, headers=headers, files=files)
-        try:
-            r.raise_for_status()
-        except httpx.HTTPStatusError:
-            # Bubble up to let caller decide on fallback
-            raise
+        # Errors bubble up to let the caller decide on fallback
+        r.raise_for_status()
         data = r.json()
-        return (data.get("text") or "").strip()
+    timings["backend"] = "openai"
+    timings["inference_ms"] = (time.perf_counter() - t0) * 1000
+    return (data.get("text") or "").strip()
 
-def transcribe(audio_path: str, language: Optional[str] = None) -> str:
+def _transcribe_wav(wav: bytes, language: Optional[str], timings: dict) -> str:
     provider = (settings.STT_PROVIDER or "local").lower()
     if provider == "openai":
         try:
-            return _transcribe_openai(audio_path, language)
-        except Exception as e:
-            if settings.STT_FALLBACK_LOCAL_ON_ERROR:
-                # Attempt local fallback
-                try:
-                    return _transcribe_local(audio_path, language)
-                except Exception:
-                    pass
+            return _transcribe_openai(wav, language, timings)
+        except Exception:
+            if not settings.STT_FALLBACK_LOCAL_ON_ERROR:
+                raise
+            try:
+                return _transcribe_local(wav, language, timings)
+            except Exception:
+                pass
             # Re-raise original error
             raise
-    return _transcribe_local(audio_path, language)
+    return _transcribe_local(wav, language, timings)
+
+def transcribe_timed(data: Optional[bytes] = None, path: Optional[str] = None,
+                     language: Optional[str] = None) -> tuple[str, dict]:
+    """Transcribe raw audio bytes or a file; returns (text, per-stage timings in ms)."""
+    t0 = time.perf_counter()
+    wav = decode_audio(data, path)
+    timings: dict = {"decode_ms": (time.perf_counter() - t0) * 1000}
+    text = _transcribe_wav(wav, language, timings)
+    timings["total_ms"] = (time.perf_counter() - t0) * 1000
+    for stage, h in _stage_ms.items():
+        if stage in timings:
+            h.observe(timings[stage])
+    logger.info("stt %s", " ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}" for k, v in timings.items()))
+    return text, timings
+
+def transcribe_bytes(data: bytes, language: Optional[str] = None) -> str:
+    return transcribe_timed(data=data, language=language)[0]
+
+def transcribe_pcm(pcm: bytes, sample_rate: int = SAMPLE_RATE, language: Optional[str] = None) -> str:
+    return transcribe_timed(data=pcm_to_wav(pcm, sample_rate), language=language)[0]
+
+def transcribe(audio_path: str, language: Optional[str] = None) -> str:
+    return transcribe_timed(path=audio_path, language=language)[0]
@@ -0,0 +1,99 @@
+from __future__ import annotations
+from collections import defaultdict
+import contextvars, logging, re, time, uuid
+
+from app.config import settings
+from app.services.metrics import Histogram, collect_spans, gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+# Per-request trace ID, copied into pool threads by executors.run_blocking/submit
+# and stamped on every log record as %(trace_id)s.
+trace_id: contextvars.ContextVar[str] = contextvars.ContextVar("trace_id", default="-")
+
+_VALID_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+_HTTP_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+_in_flight = gauge("http_requests_in_flight", "HTTP requests and WebSocket sessions being served")
+
+def current_trace_id() -> str:
+    return trace_id.get()
+
+_factory_installed = False
+
+def setup_logging() -> None:
+    """Add trace_id to every log record, and give the root logger a handler
+    that prints it unless the server's logging config already set one up."""
+    global _factory_installed
+    if not _factory_installed:
+        previous = logging.getLogRecordFactory()
+
+        def factory(*args, **kwargs) -> logging.LogRecord:
+            record = previous(*args, **kwargs)
+            record.trace_id = trace_id.get()
+            return record
+        logging.setLogRecordFactory(factory)
+        _factory_installed = True
+    root = logging.getLogger()
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"))
+        root.addHandler(handler)
+        root.setLevel(settings.LOG_LEVEL.upper())
+        # One INFO line per outbound request (weather, whisper-server) is noise at this level.
+        logging.getLogger("httpx").setLevel(max(root.level, logging.WARNING))
+
+def _stage_summary(spans: list) -> str:
+    totals: dict[str, list] = defaultdict(lambda: [0.0, 0])
+    for name, ms in spans:
+        totals[name][0] += ms
+        totals[name][1] += 1
+    ranked = sorted(totals.items(), key=lambda kv: kv[1][0], reverse=True)
+    return " ".join(f"{name}={ms:.0f}" + (f"x{n}" if n > 1 else "") for name, (ms, n) in ranked)
+
+class TracingMiddleware:
+    """Pure ASGI middleware: assigns each request a trace ID (taken from the
+    TRACE_ID_HEADER request header when valid), echoes it on the response,
+    records http_request_ms per route template and status, and logs a stage
+    breakdown for requests slower than SLOW_REQUEST_MS."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self.header = settings.TRACE_ID_HEADER.lower().encode("latin-1")
+        self._hists: dict[tuple, Histogram] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        incoming = next((v.decode("latin-1") for k, v in scope.get("headers", ()) if k == self.header), "")
+        tid = incoming if _VALID_ID.match(incoming) else uuid.uuid4().hex[:16]
+        token = trace_id.set(tid)
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", ()), (self.header, tid.encode("latin-1"))]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            with _in_flight.track(), collect_spans() as spans:
+                await self.app(scope, receive, send_with_id if scope["type"] == "http" else send)
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            if scope["type"] == "http":
+                # Bounded label values: route templates, not raw paths; no arbitrary methods.
+                key = (scope["method"] if scope["method"] in _METHODS else "OTHER", route, status)
+                hist = self._hists.get(key)
+                if hist is None:
+                    hist = self._hists[key] = histogram("http_request_ms", _HTTP_BUCKETS_MS,
+                                                        "HTTP request duration until the last body byte",
+                                                        method=key[0], route=route, status=str(status))
+                hist.observe(ms)
+                if settings.SLOW_REQUEST_MS and ms >= settings.SLOW_REQUEST_MS:
+                    logger.warning("slow request %s %s status=%s total_ms=%.0f stages: %s", scope["method"], route,
+                                   status, ms, _stage_summary(spans) or "-")
+            trace_id.reset(token)
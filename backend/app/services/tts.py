@@ -1,8 +1,18 @@
 from __future__ import annotations
-import subprocess, tempfile, os
+import hashlib, io, re, struct, subprocess, threading, wave
+from typing import Iterator, Optional
 from app.config import settings
+from app.services.cache import DiskLRUCache
+from app.services.metrics import histogram, register_stats
 import httpx
 
+_CHUNK = 16 * 1024
+_STAGE_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+def _stage_ms(stage: str, provider: str):
+    return histogram("tts_stage_ms", _STAGE_BUCKETS_MS, "TTS provider time (cache misses only)",
+                     stage=stage, provider=provider)
+
 def _voice_for_language(language: str | None) -> str:
     # Map ISO-ish codes to espeak voices; fallback to configured voice
     if not language:
@@ -24,14 +34,68 @@ def _voice_for_language(language: str | None) -> str:
     }
     return mapping.get(lang, settings.TTS_VOICE)
 
-def _synthesize_espeak(text: str, language: str | None = None) -> str:
-    fd, out_path = tempfile.mkstemp(prefix="tts_", suffix=".wav")
-    voice = _voice_for_language(language)
-    cmd = [settings.ESPEAK_BIN, "-v", voice, "-s", str(settings.TTS_SPEED_WPM), "-w", out_path, text]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    return out_path
+_cache: Optional[DiskLRUCache] = None
+_http: Optional[httpx.Client] = None
+_lock = threading.Lock()
+
+def _get_cache() -> DiskLRUCache:
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = DiskLRUCache(settings.TTS_CACHE_DIR, settings.TTS_CACHE_MAX_BYTES)
+    return _cache
+
+def _get_http() -> httpx.Client:
+    global _http
+    if _http is None:
+        with _lock:
+            if _http is None:
+                _http = httpx.Client(timeout=60)
+    return _http
+
+def cache_stats() -> dict:
+    return _get_cache().stats()
+
+register_stats("tts_cache", cache_stats)
+
+def _cache_key(provider: str, voice: str, speed: str, text: str) -> str:
+    h = hashlib.sha256()
+    for part in (provider, voice, speed, text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
 
-def _synthesize_elevenlabs(text: str, language: str | None = None) -> str:
+def _fix_wav_sizes(path: str) -> None:
+    # espeak can't seek stdout, so the RIFF/data sizes it writes are placeholders.
+    with open(path, "r+b") as f:
+        header = f.read(256)
+        f.seek(0, 2)
+        size = f.tell()
+        idx = header.find(b"data")
+        if header[:4] != b"RIFF" or idx < 0:
+            return
+        f.seek(4)
+        f.write(struct.pack("<I", size - 8))
+        f.seek(idx + 4)
+        f.write(struct.pack("<I", size - idx - 8))
+
+def _espeak_stream(text: str, voice: str) -> Iterator[bytes]:
+    cmd = [settings.ESPEAK_BIN, "-v", voice, "-s", str(settings.TTS_SPEED_WPM), "--stdout", text]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while chunk := proc.stdout.read1(_CHUNK):
+            yield chunk
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=proc.stderr.read())
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+def _elevenlabs_stream(text: str) -> Iterator[bytes]:
     api_key = settings.ELEVENLABS_API_KEY
     if not api_key:
         raise RuntimeError("ELEVENLABS_API_KEY not set")
@@ -39,7 +103,7 @@ def _synthesize_elevenlabs(text: str, language: str | None = None) -> str:
     if not voice_id or not voice_id.strip():
         raise RuntimeError("ELEVENLABS_VOICE_ID not set")
     model_id = settings.ELEVENLABS_MODEL_ID
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
     headers = {
         "xi-api-key": api_key,
         "Accept": "audio/mpeg",
@@ -50,16 +114,143 @@ def _synthesize_elevenlabs(text: str, language: str | None = None) -> str:
         "model_id": model_id,
         "voice_settings": {"stability": 0.5, "similarity_boost": 0.75},
     }
-    fd, out_path = tempfile.mkstemp(prefix="tts_", suffix=".mp3")
-    with httpx.Client(timeout=60) as client:
-        r = client.post(url, headers=headers, json=json)
+    with _get_http().stream("POST", url, headers=headers, json=json) as r:
         r.raise_for_status()
-        with open(out_path, "wb") as f:
-            f.write(r.content)
-    return out_path
+        yield from r.iter_bytes(_CHUNK)
+
+def _tee(source: Iterator[bytes], cache: DiskLRUCache, key: str, wav: bool) -> Iterator[bytes]:
+    """Yield the provider's bytes as they arrive while writing them to the
+    cache; the entry is published only if synthesis ran to completion."""
+    writer = cache.writer(key)
+    done = False
+    try:
+        for chunk in source:
+            writer.write(chunk)
+            yield chunk
+        done = True
+    finally:
+        source.close()
+        if done:
+            writer.commit(_fix_wav_sizes if wav else None)
+        else:
+            writer.abort()
+
+def _file_stream(f) -> Iterator[bytes]:
+    with f:
+        while chunk := f.read(_CHUNK):
+            yield chunk
 
-def synthesize_to_wav(text: str, language: str | None = None) -> str:
+def _primed(it: Iterator[bytes]) -> Iterator[bytes]:
+    # Pull the first chunk now so provider errors surface before a response starts.
+    try:
+        first = next(it)
+    except StopIteration:
+        return iter(())
+    except BaseException:
+        it.close()
+        raise
+
+    def chunks() -> Iterator[bytes]:
+        yield first
+        yield from it
+    return chunks()
+
+def _spec(text: str, language: str | None) -> tuple[str, str, str, str]:
+    """(provider, media_type, cache key, espeak voice) for one request."""
     provider = (settings.TTS_PROVIDER or "espeak").lower()
     if provider == "elevenlabs":
-        return _synthesize_elevenlabs(text, language)
-    return _synthesize_espeak(text, language)
+        voice = f"{settings.ELEVENLABS_VOICE_ID}/{settings.ELEVENLABS_MODEL_ID}"
+        return provider, "audio/mpeg", _cache_key(provider, voice, "", text) + ".mp3", voice
+    voice = _voice_for_language(language)
+    return "espeak", "audio/wav", _cache_key("espeak", voice, str(settings.TTS_SPEED_WPM), text) + ".wav", voice
+
+def _source(provider: str, text: str, voice: str) -> Iterator[bytes]:
+    return _elevenlabs_stream(text) if provider == "elevenlabs" else _espeak_stream(text, voice)
+
+def synthesize_stream(text: str, language: str | None = None) -> tuple[str, Iterator[bytes]]:
+    """Return (media_type, chunks). Served from the cache when possible,
+    otherwise streamed from the provider as it is produced."""
+    provider, media, key, voice = _spec(text, language)
+    cache = _get_cache()
+    path = cache.get(key)
+    if path is not None:
+        try:
+            return media, _file_stream(open(path, "rb"))
+        except FileNotFoundError:
+            pass  # evicted by another worker in between
+    with _stage_ms("first_chunk", provider).time():
+        return media, _primed(_tee(_source(provider, text, voice), cache, key, wav=media == "audio/wav"))
+
+def synthesize_bytes(text: str, language: str | None = None) -> tuple[str, bytes]:
+    """(media type, audio) for text, from the cache or synthesized into it.
+
+    The audio is returned rather than the cache path: another request can
+    evict the entry before the caller would get round to reading it.
+    """
+    provider, media, key, voice = _spec(text, language)
+    cache = _get_cache()
+    path = cache.get(key)
+    if path is not None:
+        try:
+            with open(path, "rb") as f:
+                return media, f.read()
+        except FileNotFoundError:
+            pass  # evicted in between: synthesize again
+    with _stage_ms("synthesize", provider).time():
+        return media, b"".join(_tee(_source(provider, text, voice), cache, key, wav=media == "audio/wav"))
+
+# ---- sentence-at-a-time synthesis for streamed replies ----------------------
+_SENTENCE_END = re.compile(r"[.!?\u0964\u0965]+[\"')\]]*\s+|\n+")
+_UNSPOKEN = re.compile(r"[*_#`>|]+")
+
+class SentenceSplitter:
+    """Cuts streamed LLM tokens into sentences worth sending to TTS.
+
+    Very short sentences are merged with the next one; runs without
+    punctuation are cut at a comma or space once they reach max_chars.
+    """
+
+    def __init__(self, min_chars: int = 24, max_chars: int = 240) -> None:
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buf = ""
+
+    def _emit(self, text: str, out: list[str]) -> None:
+        text = " ".join(_UNSPOKEN.sub(" ", text).split())
+        if any(c.isalnum() for c in text):
+            out.append(text)
+
+    def feed(self, text: str) -> list[str]:
+        self._buf += text
+        out: list[str] = []
+        while True:
+            cut = next((m.end() for m in _SENTENCE_END.finditer(self._buf) if m.end() >= self.min_chars), None)
+            if cut is None and len(self._buf) > self.max_chars:
+                head = self._buf[:self.max_chars]
+                cut = max(head.rfind(", "), head.rfind(" ")) + 1 or self.max_chars
+            if cut is None:
+                return out
+            self._emit(self._buf[:cut], out)
+            self._buf = self._buf[cut:]
+
+    def flush(self) -> list[str]:
+        out: list[str] = []
+        self._emit(self._buf, out)
+        self._buf = ""
+        return out
+
+def read_wav(data: bytes) -> tuple[tuple[int, int, int], bytes]:
+    """((channels, sample width, rate), PCM frames) of a synthesized WAV.
+
+    The frames run to the end of the data, so the placeholder sizes in a
+    header written by espeak are harmless.
+    """
+    with wave.open(io.BytesIO(data), "rb") as w:
+        return (w.getnchannels(), w.getsampwidth(), w.getframerate()), w.readframes(len(data))
+
+def streaming_wav_header(channels: int, sampwidth: int, rate: int) -> bytes:
+    # Length unknown up front: use the maximum, as players expect for live WAV.
+    size = 0xFFFFFFFF
+    return (b"RIFF" + struct.pack("<I", size) + b"WAVEfmt "
+            + struct.pack("<IHHIIHH", 16, 1, channels, rate, rate * channels * sampwidth, channels * sampwidth, sampwidth * 8)
+            + b"data" + struct.pack("<I", size))
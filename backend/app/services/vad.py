@@ -0,0 +1,129 @@
+from __future__ import annotations
+from collections import deque
+from typing import Callable, Optional
+import math
+import numpy as np
+
+from app.config import settings
+
+try:
+    import webrtcvad  # optional, more robust in noisy fields
+except ImportError:
+    webrtcvad = None
+
+class EnergyVAD:
+    """Frame is speech when its level is above an absolute floor and clearly
+    above the running noise estimate."""
+
+    def __init__(self, threshold_db: float, margin_db: float = 10.0) -> None:
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.noise_db = threshold_db
+
+    def __call__(self, frame: bytes) -> bool:
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+        rms = math.sqrt(float(np.mean(samples * samples))) if samples.size else 0.0
+        db = 20 * math.log10(rms / 32768.0) if rms > 0 else -120.0
+        speech = db > max(self.threshold_db, self.noise_db + self.margin_db)
+        if not speech:
+            self.noise_db = 0.95 * self.noise_db + 0.05 * db
+        return speech
+
+def make_vad(sample_rate: int) -> Callable[[bytes], bool]:
+    mode = (settings.VAD_MODE or "energy").lower()
+    if mode == "webrtc" and webrtcvad is not None and sample_rate in (8000, 16000, 32000, 48000):
+        vad = webrtcvad.Vad(settings.VAD_AGGRESSIVENESS)
+        return lambda frame: vad.is_speech(frame, sample_rate)
+    return EnergyVAD(settings.VAD_ENERGY_THRESHOLD_DB)
+
+class SpeechSegmenter:
+    """Cuts a PCM16 mono stream into speech segments.
+
+    feed() returns ("segment", pcm) at short pauses or when a segment reaches
+    max_segment_ms, so it can be transcribed while the speaker continues, and
+    ("end", pcm) with the remaining audio once silence lasts end_silence_ms.
+    """
+
+    FRAME_MS = 30
+    START_FRAMES = 3      # voiced frames in a row before an utterance starts
+    PREROLL_MS = 300      # audio kept from before the start, so onsets aren't clipped
+
+    def __init__(self, sample_rate: int, segment_silence_ms: int, end_silence_ms: int, max_segment_ms: int,
+                 is_speech: Optional[Callable[[bytes], bool]] = None) -> None:
+        self.sample_rate = sample_rate
+        self.frame_bytes = sample_rate * self.FRAME_MS // 1000 * 2
+        self.segment_silence_ms = segment_silence_ms
+        self.end_silence_ms = end_silence_ms
+        self.max_segment_bytes = sample_rate * max_segment_ms // 1000 * 2
+        self.is_speech = is_speech or make_vad(sample_rate)
+        self._pending = b""
+        self._preroll: deque[bytes] = deque(maxlen=max(1, self.PREROLL_MS // self.FRAME_MS))
+        self._reset()
+
+    def _reset(self) -> None:
+        self.in_utterance = False
+        self._voiced_run = 0
+        self._silence_ms = 0
+        self._segment = bytearray()
+        self._segment_voiced = False
+        self._paused = False
+        self._preroll.clear()
+
+    def _cut(self) -> bytes:
+        pcm = bytes(self._segment) if self._segment_voiced else b""
+        self._segment = bytearray()
+        self._segment_voiced = False
+        return pcm
+
+    def feed(self, pcm: bytes) -> list[tuple[str, bytes]]:
+        data = self._pending + pcm
+        n = len(data) - len(data) % self.frame_bytes
+        self._pending = data[n:]
+        events = []
+        for i in range(0, n, self.frame_bytes):
+            ev = self._frame(data[i:i + self.frame_bytes])
+            if ev is not None:
+                events.append(ev)
+        return events
+
+    def _frame(self, frame: bytes) -> Optional[tuple[str, bytes]]:
+        speech = self.is_speech(frame)
+        if not self.in_utterance:
+            self._preroll.append(frame)
+            self._voiced_run = self._voiced_run + 1 if speech else 0
+            if self._voiced_run >= self.START_FRAMES:
+                self.in_utterance = True
+                self._segment = bytearray(b"".join(self._preroll))
+                self._segment_voiced = True
+                self._silence_ms = 0
+            return None
+        self._segment += frame
+        if speech:
+            self._segment_voiced = True
+            self._silence_ms = 0
+            self._paused = False
+            if len(self._segment) >= self.max_segment_bytes:
+                return ("segment", self._cut())
+            return None
+        self._silence_ms += self.FRAME_MS
+        if self._silence_ms >= self.end_silence_ms:
+            pcm = self._cut()
+            self._reset()
+            return ("end", pcm)
+        if self._silence_ms >= self.segment_silence_ms and not self._paused:
+            self._paused = True
+            if self._segment_voiced:
+                return ("segment", self._cut())
+        return None
+
+    def flush(self) -> list[tuple[str, bytes]]:
+        """Force end of speech (client stopped recording)."""
+        if self._pending and self.in_utterance:
+            self._segment += self._pending
+        self._pending = b""
+        if not self.in_utterance:
+            self._reset()
+            return []
+        pcm = self._cut()
+        self._reset()
+        return [("end", pcm)]
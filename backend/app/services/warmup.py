@@ -0,0 +1,114 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+import asyncio, logging, threading, time
+
+from app.services.metrics import gauge
+
+logger = logging.getLogger(__name__)
+
+# Startup warm-up: each registered component is a blocking callable that loads
+# something the first request would otherwise pay for. Selected components run
+# on a small dedicated pool, a component starting only once the components it
+# runs `after` have finished. /v1/ready reports ready when all have finished
+# (failures included: every component also initialises lazily on first use).
+_steps: dict[str, tuple[Callable[[], Any], tuple[str, ...]]] = {}
+_loaders: dict[str, Callable[[], Any]] = {}
+_state: dict[str, dict] = {}
+_lock = threading.Lock()
+_finished = False
+_stopping = False
+_ready_gauge = gauge("ready", "1 once start-up warm-up has finished and the process is not shutting down")
+
+def register(name: str, fn: Callable[[], Any], after: Iterable[str] = ()) -> None:
+    _steps[name] = (fn, tuple(after))
+
+def register_preload(name: str, fn: Callable[[], Any]) -> None:
+    _loaders[name] = fn
+
+def preload(names: Iterable[str]) -> dict[str, float]:
+    """Load model weights in a pre-fork master (see gunicorn_conf.py); returns ms per model.
+
+    Loaders only read weights: a forward pass would start torch's intra-op
+    thread pool, which does not survive fork(). Workers still run their own
+    warm-up, which then finds the weights already in memory."""
+    timings = {}
+    for name in names:
+        if name not in _loaders:
+            logger.warning("unknown preload model '%s' (known: %s)", name, ", ".join(_loaders))
+            continue
+        started = time.perf_counter()
+        try:
+            _loaders[name]()
+        except Exception:
+            logger.exception("preload %s failed; workers will load it themselves", name)
+            continue
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("preloaded %s in %.0f ms", name, timings[name])
+    return timings
+
+def _set(name: str, **fields) -> None:
+    with _lock:
+        _state.setdefault(name, {}).update(fields)
+
+def _run_step(name: str) -> None:
+    fn, _ = _steps[name]
+    _set(name, state="running")
+    started = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        ms = (time.perf_counter() - started) * 1000
+        logger.exception("warm-up %s failed after %.0f ms", name, ms)
+        _set(name, state="failed", ms=round(ms, 1), error=str(e))
+    else:
+        ms = (time.perf_counter() - started) * 1000
+        logger.info("warm-up %s done in %.0f ms", name, ms)
+        _set(name, state="ready", ms=round(ms, 1))
+    gauge("warmup_ms", "Start-up warm-up time per component", component=name).set(ms)
+
+async def run(names: Iterable[str], concurrency: int) -> dict:
+    """Warm the selected components; returns status()."""
+    global _finished
+    selected = []
+    for name in names:
+        if name in _steps:
+            selected.append(name)
+        else:
+            logger.warning("unknown warm-up component '%s' (known: %s)", name, ", ".join(_steps))
+    for name in selected:
+        _set(name, state="pending")
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    done: dict[str, asyncio.Event] = {name: asyncio.Event() for name in selected}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="warmup") as pool:
+
+        async def one(name: str) -> None:
+            for dep in _steps[name][1]:
+                if dep in done:
+                    await done[dep].wait()
+            try:
+                await loop.run_in_executor(pool, _run_step, name)
+            finally:
+                done[name].set()
+
+        await asyncio.gather(*(one(name) for name in selected))
+    _finished = True
+    _ready_gauge.set(0 if _stopping else 1)
+    logger.info("warm-up finished in %.0f ms: %s", (time.perf_counter() - started) * 1000,
+                ", ".join(f"{n}={s.get('state')}" for n, s in status()["components"].items()) or "nothing selected")
+    return status()
+
+def stopping() -> None:
+    """Report not-ready from now on, so load balancers drain this process."""
+    global _stopping
+    _stopping = True
+    _ready_gauge.set(0)
+
+def ready() -> bool:
+    return _finished and not _stopping
+
+def status() -> dict:
+    with _lock:
+        components = {name: dict(s) for name, s in _state.items()}
+    return {"ready": ready(), "stopping": _stopping, "components": components}
@@ -0,0 +1,167 @@
+from __future__ import annotations
+from typing import Optional
+import atexit, logging, queue, socket, subprocess, threading, time
+import httpx
+
+from app.config import settings
+from app.services.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+class _Worker:
+    __slots__ = ("port", "proc")
+
+    def __init__(self, port: int) -> None:
+        self.port = port
+        self.proc: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/inference"
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _port_open(port: int) -> bool:
+    with socket.socket() as s:
+        s.settimeout(0.2)
+        return s.connect_ex(("127.0.0.1", port)) == 0
+
+class WhisperServerPool:
+    """whisper.cpp `whisper-server` processes, each holding the model in memory.
+
+    A server handles one inference at a time, so requests check a worker out of
+    a queue and return it afterwards; callers beyond `size` wait for a free one.
+    """
+
+    def __init__(self, server_bin: str, model_path: str, size: int, base_port: int,
+                 threads: int, start_timeout: float) -> None:
+        self.server_bin = server_bin
+        self.model_path = model_path
+        self.threads = threads
+        self.start_timeout = start_timeout
+        # base_port 0 picks free ports, so several app workers on one host don't collide.
+        self.workers = [_Worker(base_port + i if base_port else _free_port()) for i in range(max(1, size))]
+        self._free: queue.SimpleQueue[_Worker] = queue.SimpleQueue()
+        self._client = httpx.Client(timeout=httpx.Timeout(300.0, connect=5.0))
+        self.requests = 0
+        self.restarts = 0
+
+    def _spawn(self, worker: _Worker) -> None:
+        cmd = [self.server_bin, "-m", self.model_path, "--host", "127.0.0.1",
+               "--port", str(worker.port), "-t", str(self.threads)]
+        worker.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def _wait_ready(self, worker: _Worker) -> None:
+        deadline = time.monotonic() + self.start_timeout
+        while not _port_open(worker.port):
+            if not worker.alive():
+                raise RuntimeError(f"whisper-server on port {worker.port} exited with {worker.proc.returncode}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"whisper-server on port {worker.port} did not start in {self.start_timeout}s")
+            time.sleep(0.1)
+
+    def start(self) -> None:
+        # Spawn all first so the model loads happen in parallel.
+        try:
+            for w in self.workers:
+                self._spawn(w)
+            for w in self.workers:
+                self._wait_ready(w)
+        except Exception:
+            self.close()
+            raise
+        for w in self.workers:
+            self._free.put(w)
+
+    def _restart(self, worker: _Worker) -> None:
+        self.restarts += 1
+        if worker.alive():
+            worker.proc.kill()
+        self._spawn(worker)
+        self._wait_ready(worker)
+
+    def transcribe(self, wav: bytes, language: Optional[str], timings: Optional[dict] = None) -> str:
+        t0 = time.perf_counter()
+        worker = self._free.get()
+        t1 = time.perf_counter()
+        try:
+            if not worker.alive():
+                self._restart(worker)
+            data = {"response_format": "json", "temperature": "0.0"}
+            if language:
+                data["language"] = language
+            r = self._client.post(worker.url, data=data, files={"file": ("audio.wav", wav, "audio/wav")})
+            r.raise_for_status()
+            text = (r.json().get("text") or "").strip()
+        finally:
+            self._free.put(worker)
+        self.requests += 1
+        if timings is not None:
+            timings["queue_ms"] = (t1 - t0) * 1000
+            timings["inference_ms"] = (time.perf_counter() - t1) * 1000
+        return text
+
+    def close(self) -> None:
+        for w in self.workers:
+            if w.alive():
+                w.proc.terminate()
+        for w in self.workers:
+            if w.proc is not None:
+                try:
+                    w.proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    w.proc.kill()
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self.workers),
+            "alive": sum(w.alive() for w in self.workers),
+            "idle": self._free.qsize(),
+            "requests": self.requests,
+            "restarts": self.restarts,
+        }
+
+_pool: Optional[WhisperServerPool] = None
+_pool_failed = False
+_pool_lock = threading.Lock()
+
+def get_whisper_pool() -> Optional[WhisperServerPool]:
+    """The shared pool, started on first use; None when disabled or it failed to start."""
+    global _pool, _pool_failed
+    if settings.STT_WORKERS <= 0:
+        return None
+    if _pool is None and not _pool_failed:
+        with _pool_lock:
+            if _pool is None and not _pool_failed:
+                pool = WhisperServerPool(settings.WHISPER_SERVER_BIN, settings.WHISPER_MODEL_PATH,
+                                         settings.STT_WORKERS, settings.STT_WORKER_BASE_PORT,
+                                         settings.STT_WORKER_THREADS, settings.STT_WORKER_START_TIMEOUT_S)
+                try:
+                    pool.start()
+                except Exception:
+                    # Keep serving through the whisper-cli path.
+                    logger.exception("whisper-server pool failed to start; falling back to whisper-cli")
+                    _pool_failed = True
+                    return None
+                atexit.register(pool.close)
+                _pool = pool
+    return _pool
+
+def pool_stats() -> dict:
+    # Never starts the pool.
+    return _pool.stats() if _pool is not None else {}
+
+register_stats("whisper_pool", pool_stats)
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
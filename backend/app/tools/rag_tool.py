@@ -1,11 +1,10 @@
 from __future__ import annotations
 from langchain_core.tools import tool
-from app.services.rag import load_retriever, ensure_index_exists
+from app.services.metrics import timed
+from app.services.rag import search
 
 @tool("rag_search", return_direct=False)
+@timed("tool", "rag_search")
 def rag_search(query: str, k: int = 4) -> dict:
-    """Search the KB in Pinecone and return top-k passages."""
-    ensure_index_exists()
-    retriever = load_retriever(k=k)
-    docs = retriever.invoke(query)
-    return {"matches": [{"text": d.page_content[:1200], "metadata": d.metadata} for d in docs]}
+    """Search the agriculture knowledge base and return top-k passages."""
+    return {"matches": search(query, k=k)}
@@ -1,54 +1,206 @@
 from __future__ import annotations
-import json, io, base64, threading, os
-from typing import List, Tuple
+import json, io, base64, threading, os, logging
+from typing import TYPE_CHECKING, List, Tuple, Union
 from PIL import Image
-import torch
-from transformers import AutoImageProcessor, AutoModelForImageClassification
 from langchain_core.tools import tool
 from app.config import settings
+from app.services.batching import MicroBatcher
+from app.services.metrics import histogram, timed
+
+if TYPE_CHECKING:
+    import torch
+
+logger = logging.getLogger(__name__)
+
+# torch and transformers are imported on first use (model load), not with this
+# module, so importing the app stays fast; warm_up() pays the cost at startup.
+
+ENGINES = ("eager", "int8", "torchscript")
+
+_STAGE_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+_stage_ms = {
+    stage: histogram("vit_stage_ms", _STAGE_BUCKETS_MS, "ViT time per stage (preprocess and forward are per batch)",
+                     stage=stage)
+    for stage in ("decode", "preprocess", "forward")
+}
 
 _model_lock = threading.Lock()
 _model = None
 _processor = None
 _labels = None
 
+def _logits_only(model: torch.nn.Module) -> torch.nn.Module:
+    """pixel_values -> logits, so eager and traced engines share one call signature."""
+    import torch
+
+    class _LogitsOnly(torch.nn.Module):
+        def __init__(self, model: torch.nn.Module) -> None:
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+            return self.model(pixel_values=pixel_values).logits
+    return _LogitsOnly(model)
+
+def converted_path(engine: str, model_dir: str | None = None) -> str:
+    return os.path.join(model_dir or settings.VIT_MODEL_DIR, "converted", f"{engine}.pt")
+
+def _configure_threads() -> None:
+    import torch
+    if settings.VIT_NUM_THREADS > 0:
+        torch.set_num_threads(settings.VIT_NUM_THREADS)
+    if settings.VIT_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(settings.VIT_INTEROP_THREADS)
+        except RuntimeError:
+            # Can only be set before the first inter-op parallel work in the process.
+            logger.warning("VIT_INTEROP_THREADS ignored: torch inter-op pool already started")
+
+def _load_engine(model_dir: str, engine: str) -> torch.nn.Module:
+    import torch
+    from transformers import AutoModelForImageClassification
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown VIT_ENGINE={engine} ({'|'.join(ENGINES)})")
+    if engine != "eager":
+        path = converted_path(engine, model_dir)
+        if os.path.isfile(path):
+            return torch.jit.load(path, map_location="cpu").eval()
+        logger.warning("ViT engine %s not converted (%s missing); using eager. Run: python -m app.vit_convert --engine %s",
+                       engine, path, engine)
+    return _logits_only(AutoModelForImageClassification.from_pretrained(model_dir)).eval()
+
 def _load_model():
     global _model, _processor, _labels
     if _model is None:
         with _model_lock:
             if _model is None:
+                from transformers import AutoConfig, AutoImageProcessor
                 model_dir = settings.VIT_MODEL_DIR
+                _configure_threads()
                 _processor = AutoImageProcessor.from_pretrained(model_dir)
-                _model = AutoModelForImageClassification.from_pretrained(model_dir)
                 labels_path = settings.VIT_LABELS_JSON
                 if os.path.isfile(labels_path):
                     with open(labels_path, "r", encoding="utf-8") as f:
                         _labels = json.load(f)
                 else:
-                    _labels = getattr(_model.config, "id2label", {})
+                    _labels = getattr(AutoConfig.from_pretrained(model_dir), "id2label", {})
+                _model = _load_engine(model_dir, (settings.VIT_ENGINE or "eager").lower())
     return _model, _processor, _labels
 
-def _predict_probs(image: Image.Image, top_k: int = 3):
-    model, processor, labels = _load_model()
-    inputs = processor(images=image, return_tensors="pt")
+def load_weights() -> None:
+    _load_model()
+
+def convert_model(engine: str, model_dir: str | None = None) -> str:
+    """Trace the classifier to TorchScript (optionally int8 dynamic-quantized) and
+    cache it under <model_dir>/converted/<engine>.pt. Returns the artifact path."""
+    if engine not in ("int8", "torchscript"):
+        raise ValueError(f"Nothing to convert for engine={engine}")
+    import torch
+    from transformers import AutoImageProcessor, AutoModelForImageClassification
+    model_dir = model_dir or settings.VIT_MODEL_DIR
+    processor = AutoImageProcessor.from_pretrained(model_dir)
+    model = _logits_only(AutoModelForImageClassification.from_pretrained(model_dir)).eval()
+    if engine == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    example = processor(images=[Image.new("RGB", (224, 224))] * 2, return_tensors="pt")["pixel_values"]
     with torch.no_grad():
-        logits = model(**inputs).logits
-        probs = torch.softmax(logits, dim=-1)[0]
-        topk = torch.topk(probs, k=top_k)
+        traced = torch.jit.trace(model, (example,))
+        if engine == "torchscript":
+            traced = torch.jit.freeze(traced)
+    path = converted_path(engine, model_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    torch.jit.save(traced, tmp)
+    os.replace(tmp, path)
+    return path
+
+def _forward(images: List[Image.Image], top_k: int) -> List[List[Tuple[str, float]]]:
+    import torch
+    model, processor, labels = _load_model()
+    with _stage_ms["preprocess"].time():
+        inputs = processor(images=images, return_tensors="pt")
+    with torch.no_grad(), _stage_ms["forward"].time():
+        logits = model(inputs["pixel_values"])
+        probs = torch.softmax(logits, dim=-1)
+        topk = torch.topk(probs, k=min(top_k, probs.shape[-1]), dim=-1)
     results = []
-    for idx, score in zip(topk.indices.tolist(), topk.values.tolist()):
-        label = labels.get(idx, str(idx)) if isinstance(labels, dict) else str(idx)
-        results.append((label, float(score)))
+    for indices, scores in zip(topk.indices.tolist(), topk.values.tolist()):
+        row = []
+        for idx, score in zip(indices, scores):
+            label = labels.get(idx, str(idx)) if isinstance(labels, dict) else str(idx)
+            row.append((label, float(score)))
+        results.append(row)
     return results
 
+def _forward_batch(payloads: List[Tuple[Image.Image, int]]) -> List[List[Tuple[str, float]]]:
+    k = max(top_k for _, top_k in payloads)
+    rows = _forward([image for image, _ in payloads], k)
+    return [row[:top_k] for row, (_, top_k) in zip(rows, payloads)]
+
+_batcher: MicroBatcher | None = None
+
+def _get_batcher() -> MicroBatcher | None:
+    global _batcher
+    if _batcher is None and settings.VIT_BATCH_MAX_SIZE > 1:
+        with _model_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(_forward_batch, settings.VIT_BATCH_MAX_SIZE,
+                                        settings.VIT_BATCH_MAX_WAIT_MS, name="vit")
+    return _batcher
+
+def batch_stats() -> dict:
+    return _batcher.stats() if _batcher else {}
+
+def warm_up() -> None:
+    """Load the model and run one forward pass, so the first request skips
+    weight loading and the framework's first-call allocations."""
+    _forward([Image.new("RGB", (224, 224))], 1)
+
+def _predict_probs(image: Image.Image, top_k: int = 3):
+    batcher = _get_batcher()
+    if batcher is None:
+        return _forward([image], top_k)[0]
+    return batcher((image, top_k))
+
+# Raw upload bytes or an already-decoded image; callers pass these through
+# unchanged instead of round-tripping via base64.
+ImageInput = Union[bytes, bytearray, memoryview, Image.Image]
+
+def _decode_size() -> int:
+    size = getattr(_processor, "size", None) or {}
+    if isinstance(size, (int, float)):
+        return int(size)
+    # A dict, or a SizeDict (attribute access only) in newer transformers.
+    get = size.get if isinstance(size, dict) else lambda k: getattr(size, k, None)
+    return int(get("shortest_edge") or get("height") or 224)
+
+def decode_image(data: Union[bytes, bytearray, memoryview]) -> Image.Image:
+    """Decode upload bytes to RGB. JPEGs use draft mode so libjpeg scales down
+    by 1/2..1/8 while decoding, landing near the processor's input size instead
+    of materializing a full 12MP frame."""
+    image = Image.open(io.BytesIO(data))
+    if image.format == "JPEG":
+        size = _decode_size()
+        image.draft("RGB", (size, size))
+    return image.convert("RGB")
+
+def classify_image(image: ImageInput, top_k: int = 3) -> dict:
+    try:
+        if not isinstance(image, Image.Image):
+            with _stage_ms["decode"].time():
+                image = decode_image(image)
+        topk = _predict_probs(image, top_k=top_k)
+        return {"label": topk[0][0], "score": topk[0][1],
+                "top_k": [{"label": l, "score": s} for l, s in topk]}
+    except Exception as e:
+        return {"error": str(e)}
+
 @tool("classify_crop_disease_direct", return_direct=False)
+@timed("tool", "classify_crop_disease_direct")
 def classify_crop_disease(image_base64: str) -> dict:
     """Classify a crop disease from a base64-encoded image and return top-1 and top-k results."""
     try:
         img_bytes = base64.b64decode(image_base64)
-        image = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-        topk = _predict_probs(image, top_k=3)
-        return {"label": topk[0][0], "score": topk[0][1],
-                "top_k": [{"label": l, "score": s} for l, s in topk]}
     except Exception as e:
         return {"error": str(e)}
+    return classify_image(img_bytes)
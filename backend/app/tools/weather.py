@@ -1,34 +1,208 @@
 from __future__ import annotations
 import httpx
-from typing import Literal
-from langchain_core.tools import tool
+from collections import Counter
+from typing import Literal, Optional
+import asyncio, json, os, sqlite3, threading, time, logging
+from langchain_core.tools import StructuredTool
 
-GEOCODE_URL = "https://geocoding-api.open-meteo.com/v1/search"
-FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+from app.config import settings
+from app.services.cache import TTLCache
+from app.services.metrics import histogram, register_stats, timed
 
-@tool("get_weather", return_direct=False)
-def get_weather(city: str, unit: Literal["c","f"]="c") -> dict:
-    """Get current weather for a city using Open-Meteo (no API key)."""
+logger = logging.getLogger(__name__)
+
+_CURRENT_FIELDS = "temperature_2m,relative_humidity_2m,weather_code"
+_UPSTREAM_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# All HTTP goes through one pooled AsyncClient that lives on a dedicated event
+# loop thread, so sync callers (AgentExecutor.invoke) and async callers
+# (astream_events) share connections and TLS sessions.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_client: Optional[httpx.AsyncClient] = None
+_loop_lock = threading.Lock()
+
+_geocode_mem = TTLCache(4096, 30 * 86400)
+_forecast_cache = TTLCache(4096, settings.WEATHER_FORECAST_TTL_S)
+_demand: Counter = Counter()  # forecast key -> queries since last prefetch
+_inflight: dict[tuple, asyncio.Future] = {}  # forecast key -> pending fetch (loop-only)
+_prefetch_task: Optional[asyncio.Future] = None
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="weather-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+def _http() -> httpx.AsyncClient:
+    # Only called on the weather loop.
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+        )
+    return _client
+
+def _run(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
+
+# ---- geocode cache: memory LRU in front of a small SQLite table ----------
+_db_local = threading.local()
+
+def _db() -> sqlite3.Connection:
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        path = settings.WEATHER_GEOCODE_CACHE_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS geocode (name TEXT PRIMARY KEY, payload TEXT NOT NULL, created REAL NOT NULL)")
+        _db_local.conn = conn
+    return conn
+
+def _geocode_key(city: str) -> str:
+    return " ".join(city.split()).casefold()
+
+def _geocode_disk_get(key: str) -> Optional[dict]:
     try:
-        with httpx.Client(timeout=10.0) as client:
-            geor = client.get(GEOCODE_URL, params={"name": city, "count": 1, "language": "en"}).json()
-            if not geor.get("results"):
-                return {"error": f"No match for '{city}'"}
-            loc = geor["results"][0]
-            lat, lon = loc["latitude"], loc["longitude"]
-            params = {"latitude": lat, "longitude": lon, "current": "temperature_2m,relative_humidity_2m,weather_code"}
-            if unit == "f": params["temperature_unit"] = "fahrenheit"
-            fr = client.get(FORECAST_URL, params=params).json()
-            cur = fr.get("current") or {}
-            return {
-                "city": loc["name"],
-                "country": loc.get("country"),
-                "latitude": lat,
-                "longitude": lon,
-                "temperature": cur.get("temperature_2m"),
-                "relative_humidity": cur.get("relative_humidity_2m"),
-                "weather_code": cur.get("weather_code"),
-                "unit": "F" if unit == "f" else "C"
-            }
+        row = _db().execute("SELECT payload FROM geocode WHERE name = ?", (key,)).fetchone()
+    except sqlite3.Error:
+        logger.exception("geocode cache read failed")
+        return None
+    return json.loads(row[0]) if row else None
+
+def _geocode_disk_put(key: str, loc: dict) -> None:
+    try:
+        _db().execute("INSERT OR REPLACE INTO geocode (name, payload, created) VALUES (?, ?, ?)",
+                      (key, json.dumps(loc), time.time()))
+    except sqlite3.Error:
+        logger.exception("geocode cache write failed")
+
+async def _geocode(city: str) -> Optional[dict]:
+    key = _geocode_key(city)
+    loc = _geocode_mem.get(key)
+    if loc is not None:
+        return loc or None  # {} marks a known miss
+    loc = _geocode_disk_get(key)
+    if loc is None:
+        with histogram("weather_upstream_ms", _UPSTREAM_BUCKETS_MS, "Open-Meteo request time", endpoint="geocode").time():
+            geor = (await _http().get(settings.WEATHER_GEOCODE_URL, params={"name": city, "count": 1, "language": "en"})).json()
+        if not geor.get("results"):
+            _geocode_mem.put(key, {})
+            return None
+        r = geor["results"][0]
+        loc = {"name": r["name"], "country": r.get("country"), "latitude": r["latitude"], "longitude": r["longitude"]}
+        _geocode_disk_put(key, loc)
+    _geocode_mem.put(key, loc)
+    return loc
+
+# ---- forecasts -----------------------------------------------------------
+def _forecast_key(lat: float, lon: float, unit: str) -> tuple:
+    p = settings.WEATHER_COORD_PRECISION
+    return (round(lat, p), round(lon, p), unit)
+
+async def _fetch_current(keys: list[tuple]) -> list[dict]:
+    """One Open-Meteo request for many coordinates (all with the same unit)."""
+    params = {
+        "latitude": ",".join(str(k[0]) for k in keys),
+        "longitude": ",".join(str(k[1]) for k in keys),
+        "current": _CURRENT_FIELDS,
+    }
+    if keys[0][2] == "f":
+        params["temperature_unit"] = "fahrenheit"
+    with histogram("weather_upstream_ms", _UPSTREAM_BUCKETS_MS, "Open-Meteo request time", endpoint="forecast").time():
+        r = await _http().get(settings.WEATHER_FORECAST_URL, params=params)
+    r.raise_for_status()
+    data = r.json()
+    rows = data if isinstance(data, list) else [data]
+    out = [row.get("current") or {} for row in rows]
+    for key, cur in zip(keys, out):
+        _forecast_cache.put(key, cur)
+    return out
+
+async def _current(key: tuple) -> dict:
+    _demand[key] += 1
+    cur = _forecast_cache.get(key)
+    if cur is not None:
+        return cur
+    # Concurrent misses for the same location share one upstream request.
+    fut = _inflight.get(key)
+    if fut is None:
+        fut = _inflight[key] = asyncio.ensure_future(_fetch_current([key]))
+        fut.add_done_callback(lambda _: _inflight.pop(key, None))
+    return (await asyncio.shield(fut))[0]
+
+async def _get_weather_on_loop(city: str, unit: str) -> dict:
+    try:
+        loc = await _geocode(city)
+        if loc is None:
+            return {"error": f"No match for '{city}'"}
+        lat, lon = loc["latitude"], loc["longitude"]
+        cur = await _current(_forecast_key(lat, lon, unit))
+        return {
+            "city": loc["name"],
+            "country": loc.get("country"),
+            "latitude": lat,
+            "longitude": lon,
+            "temperature": cur.get("temperature_2m"),
+            "relative_humidity": cur.get("relative_humidity_2m"),
+            "weather_code": cur.get("weather_code"),
+            "unit": "F" if unit == "f" else "C"
+        }
     except Exception as e:
         return {"error": str(e)}
+
+# ---- background prefetch of the most-queried locations ------------------
+async def _prefetch_loop(interval: float, top_n: int, batch: int) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        hot = [key for key, _ in _demand.most_common(top_n)]
+        _demand.clear()
+        for unit in ("c", "f"):
+            keys = [k for k in hot if k[2] == unit]
+            for i in range(0, len(keys), batch):
+                try:
+                    await _fetch_current(keys[i:i + batch])
+                except Exception:
+                    logger.warning("weather prefetch failed for %d locations", len(keys[i:i + batch]), exc_info=True)
+
+def start_prefetcher() -> None:
+    """Refresh forecasts for the hottest locations every WEATHER_PREFETCH_INTERVAL_S."""
+    global _prefetch_task
+    interval = settings.WEATHER_PREFETCH_INTERVAL_S
+    if interval <= 0 or _prefetch_task is not None:
+        return
+    _prefetch_task = _run(_prefetch_loop(interval, settings.WEATHER_PREFETCH_TOP_N, settings.WEATHER_PREFETCH_BATCH))
+
+def stop_prefetcher() -> None:
+    global _prefetch_task
+    if _prefetch_task is not None:
+        _prefetch_task.cancel()
+        _prefetch_task = None
+
+def cache_stats() -> dict:
+    return {"geocode": _geocode_mem.stats(), "forecast": _forecast_cache.stats()}
+
+register_stats("weather_cache", cache_stats, label="cache")
+
+# ---- tool ------------------------------------------------------------------
+@timed("tool", "get_weather")
+def _get_weather(city: str, unit: Literal["c","f"]="c") -> dict:
+    """Get current weather for a city using Open-Meteo (no API key)."""
+    return _run(_get_weather_on_loop(city, unit)).result()
+
+@timed("tool", "get_weather")
+async def _aget_weather(city: str, unit: Literal["c","f"]="c") -> dict:
+    """Get current weather for a city using Open-Meteo (no API key)."""
+    return await asyncio.wrap_future(_run(_get_weather_on_loop(city, unit)))
+
+get_weather = StructuredTool.from_function(
+    func=_get_weather,
+    coroutine=_aget_weather,
+    name="get_weather",
+    return_direct=False,
+)
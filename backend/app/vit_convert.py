@@ -0,0 +1,16 @@
+from __future__ import annotations
+import argparse
+from app.tools.vit import convert_model
+from app.config import settings
+
+def convert(engines: list[str], model_dir: str | None = None):
+    for engine in engines:
+        path = convert_model(engine, model_dir)
+        print(f"Converted ViT ({engine}) from '{model_dir or settings.VIT_MODEL_DIR}' -> {path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", nargs="+", default=["int8"], choices=["int8", "torchscript"])
+    parser.add_argument("--model-dir", default=None, help="Defaults to VIT_MODEL_DIR")
+    args = parser.parse_args()
+    convert(args.engine, model_dir=args.model_dir)
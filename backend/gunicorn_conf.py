@@ -0,0 +1,41 @@
+"""gunicorn settings for running several workers that share one copy of the model weights:
+
+    gunicorn -c gunicorn_conf.py app.main:app
+
+The master imports the app and loads the models in PRELOAD_MODELS (the ViT
+classifier and the E5 embedder) before forking, so the workers map the same
+weight pages copy-on-write instead of each loading its own copy. GC is off in
+the master and everything it allocated is frozen before fork, so collections
+in the workers do not write to (and so copy) those pages. Each worker still
+runs its own start-up warm-up, whisper-server pool and weather prefetcher.
+
+`uvicorn app.main:app --workers N` spawns fresh interpreters instead, each
+loading every model itself. Compare with `python -m scripts.bench_memory`.
+"""
+import gc, os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+timeout = 120  # a worker busy loading a model on first use must not be killed as stuck
+graceful_timeout = 30
+keepalive = 5
+
+# Avoid leaving freed holes in pages that the workers will share.
+gc.disable()
+
+def on_starting(server):
+    # Runs in the master after preload_app imported app.main, before any fork.
+    from app.config import settings
+    from app.services import warmup
+    names = [n.strip() for n in settings.PRELOAD_MODELS.split(",") if n.strip()]
+    if names:
+        timings = warmup.preload(names)
+        server.log.info("preloaded %s", ", ".join(f"{n} in {ms:.0f} ms" for n, ms in timings.items()) or "nothing")
+
+def pre_fork(server, worker):
+    gc.freeze()
+
+def post_fork(server, worker):
+    gc.enable()
@@ -0,0 +1,305 @@
+"""End-to-end benchmark of app.main against local stand-ins.
+
+Starts the real app under uvicorn with the fake LLM (USE_LLM=fake), a seeded
+local vector index with a hashing embedder, the stub weather server, fake
+whisper/espeak executables and a tiny random ViT (see scripts/standins.py).
+It then drives a mixed concurrent workload over HTTP for --duration seconds.
+
+Reported per endpoint: throughput and client-side p50/p95/p99. Reported per
+stage: STT stages from the Server-Timing header of /v1/voice, chat TTFT from
+the SSE stream, and every app histogram that saw traffic (estimated from
+buckets). The JSON written to --out can be passed to --compare on a later run.
+
+Usage: python -m scripts.bench_e2e --duration 30 --concurrency 16 \\
+           --mix chat=5,chat_stream=2,voice=1,image=1,tts=1 --out bench.json
+"""
+from __future__ import annotations
+import argparse, asyncio, io, json, math, os, platform, random, socket, struct, subprocess, sys, tempfile, threading, time
+from collections import defaultdict
+
+import httpx
+
+from scripts import standins
+from scripts.stub_weather_server import start_in_thread
+
+ENDPOINTS = ("chat", "chat_stream", "voice", "image", "tts")
+
+def _pct(samples: list[float], p: float) -> float:
+    if not samples:
+        return float("nan")
+    s = sorted(samples)
+    return s[min(len(s) - 1, max(0, math.ceil(p / 100 * len(s)) - 1))]
+
+def _summary(samples: list[float], seconds: float | None = None) -> dict:
+    out = {"n": len(samples), "p50": _pct(samples, 50), "p95": _pct(samples, 95), "p99": _pct(samples, 99),
+           "mean": sum(samples) / len(samples) if samples else float("nan"), "max": max(samples, default=float("nan"))}
+    if seconds:
+        out["rps"] = len(samples) / seconds
+    return {k: round(v, 2) if isinstance(v, float) else v for k, v in out.items()}
+
+def _hist_quantile(buckets: dict, count: int, q: float) -> float:
+    # Linear interpolation inside the bucket holding the q-th observation.
+    target, prev_le, prev_c = q * count, 0.0, 0
+    for le, c in buckets.items():
+        if c >= target:
+            if le == float("inf"):
+                return prev_le
+            span = c - prev_c
+            return prev_le + (le - prev_le) * ((target - prev_c) / span if span else 1.0)
+        prev_le, prev_c = le, c
+    return prev_le
+
+def _hist_delta(before: dict, after: dict) -> dict:
+    out = {}
+    for name, snap in after.items():
+        base = before.get(name, {"buckets": {}, "sum": 0.0, "count": 0})
+        n = snap["count"] - base["count"]
+        if n <= 0:
+            continue
+        buckets = {le: c - base["buckets"].get(le, 0) for le, c in snap["buckets"].items()}
+        out[name] = {"n": n, "mean": round((snap["sum"] - base["sum"]) / n, 2),
+                     **{f"p{p}": round(_hist_quantile(buckets, n, p / 100), 2) for p in (50, 95, 99)},
+                     "estimated": True}
+    return out
+
+def _wav(seconds: float, seed: int) -> bytes:
+    # 16 kHz mono PCM16: goes straight to whisper without ffmpeg.
+    rnd = random.Random(seed)
+    n = int(16000 * seconds)
+    pcm = struct.pack(f"<{n}h", *(int(3000 * math.sin(i * (0.05 + seed % 7 * 0.01))) + rnd.randint(-200, 200)
+                                  for i in range(n)))
+    return (b"RIFF" + struct.pack("<I", 36 + len(pcm)) + b"WAVEfmt " + struct.pack("<IHHIIHH", 16, 1, 1, 16000, 32000, 2, 16)
+            + b"data" + struct.pack("<I", len(pcm)) + pcm)
+
+def _jpeg(seed: int) -> bytes:
+    from PIL import Image
+    import numpy as np
+    arr = np.random.default_rng(seed).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _parse_server_timing(header: str) -> dict[str, float]:
+    out = {}
+    for part in (header or "").split(","):
+        name, _, rest = part.strip().partition(";dur=")
+        try:
+            out[name] = float(rest)
+        except ValueError:
+            pass
+    return out
+
+class Workload:
+    def __init__(self, client: httpx.AsyncClient, args, rnd: random.Random) -> None:
+        self.client = client
+        self.args = args
+        self.rnd = rnd
+        self.latency: dict[str, list[float]] = defaultdict(list)
+        self.stages: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.audio = [_wav(args.audio_seconds, i) for i in range(8)]
+        self.images = [_jpeg(i) for i in range(4)]
+        self.counter = 0
+
+    def _question(self) -> str:
+        q = self.rnd.choice(standins.QUESTIONS)
+        # Some unique questions so caches see a realistic hit ratio.
+        return q if self.rnd.random() < self.args.repeat_ratio else f"{q} (farm {self.rnd.randint(1, 10**6)})"
+
+    def _session(self) -> str:
+        self.counter += 1
+        return f"bench-{self.counter}"
+
+    async def chat(self) -> None:
+        r = await self.client.post("/v1/chat", json={"session_id": self._session(), "message": self._question()})
+        r.raise_for_status()
+
+    async def chat_stream(self) -> None:
+        t0 = time.perf_counter()
+        body = {"session_id": self._session(), "message": self._question(), "stream": True}
+        async with self.client.stream("POST", "/v1/chat", json=body) as r:
+            r.raise_for_status()
+            first = None
+            async for line in r.aiter_lines():
+                if first is None and line.startswith("event: token"):
+                    first = (time.perf_counter() - t0) * 1000
+                    self.stages["chat_stream.ttft_ms"].append(first)
+                if line.startswith("event: done"):
+                    break
+
+    async def voice(self) -> None:
+        files = {"audio": ("q.wav", self.rnd.choice(self.audio), "audio/wav")}
+        data = {"session_id": self._session(), "tts": "true" if self.args.voice_tts else "false"}
+        r = await self.client.post("/v1/voice", data=data, files=files)
+        r.raise_for_status()
+        for name, ms in _parse_server_timing(r.headers.get("server-timing", "")).items():
+            self.stages[f"voice.{name}_ms"].append(ms)
+
+    async def image(self) -> None:
+        files = {"file": ("leaf.jpg", self.rnd.choice(self.images), "image/jpeg")}
+        r = await self.client.post("/v1/image/classify", files=files)
+        r.raise_for_status()
+
+    async def tts(self) -> None:
+        r = await self.client.post("/v1/tts", data={"text": self._question()})
+        r.raise_for_status()
+
+    async def run(self, mix: dict[str, float], seconds: float, concurrency: int, record: bool) -> float:
+        names, weights = zip(*mix.items())
+        deadline = time.perf_counter() + seconds
+
+        async def worker() -> None:
+            while time.perf_counter() < deadline:
+                name = self.rnd.choices(names, weights)[0]
+                t0 = time.perf_counter()
+                try:
+                    await getattr(self, name)()
+                except Exception as e:
+                    if record:
+                        self.errors[name] += 1
+                        if self.errors[name] <= 3:
+                            detail = e.response.text[:200] if isinstance(e, httpx.HTTPStatusError) else e
+                            print(f"  {name} failed: {type(e).__name__}: {detail}", file=sys.stderr)
+                    continue
+                if record:
+                    self.latency[name].append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - t0
+
+def _parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint '{name}' in --mix (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return {k: v for k, v in mix.items() if v > 0}
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def _compare(current: dict, path: str) -> None:
+    with open(path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    print(f"\nvs {path} ({old['meta'].get('git_rev')}, {old['meta'].get('started')}):")
+    for section in ("endpoints", "stages"):
+        for name, cur in current[section].items():
+            prev = old.get(section, {}).get(name)
+            if not prev:
+                continue
+            deltas = []
+            for key in ("p50", "p95", "p99", "rps"):
+                if key in cur and key in prev and prev[key] and not math.isnan(prev[key]):
+                    deltas.append(f"{key} {prev[key]:.1f}->{cur[key]:.1f} ({(cur[key] - prev[key]) / prev[key] * 100:+.0f}%)")
+            print(f"  {name:32s} " + "  ".join(deltas))
+
+def _print_table(title: str, rows: dict) -> None:
+    print(f"\n{title}")
+    for name, r in rows.items():
+        rps = f" {r['rps']:7.2f}/s" if "rps" in r else ""
+        err = f" errors={r['errors']}" if r.get("errors") else ""
+        print(f"  {name:32s} n={r['n']:6d}{rps} p50={r['p50']:9.1f} p95={r['p95']:9.1f} p99={r['p99']:9.1f}{err}")
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    ap.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before the run")
+    ap.add_argument("--concurrency", type=int, default=8, help="closed-loop clients")
+    ap.add_argument("--mix", default="chat=5,chat_stream=2,voice=1,image=1,tts=1", help="endpoint weights")
+    ap.add_argument("--repeat-ratio", type=float, default=0.7, help="share of questions drawn from the fixed FAQ list")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--llm-latency-ms", type=float, default=300.0)
+    ap.add_argument("--llm-tokens-per-s", type=float, default=50.0)
+    ap.add_argument("--stt-latency-ms", type=float, default=150.0)
+    ap.add_argument("--tts-latency-ms", type=float, default=50.0)
+    ap.add_argument("--weather-latency-ms", type=float, default=50.0)
+    ap.add_argument("--embed-latency-ms", type=float, default=0.0)
+    ap.add_argument("--docs", type=int, default=500, help="passages seeded into the local index")
+    ap.add_argument("--audio-seconds", type=float, default=3.0)
+    ap.add_argument("--voice-tts", action="store_true", help="ask /v1/voice for an audio reply")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app settings (repeatable)")
+    ap.add_argument("--out", default=None, help="write results as JSON")
+    ap.add_argument("--compare", default=None, help="previous JSON result to diff against")
+    args = ap.parse_args()
+    mix = _parse_mix(args.mix)
+
+    weather, weather_url = start_in_thread(args.weather_latency_ms)
+    root = tempfile.mkdtemp(prefix="bench-e2e-")
+    overrides = dict(kv.split("=", 1) for kv in args.env)
+    env = standins.configure(root, stt_latency_ms=args.stt_latency_ms, tts_latency_ms=args.tts_latency_ms,
+                             llm_latency_ms=args.llm_latency_ms, llm_tokens_per_s=args.llm_tokens_per_s,
+                             weather_url=weather_url, overrides=overrides)
+    if "image" in mix:
+        standins.make_tiny_vit(env["VIT_MODEL_DIR"])
+
+    # Settings are read at import, so the app comes in only now.
+    import uvicorn
+    from app.services import metrics
+    standins.install_embeddings(standins.HashEmbeddings(latency_ms=args.embed_latency_ms))
+    standins.seed_index(args.docs)
+    from app.main import app
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise SystemExit("server failed to start")
+        time.sleep(0.05)
+
+    async def drive() -> tuple[Workload, float, dict, dict]:
+        limits = httpx.Limits(max_connections=args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120.0, limits=limits) as client:
+            # Warm-up runs in the background after startup; don't measure it.
+            while (await client.get("/v1/ready")).status_code != 200:
+                await asyncio.sleep(0.1)
+            load = Workload(client, args, random.Random(args.seed))
+            if args.warmup > 0:
+                await load.run(mix, args.warmup, args.concurrency, record=False)
+            before = metrics.snapshot()
+            seconds = await load.run(mix, args.duration, args.concurrency, record=True)
+            return load, seconds, before, metrics.snapshot()
+
+    started = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    try:
+        load, seconds, before, after = asyncio.run(drive())
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        weather.shutdown()
+
+    endpoints = {name: {**_summary(load.latency[name], seconds), "errors": load.errors[name]} for name in mix}
+    total = sum(len(v) for v in load.latency.values())
+    result = {
+        "meta": {"started": started, "git_rev": _git_rev(), "python": platform.python_version(),
+                 "cpus": os.cpu_count(), "args": vars(args), "env": {k: v for k, v in env.items() if not k.endswith("_BIN")}},
+        "overall": {"requests": total, "errors": sum(load.errors.values()), "seconds": round(seconds, 2),
+                    "rps": round(total / seconds, 2) if seconds else 0.0},
+        "endpoints": endpoints,
+        "stages": {**{name: _summary(v) for name, v in sorted(load.stages.items())}, **_hist_delta(before, after)},
+    }
+    print(f"\n{total} requests in {seconds:.1f}s = {result['overall']['rps']:.2f} req/s "
+          f"(concurrency {args.concurrency}, errors {result['overall']['errors']})")
+    _print_table("endpoints (client latency, ms)", endpoints)
+    _print_table("stages", result["stages"])
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, default=str)
+        print(f"\nwrote {args.out}")
+    if args.compare:
+        _compare(result, args.compare)
+
+if __name__ == "__main__":
+    main()
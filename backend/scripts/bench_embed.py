@@ -0,0 +1,169 @@
+"""Embeddings/sec of the E5 engines in app.services.rag against the
+sentence-transformers wrapper used before (EMBEDDING_ENGINE=hf):
+
+  documents  ingest-style: --docs passages of mixed length, sorted by length as
+             app.ingest does, embedded in chunks of --ingest-batch
+  queries    --queries short questions one at a time, then from --concurrency
+             threads (coalesced by the query micro-batcher in the E5 engines)
+
+Each engine's document vectors are also compared with the eager fp32 engine's
+(mean and minimum cosine), as an accuracy check on int8. hf ignores the E5
+prefixes, so its vectors differ when EMBEDDING_*_PREFIX are set.
+
+With --standins the model is a randomly initialised encoder of E5-base shape
+(scripts/standins.py, nothing downloaded); otherwise EMBEDDING_MODEL is loaded.
+
+Usage: python -m scripts.bench_embed --standins --engines hf eager int8 torchscript
+"""
+from __future__ import annotations
+import argparse, gc, json, os, random, statistics, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+_WORDS = ("wheat paddy mustard cotton sugarcane soybean maize tomato onion chickpea sowing fertilizer dose "
+          "irrigation schedule pest control seed rate disease management nitrogen urea potash phosphorus soil "
+          "moisture rainfall district farmers kharif rabi yield acre hectare spray fungicide leaf blight rust "
+          "mildew aphid borer weeding harvest storage market price scheme subsidy drip sprinkler").split()
+
+def _corpus(n: int, rng: random.Random) -> list[str]:
+    # Chunk-like passages: mostly 60-200 words, with a tail of short and long ones.
+    return [" ".join(rng.choice(_WORDS) for _ in range(max(5, min(400, int(rng.lognormvariate(4.6, 0.6))))))
+            for _ in range(n)]
+
+def _questions(n: int, rng: random.Random) -> list[str]:
+    from scripts.standins import QUESTIONS
+    return [f"{rng.choice(QUESTIONS)} ({rng.choice(_WORDS)} {i})" for i in range(n)]
+
+def _load(engine: str, model: str, args):
+    if engine == "hf":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model)
+    from app.config import settings
+    from app.services.rag import E5Embeddings
+    return E5Embeddings(model, engine=engine, batch_size=args.batch_size, max_length=settings.EMBEDDING_MAX_LENGTH,
+                        query_prefix=settings.EMBEDDING_QUERY_PREFIX, passage_prefix=settings.EMBEDDING_PASSAGE_PREFIX,
+                        query_batch_max_size=args.query_batch, query_batch_max_wait_ms=args.query_wait_ms)
+
+def _embed_docs(emb, texts: list[str]) -> np.ndarray:
+    from app.services.rag import E5Embeddings
+    if isinstance(emb, E5Embeddings):
+        return emb.encode(texts, emb.passage_prefix)
+    return np.asarray(emb.embed_documents(texts), dtype=np.float32)
+
+def _embed_query(emb, text: str) -> np.ndarray:
+    from app.services.rag import E5Embeddings
+    if isinstance(emb, E5Embeddings):
+        return emb.encode_query(text)
+    return np.asarray(emb.embed_query(text), dtype=np.float32)
+
+def _best(fn, repeat: int) -> tuple[float, object]:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t)
+    return best, result
+
+def bench_engine(engine: str, model: str, docs: list[str], queries: list[str], args) -> tuple[dict, np.ndarray]:
+    t = time.perf_counter()
+    emb = _load(engine, model, args)
+    load_s = time.perf_counter() - t
+    _embed_docs(emb, docs[:8])
+    for q in queries[:4]:
+        _embed_query(emb, q)
+
+    ordered = sorted(range(len(docs)), key=lambda i: len(docs[i]))
+
+    def documents() -> np.ndarray:
+        rows = []
+        for start in range(0, len(ordered), args.ingest_batch):
+            chunk = ordered[start:start + args.ingest_batch]
+            rows.append((chunk, _embed_docs(emb, [docs[i] for i in chunk])))
+        out = np.empty((len(docs), rows[0][1].shape[1]), dtype=np.float32)
+        for chunk, vecs in rows:
+            out[chunk] = vecs
+        return out
+
+    docs_s, vecs = _best(documents, args.repeat)
+    latencies = []
+
+    def sequential() -> None:
+        latencies.clear()
+        for q in queries:
+            t = time.perf_counter()
+            _embed_query(emb, q)
+            latencies.append((time.perf_counter() - t) * 1000)
+
+    seq_s, _ = _best(sequential, args.repeat)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        conc_s, _ = _best(lambda: list(pool.map(lambda q: _embed_query(emb, q), queries)), args.repeat)
+    del emb
+    gc.collect()
+    vecs = vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+    return {"load_s": round(load_s, 2), "docs_per_s": round(len(docs) / docs_s, 1),
+            "queries_per_s_sequential": round(len(queries) / seq_s, 1),
+            "query_p50_ms": round(statistics.median(latencies), 2),
+            "queries_per_s_concurrent": round(len(queries) / conc_s, 1)}, vecs
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--engines", nargs="+", default=["hf", "eager", "int8", "torchscript"],
+                    choices=["hf", "eager", "int8", "torchscript"])
+    ap.add_argument("--docs", type=int, default=256)
+    ap.add_argument("--queries", type=int, default=128)
+    ap.add_argument("--concurrency", type=int, default=8, help="threads embedding queries at once")
+    ap.add_argument("--ingest-batch", type=int, default=64, help="texts per embed call (INGEST_EMBED_BATCH)")
+    ap.add_argument("--batch-size", type=int, default=32, help="EMBEDDING_BATCH_SIZE: texts per forward pass")
+    ap.add_argument("--query-batch", type=int, default=16, help="EMBEDDING_QUERY_BATCH_MAX_SIZE")
+    ap.add_argument("--query-wait-ms", type=float, default=2.0, help="EMBEDDING_QUERY_BATCH_MAX_WAIT_MS")
+    ap.add_argument("--repeat", type=int, default=2, help="timed passes per measurement; the best is kept")
+    ap.add_argument("--standins", action="store_true", help="random E5-base-shaped encoder, offline")
+    ap.add_argument("--encoder-layers", type=int, default=12)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", default=None, help="write results as JSON")
+    args = ap.parse_args()
+
+    if args.standins:
+        from scripts import standins
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        model = standins.make_random_encoder(os.path.join(tempfile.mkdtemp(prefix="bench-embed-"), "encoder"),
+                                             layers=args.encoder_layers)
+    else:
+        from app.config import settings
+        model = settings.EMBEDDING_MODEL
+    import torch
+    rng = random.Random(args.seed)
+    docs, queries = _corpus(args.docs, rng), _questions(args.queries, rng)
+
+    results = {"meta": {"started": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "model": model,
+                        "torch_threads": torch.get_num_threads(), "args": vars(args)}, "engines": {}}
+    vectors = {}
+    for engine in args.engines:
+        results["engines"][engine], vectors[engine] = bench_engine(engine, model, docs, queries, args)
+        print(f"{engine}: {results['engines'][engine]}")
+    if "eager" in vectors:
+        for engine, vecs in vectors.items():
+            cos = (vecs * vectors["eager"]).sum(axis=1)
+            results["engines"][engine]["cosine_vs_eager"] = {"mean": round(float(cos.mean()), 5),
+                                                             "min": round(float(cos.min()), 5)}
+
+    base = results["engines"][args.engines[0]]
+    print(f"\n{len(docs)} passages, {len(queries)} queries, {torch.get_num_threads()} torch threads; "
+          f"speed-ups relative to {args.engines[0]}")
+    print(f"{'engine':12s} {'docs/s':>16s} {'query/s seq':>16s} {'p50 ms':>8s} "
+          f"{'query/s x' + str(args.concurrency):>16s} {'cos vs eager':>13s}")
+    for engine, r in results["engines"].items():
+        cos = r.get("cosine_vs_eager", {}).get("mean")
+        print(f"{engine:12s} {r['docs_per_s']:9.1f} ({r['docs_per_s'] / base['docs_per_s']:4.2f}x) "
+              f"{r['queries_per_s_sequential']:9.1f} ({r['queries_per_s_sequential'] / base['queries_per_s_sequential']:4.2f}x) "
+              f"{r['query_p50_ms']:8.2f} "
+              f"{r['queries_per_s_concurrent']:9.1f} ({r['queries_per_s_concurrent'] / base['queries_per_s_concurrent']:4.2f}x) "
+              f"{'-' if cos is None else f'{cos:.4f}':>13s}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.out}")
+
+if __name__ == "__main__":
+    main()
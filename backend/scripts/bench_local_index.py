@@ -0,0 +1,68 @@
+"""Query latency and recall of the local memory-mapped index vs brute-force float32.
+
+Builds float32 and int8 indexes from random (or --from-index) vectors in a
+temp directory, then runs --queries searches against each.
+
+Usage: python -m scripts.bench_local_index --rows 100000 --dim 768 --k 4
+"""
+from __future__ import annotations
+import argparse, statistics, tempfile, time
+import numpy as np
+
+from app.services.local_index import LocalVectorIndex
+
+def _load_vectors(args) -> np.ndarray:
+    if args.from_index:
+        snap = LocalVectorIndex(args.from_index).snapshot()
+        if snap is None or not snap.count:
+            raise SystemExit(f"No committed index at {args.from_index}")
+        return snap.rows_float32(0, snap.count)
+    rng = np.random.default_rng(args.seed)
+    return rng.standard_normal((args.rows, args.dim), dtype=np.float32)
+
+def _pct(ms: list[float], p: float) -> float:
+    ms = sorted(ms)
+    return ms[min(len(ms) - 1, int(round(p / 100 * (len(ms) - 1))))]
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--from-index", default=None, help="Benchmark vectors of an existing local index")
+    args = parser.parse_args()
+
+    vectors = _load_vectors(args)
+    rows, dim = vectors.shape
+    normed = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    rng = np.random.default_rng(args.seed + 1)
+    # Perturbed corpus rows make queries with a realistic score distribution.
+    picks = rng.integers(0, rows, size=args.queries)
+    queries = normed[picks] + 0.3 * rng.standard_normal((args.queries, dim), dtype=np.float32) / np.sqrt(dim)
+    truth = [set(np.argsort(normed @ q)[::-1][:args.k].tolist()) for q in queries]
+
+    ids = [str(i) for i in range(rows)]
+    texts = [""] * rows
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype in ("float32", "int8"):
+            idx = LocalVectorIndex(f"{tmp}/{dtype}", dtype=dtype)
+            t0 = time.perf_counter()
+            idx.upsert(ids, vectors, texts)
+            idx.commit()
+            build_s = time.perf_counter() - t0
+            idx.search(queries[0], k=args.k)  # map pages in
+            lat, hits = [], 0
+            for q, want in zip(queries, truth):
+                t0 = time.perf_counter()
+                res = idx.search(q, k=args.k)
+                lat.append((time.perf_counter() - t0) * 1000)
+                hits += len(want & {int(rec["id"]) for rec, _ in res})
+            recall = hits / (len(queries) * args.k)
+            print(f"{dtype:>7}: rows={rows} dim={dim} build={build_s:.2f}s "
+                  f"p50={_pct(lat, 50):.2f}ms p95={_pct(lat, 95):.2f}ms mean={statistics.mean(lat):.2f}ms "
+                  f"recall@{args.k}={recall:.4f}")
+
+if __name__ == "__main__":
+    main()
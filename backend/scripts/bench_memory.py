@@ -0,0 +1,224 @@
+"""Memory per worker for each way of running several workers (Linux only):
+
+  uvicorn   uvicorn app.main:app --workers N; spawned interpreters, each loading every model
+  gunicorn  gunicorn -c gunicorn_conf.py with PRELOAD_MODELS empty; forked workers load their own models
+  preload   gunicorn -c gunicorn_conf.py; the master loads the models before forking
+
+For each mode the server is started with --workers workers. The script waits
+until every worker has logged the end of its warm-up (which runs a ViT and an
+embedding forward pass), sends --requests image and chat requests, and waits
+for RSS to settle. It then reads /proc/<pid>/smaps_rollup for the master, each
+worker and their helper processes (whisper-server and the like). RSS counts a
+shared page in every process that maps it. PSS divides it between them, so
+the PSS total is what a mode really costs.
+
+With --standins the server runs offline on the fake LLM, whisper and espeak,
+with randomly initialised ViT and E5-shaped encoder weights of base size.
+Without it, the configuration in .env is used, so real models are loaded.
+
+Usage: python -m scripts.bench_memory --standins --workers 3
+"""
+from __future__ import annotations
+import argparse, asyncio, io, json, os, socket, subprocess, sys, tempfile, threading, time
+
+import httpx
+from PIL import Image
+
+MODES = ("uvicorn", "gunicorn", "preload")
+_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _command(mode: str, port: int, workers: int) -> list[str]:
+    if mode == "uvicorn":
+        return [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(workers), "--log-level", "warning"]
+    return [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "app.main:app",
+            "--bind", f"127.0.0.1:{port}", "--workers", str(workers)]
+
+def _children() -> dict[int, list[int]]:
+    tree: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        tree.setdefault(ppid, []).append(int(entry))
+    return tree
+
+def _descendants(pid: int, tree: dict[int, list[int]]) -> list[int]:
+    out, stack = [], list(tree.get(pid, ()))
+    while stack:
+        p = stack.pop()
+        out.append(p)
+        stack.extend(tree.get(p, ()))
+    return out
+
+def _cmdline(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+    except OSError:
+        return ""
+
+def _memory(pid: int) -> dict[str, float]:
+    # Values in MB.
+    mem = dict.fromkeys(_FIELDS, 0.0)
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in mem:
+                    mem[key] = int(rest.split()[0]) / 1024
+    except OSError:
+        pass
+    return mem
+
+def _processes(master: int) -> dict[str, list[int]]:
+    tree = _children()
+    workers = [p for p in tree.get(master, ()) if "resource_tracker" not in _cmdline(p)]
+    helpers = [p for p in _descendants(master, tree) if p not in workers]
+    return {"master": [master], "workers": sorted(workers), "helpers": helpers}
+
+def _row(mem: dict[str, float]) -> dict[str, float]:
+    return {"rss_mb": round(mem["Rss"], 1), "pss_mb": round(mem["Pss"], 1),
+            "shared_mb": round(mem["Shared_Clean"] + mem["Shared_Dirty"], 1),
+            "private_mb": round(mem["Private_Clean"] + mem["Private_Dirty"], 1),
+            "swap_mb": round(mem["Swap"], 1)}
+
+def _sum(rows: list[dict[str, float]]) -> dict[str, float]:
+    return {k: round(sum(r[k] for r in rows), 1) for k in ("rss_mb", "pss_mb", "shared_mb", "private_mb", "swap_mb")}
+
+def _image_bytes() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (320, 240), (90, 140, 60)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+async def _drive(url: str, requests: int, concurrency: int, question: str) -> int:
+    image = _image_bytes()
+    sem = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+
+        async def one(i: int) -> bool:
+            async with sem:
+                if i % 2:
+                    r = await client.post("/v1/image/classify", files={"file": ("leaf.jpg", image, "image/jpeg")})
+                else:
+                    r = await client.post("/v1/chat", json={"session_id": f"mem-{i}", "message": question})
+                return r.status_code == 200
+
+        ok = await asyncio.gather(*(one(i) for i in range(requests)))
+    return sum(ok)
+
+def _settle(pids: list[int], timeout: float, interval: float = 0.5) -> None:
+    # Wait until the summed RSS moves by less than 1% between samples.
+    last, deadline = None, time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        total = sum(_memory(p)["Rss"] for p in pids)
+        if last is not None and abs(total - last) <= 0.01 * max(last, 1.0):
+            return
+        last = total
+        time.sleep(interval)
+
+def bench_mode(mode: str, workers: int, env: dict, args) -> dict:
+    port = _free_port()
+    child_env = {**os.environ, **env, "LOG_LEVEL": "INFO"}
+    if mode == "gunicorn":
+        child_env["PRELOAD_MODELS"] = ""
+    started = time.perf_counter()
+    proc = subprocess.Popen(_command(mode, port, workers), env=child_env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True)
+    log: list[str] = []
+    threading.Thread(target=lambda: log.extend(proc.stderr), daemon=True).start()
+    try:
+        while sum("warm-up finished" in line for line in log) < workers:
+            if proc.poll() is not None:
+                raise SystemExit(f"{mode}: server exited with {proc.returncode}:\n{''.join(log)[-3000:]}")
+            if time.perf_counter() - started > args.timeout:
+                raise SystemExit(f"{mode}: workers not warm after {args.timeout:.0f}s:\n{''.join(log)[-3000:]}")
+            time.sleep(0.1)
+        warm_s = time.perf_counter() - started
+        ok = asyncio.run(_drive(f"http://127.0.0.1:{port}", args.requests, max(1, 2 * workers), args.question))
+        procs = _processes(proc.pid)
+        _settle(procs["master"] + procs["workers"], args.settle)
+        procs = _processes(proc.pid)
+        master = _row(_memory(proc.pid))
+        per_worker = [{"pid": p, **_row(_memory(p))} for p in procs["workers"]]
+        helpers = _sum([_row(_memory(p)) for p in procs["helpers"]]) if procs["helpers"] else _sum([])
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    if len(per_worker) != workers:
+        print(f"  warning: found {len(per_worker)} worker processes, expected {workers}")
+    python_total = _sum([master, *per_worker])
+    return {"warm_s": round(warm_s, 1), "requests_ok": ok, "master": master, "workers": per_worker,
+            "helpers": {"count": len(procs["helpers"]), **helpers},
+            "total_pss_mb": python_total["pss_mb"], "total_rss_mb": python_total["rss_mb"],
+            "worker_pss_mb_avg": round(sum(w["pss_mb"] for w in per_worker) / max(1, len(per_worker)), 1),
+            "worker_private_mb_avg": round(sum(w["private_mb"] for w in per_worker) / max(1, len(per_worker)), 1)}
+
+def _print_mode(mode: str, r: dict) -> None:
+    print(f"\n{mode}: all workers warm after {r['warm_s']:.1f}s, {r['requests_ok']}/{r['requests_total']} requests ok")
+    print(f"  {'process':14s} {'rss_mb':>9s} {'pss_mb':>9s} {'shared_mb':>10s} {'private_mb':>11s}")
+    rows = [("master", r["master"]), *((f"worker {w['pid']}", w) for w in r["workers"]),
+            (f"helpers ({r['helpers']['count']})", r["helpers"])]
+    for name, row in rows:
+        print(f"  {name:14s} {row['rss_mb']:9.1f} {row['pss_mb']:9.1f} {row['shared_mb']:10.1f} {row['private_mb']:11.1f}")
+    print(f"  master + workers: PSS {r['total_pss_mb']:.0f} MB (RSS sum {r['total_rss_mb']:.0f} MB); "
+          f"per worker PSS {r['worker_pss_mb_avg']:.0f} MB, private {r['worker_private_mb_avg']:.0f} MB")
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    ap.add_argument("--workers", type=int, default=3)
+    ap.add_argument("--requests", type=int, default=24, help="image and chat requests sent once all workers are warm")
+    ap.add_argument("--standins", action="store_true", help="run offline against local stand-ins")
+    ap.add_argument("--vit-layers", type=int, default=12, help="stand-in ViT depth (hidden size 768)")
+    ap.add_argument("--encoder-layers", type=int, default=12, help="stand-in encoder depth (hidden size 768)")
+    ap.add_argument("--encoder-vocab", type=int, default=30522,
+                    help="stand-in encoder vocabulary (multilingual-e5-base has 250002)")
+    ap.add_argument("--docs", type=int, default=50, help="passages seeded into the stand-in index")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra settings for the server")
+    ap.add_argument("--timeout", type=float, default=600.0, help="seconds to wait for all workers to warm up")
+    ap.add_argument("--settle", type=float, default=10.0, help="max seconds to wait for RSS to settle")
+    ap.add_argument("--question", default="What is the recommended fertilizer dose for wheat?")
+    ap.add_argument("--out", default=None, help="write results as JSON")
+    args = ap.parse_args()
+
+    overrides = dict(kv.split("=", 1) for kv in args.env)
+    env = dict(overrides)
+    if args.standins:
+        from scripts import standins
+        root = tempfile.mkdtemp(prefix="bench-memory-")
+        encoder_dir = os.path.join(root, "encoder")
+        env = standins.configure(root, overrides={"EMBEDDING_MODEL": encoder_dir, "HF_HUB_OFFLINE": "1", **overrides})
+        standins.make_tiny_vit(env["VIT_MODEL_DIR"], hidden=768, layers=args.vit_layers)
+        standins.make_random_encoder(encoder_dir, layers=args.encoder_layers, vocab_size=args.encoder_vocab)
+        standins.seed_index(args.docs)
+
+    results = {"meta": {"started": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "args": vars(args)}, "modes": {}}
+    for mode in args.modes:
+        r = bench_mode(mode, args.workers, env, args)
+        r["requests_total"] = args.requests
+        results["modes"][mode] = r
+        _print_mode(mode, r)
+    if len(results["modes"]) > 1:
+        print(f"\n{'mode':10s} {'total PSS MB':>13s} {'PSS/worker MB':>14s} {'private/worker MB':>18s}")
+        for mode, r in results["modes"].items():
+            print(f"{mode:10s} {r['total_pss_mb']:13.0f} {r['worker_pss_mb_avg']:14.0f} {r['worker_private_mb_avg']:18.0f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.out}")
+
+if __name__ == "__main__":
+    main()
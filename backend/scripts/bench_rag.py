@@ -0,0 +1,57 @@
+"""Compare cold (per-call init) and warm (process-wide) rag_search latency.
+
+Usage: python -m scripts.bench_rag --query "yellow leaves on paddy" --runs 5
+"""
+from __future__ import annotations
+import argparse, statistics, time
+
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_pinecone import PineconeVectorStore
+from pinecone import Pinecone
+
+from app.config import settings
+from app.services import rag
+from app.tools.rag_tool import rag_search
+
+def _cold_search(query: str, k: int):
+    # Mirrors the old per-call path: list indexes, reload E5, new vector store client.
+    pc = Pinecone(api_key=settings.PINECONE_API_KEY)
+    pc.list_indexes().names()
+    emb = HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL)
+    vs = PineconeVectorStore(
+        index_name=rag._normalized_index_name(settings.PINECONE_INDEX),
+        embedding=emb,
+        namespace=settings.PINECONE_NAMESPACE,
+        pinecone_api_key=settings.PINECONE_API_KEY,
+    )
+    return vs.as_retriever(search_kwargs={"k": k}).invoke(query)
+
+def _timed(fn, runs: int) -> list[float]:
+    out = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+def _report(name: str, ms: list[float]) -> None:
+    print(f"{name:>6}: mean={statistics.mean(ms):8.1f}ms  median={statistics.median(ms):8.1f}ms  "
+          f"min={min(ms):8.1f}ms  max={max(ms):8.1f}ms  (n={len(ms)})")
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--query", default="yellow leaves on paddy")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    cold = _timed(lambda: _cold_search(args.query, args.k), args.runs)
+    t0 = time.perf_counter()
+    rag.warm_up()
+    print(f"warm-up: {(time.perf_counter() - t0) * 1000:.1f}ms")
+    warm = _timed(lambda: rag_search.invoke({"query": args.query, "k": args.k}), args.runs)
+    _report("cold", cold)
+    _report("warm", warm)
+
+if __name__ == "__main__":
+    main()
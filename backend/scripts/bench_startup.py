@@ -0,0 +1,166 @@
+"""Cold-start timings for the app, each measured in fresh subprocesses:
+
+  imports  wall time of `import app.main`, plus the packages that cost most (-X importtime)
+  warmup   per-component warm-up time at each --concurrency (components from WARMUP_COMPONENTS)
+  serve    time from spawning uvicorn until /v1/health and /v1/ready answer 200,
+           then the first and second /v1/chat latency
+
+With --standins the children run offline against scripts/standins.py: the fake
+LLM, a hashing embedder, fake whisper binaries and a tiny random ViT. Without
+it they use the configuration in .env, so real models are loaded.
+
+Usage: python -m scripts.bench_startup --runs 3 --standins --concurrency 1 4
+"""
+from __future__ import annotations
+import argparse, json, os, socket, statistics, subprocess, sys, tempfile, time
+from collections import defaultdict
+
+import httpx
+
+# Child preamble: the stand-in embedder has to be installed inside the child.
+_STANDINS = "from scripts import standins; standins.install_embeddings()\n"
+
+def _child(code: str, standins: bool, **kwargs) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *kwargs.pop("flags", []), "-c", (_STANDINS if standins else "") + code],
+                          capture_output=True, text=True, **kwargs)
+
+def _importtime_by_package(stderr: str) -> dict[str, float]:
+    # Self time summed per top-level package, in ms.
+    totals: dict[str, float] = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line.split("|")
+        try:
+            self_us = int(parts[0].split(":")[1])
+        except ValueError:
+            continue  # header line
+        totals[parts[2].strip().split(".")[0]] += self_us / 1000
+    return dict(sorted(totals.items(), key=lambda kv: kv[1], reverse=True))
+
+def bench_imports(runs: int, top: int) -> dict:
+    walls, packages = [], defaultdict(list)
+    code = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+    for _ in range(runs):
+        out = _child(code, False, flags=["-X", "importtime"], check=True)
+        walls.append(float(out.stdout.strip().splitlines()[-1]) * 1000)
+        for pkg, ms in _importtime_by_package(out.stderr).items():
+            packages[pkg].append(ms)
+    ranked = sorted(((pkg, statistics.median(v)) for pkg, v in packages.items()), key=lambda kv: kv[1], reverse=True)
+    result = {"wall_ms": round(statistics.median(walls), 1), "runs_ms": [round(w, 1) for w in walls],
+              "top_packages_ms": {pkg: round(ms, 1) for pkg, ms in ranked[:top]}}
+    print(f"\nimport app.main: {result['wall_ms']:.0f} ms (median of {runs})")
+    for pkg, ms in result["top_packages_ms"].items():
+        print(f"  {pkg:28s} {ms:8.1f} ms")
+    return result
+
+def bench_warmup(runs: int, concurrencies: list[int], standins: bool) -> dict:
+    code = ("import asyncio, json, time\nimport app.main as m\nfrom app.services import warmup\n"
+            "t = time.perf_counter()\n"
+            "status = asyncio.run(warmup.run(m._warmup_components(), {c}))\n"
+            "print(json.dumps({{'total_ms': (time.perf_counter() - t) * 1000, **status}}))\n")
+    results = {}
+    for c in concurrencies:
+        totals, components = [], defaultdict(list)
+        for _ in range(runs):
+            out = _child(code.format(c=c), standins)
+            if out.returncode != 0:
+                raise SystemExit(f"warm-up child failed:\n{out.stderr[-2000:]}")
+            status = json.loads(out.stdout.strip().splitlines()[-1])
+            totals.append(status["total_ms"])
+            for name, s in status["components"].items():
+                components[name].append((s.get("ms") or 0.0, s.get("state")))
+        results[str(c)] = {
+            "total_ms": round(statistics.median(totals), 1),
+            "components": {name: {"ms": round(statistics.median(ms for ms, _ in v), 1),
+                                  "states": sorted({st for _, st in v})} for name, v in components.items()},
+        }
+        print(f"\nwarm-up, concurrency {c}: {results[str(c)]['total_ms']:.0f} ms total (median of {runs})")
+        for name, r in results[str(c)]["components"].items():
+            print(f"  {name:12s} {r['ms']:8.1f} ms  {','.join(r['states'])}")
+    return results
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def bench_serve(runs: int, standins: bool, timeout: float, question: str) -> dict:
+    samples = defaultdict(list)
+    for _ in range(runs):
+        port = _free_port()
+        code = f"import uvicorn\nuvicorn.run('app.main:app', host='127.0.0.1', port={port}, log_level='warning')\n"
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-c", (_STANDINS if standins else "") + code],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        marks: dict[str, float] = {}
+        try:
+            with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+                while "ready" not in marks:
+                    if proc.poll() is not None:
+                        raise SystemExit(f"server exited with {proc.returncode}:\n{proc.stderr.read()[-2000:]}")
+                    if time.perf_counter() - t0 > timeout:
+                        raise SystemExit(f"not ready after {timeout:.0f}s (reached: {', '.join(marks) or 'nothing'})")
+                    for mark, path in (("health", "/v1/health"), ("ready", "/v1/ready")):
+                        if mark in marks:
+                            continue
+                        try:
+                            if client.get(path).status_code == 200:
+                                marks[mark] = (time.perf_counter() - t0) * 1000
+                        except httpx.TransportError:
+                            pass
+                        break
+                    time.sleep(0.02)
+                for mark in ("first_chat", "second_chat"):
+                    t = time.perf_counter()
+                    client.post("/v1/chat", json={"session_id": f"startup-{mark}", "message": question}).raise_for_status()
+                    marks[mark] = (time.perf_counter() - t) * 1000
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        for mark, ms in marks.items():
+            samples[mark].append(ms)
+    result = {mark: round(statistics.median(v), 1) for mark, v in samples.items()}
+    print(f"\nserve (median of {runs}): spawn -> /v1/health {result['health']:.0f} ms, -> /v1/ready {result['ready']:.0f} ms; "
+          f"first chat {result['first_chat']:.0f} ms, second chat {result['second_chat']:.0f} ms")
+    return result
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sections", nargs="+", default=["imports", "warmup", "serve"], choices=["imports", "warmup", "serve"])
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 4], help="WARMUP_CONCURRENCY values to compare")
+    ap.add_argument("--top", type=int, default=12, help="packages listed in the import breakdown")
+    ap.add_argument("--standins", action="store_true", help="run offline against local stand-ins")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra settings for the children")
+    ap.add_argument("--timeout", type=float, default=300.0, help="seconds to wait for /v1/ready")
+    ap.add_argument("--question", default="What is the recommended fertilizer dose for wheat?")
+    ap.add_argument("--out", default=None, help="write results as JSON")
+    args = ap.parse_args()
+
+    overrides = dict(kv.split("=", 1) for kv in args.env)
+    if args.standins:
+        from scripts import standins
+        root = tempfile.mkdtemp(prefix="bench-startup-")
+        env = standins.configure(root, overrides=overrides)
+        standins.make_tiny_vit(env["VIT_MODEL_DIR"])
+    else:
+        os.environ.update(overrides)
+
+    results = {"meta": {"started": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "args": vars(args)}}
+    if "imports" in args.sections:
+        results["imports"] = bench_imports(args.runs, args.top)
+    if "warmup" in args.sections:
+        results["warmup"] = bench_warmup(args.runs, args.concurrency, args.standins)
+    if "serve" in args.sections:
+        results["serve"] = bench_serve(args.runs, args.standins, args.timeout, args.question)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.out}")
+
+if __name__ == "__main__":
+    main()
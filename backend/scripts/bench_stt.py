@@ -0,0 +1,47 @@
+"""Per-stage STT latency: resident whisper-server pool vs whisper-cli per request.
+
+Usage: python -m scripts.bench_stt --audio sample.ogg --runs 5 [--concurrency 4]
+"""
+from __future__ import annotations
+import argparse, statistics, time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services import stt, whisper_pool
+
+def _report(label: str, rows: list[dict], wall: float) -> None:
+    print(f"{label} ({len(rows)} runs, {wall:.1f}s wall)")
+    for stage in ("decode_ms", "queue_ms", "inference_ms", "total_ms"):
+        vals = [r[stage] for r in rows if stage in r]
+        if vals:
+            print(f"  {stage:13s} p50={statistics.median(vals):8.1f}  max={max(vals):8.1f}")
+
+def _run(data: bytes, runs: int, concurrency: int, language: str | None) -> tuple[list[dict], float]:
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as ex:
+        rows = list(ex.map(lambda _: stt.transcribe_timed(data=data, language=language)[1], range(runs)))
+    return rows, time.perf_counter() - t0
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--audio", required=True)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--language", default=None)
+    args = ap.parse_args()
+    with open(args.audio, "rb") as f:
+        data = f.read()
+
+    t0 = time.perf_counter()
+    pool = whisper_pool.get_whisper_pool()
+    if pool is None:
+        print("whisper-server pool unavailable (STT_WORKERS=0 or start failed)")
+    else:
+        print(f"pool start: {time.perf_counter() - t0:.2f}s ({pool.stats()['workers']} workers)")
+        _report("whisper-server pool", *_run(data, args.runs, args.concurrency, args.language))
+        whisper_pool.shutdown()
+
+    stt.get_whisper_pool = lambda: None  # force the per-request whisper-cli path
+    _report("whisper-cli", *_run(data, args.runs, args.concurrency, args.language))
+
+if __name__ == "__main__":
+    main()
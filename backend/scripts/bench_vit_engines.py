@@ -0,0 +1,85 @@
+"""Accuracy/latency comparison of ViT inference engines (eager, int8, torchscript).
+
+Images come from --images (a folder; if it has one sub-folder per label the
+folder name is used as ground truth) or are random noise. Engines other than
+eager must be converted first: python -m app.vit_convert --engine int8 torchscript
+
+Usage: python -m scripts.bench_vit_engines --images ./samples --batch-sizes 1 8
+"""
+from __future__ import annotations
+import argparse, os, statistics, time
+import torch
+from PIL import Image
+from transformers import AutoImageProcessor
+
+from app.config import settings
+from app.tools import vit
+
+_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+def _load_images(folder: str | None, n_random: int) -> tuple[list[Image.Image], list[str | None]]:
+    if not folder:
+        gen = torch.Generator().manual_seed(0)
+        imgs = [Image.fromarray((torch.rand(224, 224, 3, generator=gen) * 255).byte().numpy()) for _ in range(n_random)]
+        return imgs, [None] * n_random
+    images, truth = [], []
+    for root, _, files in os.walk(folder):
+        label = os.path.basename(root) if os.path.abspath(root) != os.path.abspath(folder) else None
+        for name in sorted(files):
+            if name.lower().endswith(_EXTS):
+                with open(os.path.join(root, name), "rb") as f:
+                    images.append(vit.decode_image(f.read()))
+                truth.append(label)
+    return images, truth
+
+def _label(labels, idx: int) -> str:
+    return labels.get(idx, str(idx)) if isinstance(labels, dict) else str(idx)
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", default=None)
+    parser.add_argument("--random", type=int, default=32, help="Noise images when --images is not given")
+    parser.add_argument("--engines", nargs="+", default=list(vit.ENGINES), choices=list(vit.ENGINES))
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model_dir = settings.VIT_MODEL_DIR
+    processor = AutoImageProcessor.from_pretrained(model_dir)
+    labels = vit._load_model()[2]
+    images, truth = _load_images(args.images, args.random)
+    pixels = processor(images=images, return_tensors="pt")["pixel_values"]
+    print(f"{len(images)} images, torch threads={torch.get_num_threads()}")
+
+    reference = None
+    for engine in args.engines:
+        if engine != "eager" and not os.path.isfile(vit.converted_path(engine, model_dir)):
+            print(f"{engine:>11}: skipped (not converted)")
+            continue
+        model = vit._load_engine(model_dir, engine)
+        with torch.no_grad():
+            preds = model(pixels).argmax(dim=-1)
+        if reference is None:
+            reference = preds
+        agree = (preds == reference).float().mean().item()
+        labelled = [(p, t) for p, t in zip(preds.tolist(), truth) if t is not None]
+        acc = (sum(_label(labels, p) == t for p, t in labelled) / len(labelled)) if labelled else None
+        line = f"{engine:>11}: top1-agreement={agree:.4f}" + (f" accuracy={acc:.4f}" if acc is not None else "")
+        for bs in args.batch_sizes:
+            batch = pixels[:bs] if pixels.shape[0] >= bs else pixels.repeat((bs + pixels.shape[0] - 1) // pixels.shape[0], 1, 1, 1)[:bs]
+            with torch.no_grad():
+                model(batch)  # warm-up
+                times = []
+                for _ in range(args.runs):
+                    t0 = time.perf_counter()
+                    model(batch)
+                    times.append((time.perf_counter() - t0) * 1000)
+            med = statistics.median(times)
+            line += f"  bs={bs}: {med:.1f}ms ({bs / med * 1000:.1f} img/s)"
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""get_weather latency and upstream request counts against the local stub API.
+
+Runs cold lookups (empty caches), warm lookups, and a concurrent burst through
+the async tool path, then lets the background refresher run once and reports
+how many upstream requests each phase cost.
+
+Usage: python -m scripts.bench_weather --cities 20 --latency-ms 50
+"""
+from __future__ import annotations
+import argparse, asyncio, os, statistics, tempfile, time
+
+from scripts.stub_weather_server import start_in_thread
+
+def _ms(samples: list[float]) -> str:
+    return f"p50={statistics.median(samples):.2f}ms max={max(samples):.2f}ms"
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cities", type=int, default=20)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    ap.add_argument("--burst", type=int, default=200)
+    args = ap.parse_args()
+
+    server, base = start_in_thread(args.latency_ms)
+    tmp = tempfile.mkdtemp(prefix="bench-weather-")
+    os.environ.update({
+        "WEATHER_GEOCODE_URL": f"{base}/v1/search",
+        "WEATHER_FORECAST_URL": f"{base}/v1/forecast",
+        "WEATHER_GEOCODE_CACHE_PATH": os.path.join(tmp, "geocode.db"),
+        "WEATHER_PREFETCH_INTERVAL_S": "1",
+    })
+    from app.tools import weather  # settings are read at import
+
+    cities = [f"village-{i}" for i in range(args.cities)]
+
+    def phase() -> None:
+        counts = dict(server.counts)
+        server.counts.clear()
+        print(f"  upstream: geocode={counts.get('/v1/search', 0)} forecast={counts.get('/v1/forecast', 0)}")
+
+    for label in ("cold", "warm"):
+        samples = []
+        for c in cities:
+            t0 = time.perf_counter()
+            out = weather.get_weather.invoke({"city": c})
+            samples.append((time.perf_counter() - t0) * 1000)
+            assert "error" not in out, out
+        print(f"{label:5s} {_ms(samples)}")
+        phase()
+
+    async def burst() -> float:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(weather.get_weather.ainvoke({"city": cities[i % len(cities)]}) for i in range(args.burst)))
+        return (time.perf_counter() - t0) * 1000
+    print(f"burst {args.burst} async calls in {asyncio.run(burst()):.1f}ms")
+    phase()
+
+    weather.start_prefetcher()
+    time.sleep(1.5)
+    weather.stop_prefetcher()
+    print("prefetch after one interval")
+    phase()
+    print(weather.cache_stats())
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
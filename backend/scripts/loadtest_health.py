@@ -0,0 +1,65 @@
+"""Health-check latency while long /v1/chat requests are in flight.
+
+Measures /v1/health latency on an idle server, then again while --chats
+concurrent chat requests are running. With blocking work offloaded to the
+resource pools the two distributions should be about the same.
+
+Usage: python -m scripts.loadtest_health --url http://localhost:8000 --chats 16
+"""
+from __future__ import annotations
+import argparse, asyncio, statistics, time
+import httpx
+
+def _pct(ms: list[float], p: float) -> float:
+    ms = sorted(ms)
+    return ms[min(len(ms) - 1, int(round(p / 100 * (len(ms) - 1))))] if ms else float("nan")
+
+async def _probe(client: httpx.AsyncClient, stop: asyncio.Event, interval: float) -> list[float]:
+    out = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        r = await client.get("/v1/health")
+        r.raise_for_status()
+        out.append((time.perf_counter() - t0) * 1000)
+        await asyncio.sleep(interval)
+    return out
+
+async def _chat(client: httpx.AsyncClient, i: int, message: str) -> float:
+    t0 = time.perf_counter()
+    r = await client.post("/v1/chat", json={"session_id": f"loadtest-{i}", "message": message})
+    r.raise_for_status()
+    return time.perf_counter() - t0
+
+def _report(name: str, ms: list[float]) -> None:
+    print(f"{name:>10}: n={len(ms):4d} p50={_pct(ms, 50):7.1f}ms p95={_pct(ms, 95):7.1f}ms "
+          f"p99={_pct(ms, 99):7.1f}ms max={max(ms, default=float('nan')):7.1f}ms")
+
+async def main(args) -> None:
+    limits = httpx.Limits(max_connections=args.chats + 4)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        stop = asyncio.Event()
+        idle = asyncio.create_task(_probe(client, stop, args.interval))
+        await asyncio.sleep(args.idle_seconds)
+        stop.set()
+        baseline = await idle
+
+        stop = asyncio.Event()
+        probe = asyncio.create_task(_probe(client, stop, args.interval))
+        chats = await asyncio.gather(*[_chat(client, i, args.message) for i in range(args.chats)], return_exceptions=True)
+        stop.set()
+        loaded = await probe
+
+    ok = [c for c in chats if isinstance(c, float)]
+    print(f"chat requests: {len(ok)}/{len(chats)} ok, mean {statistics.mean(ok) if ok else float('nan'):.2f}s")
+    _report("idle", baseline)
+    _report("under load", loaded)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--chats", type=int, default=16)
+    parser.add_argument("--message", default="Explain integrated pest management for cotton in detail.")
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--idle-seconds", type=float, default=3.0)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    asyncio.run(main(parser.parse_args()))
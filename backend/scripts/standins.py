@@ -0,0 +1,206 @@
+"""Local stand-ins for the external dependencies of app.main, for offline
+benchmarks: fake whisper-cli / whisper-server / espeak-ng executables with
+configurable latency, a deterministic hashing embedder, randomly initialised
+ViT and E5-shaped encoder models, and a seeded local vector index.
+
+configure() must run before anything from `app` is imported, since settings
+are read from the environment at import time.
+"""
+from __future__ import annotations
+import hashlib, os, stat, sys, textwrap, time
+from typing import Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+QUESTIONS = [
+    "What is the weather in Nashik today?",
+    "Will it rain in Ludhiana tomorrow?",
+    "What is the recommended fertilizer dose for wheat?",
+    "When should I sow mustard in Rajasthan?",
+    "How do I control stem borer in paddy?",
+    "How much irrigation does sugarcane need in summer?",
+    "Which government schemes support drip irrigation?",
+    "What is the seed rate for soybean per acre?",
+    "How can I improve soil organic carbon on my farm?",
+    "What causes yellowing of leaves in cotton?",
+]
+
+_WHISPER_CLI = '''\
+#!{python}
+import sys, time, hashlib
+time.sleep({model_load_ms} / 1000 + {latency_ms} / 1000)
+path = sys.argv[sys.argv.index("-f") + 1]
+questions = {questions!r}
+digest = hashlib.sha256(open(path, "rb").read()).digest()
+print("[00:00:00.000 --> 00:00:02.000]  " + questions[digest[0] % len(questions)])
+'''
+
+_WHISPER_SERVER = '''\
+#!{python}
+import sys, time, json, hashlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+port = int(sys.argv[sys.argv.index("--port") + 1])
+questions = {questions!r}
+time.sleep({model_load_ms} / 1000)
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep({latency_ms} / 1000)
+        text = questions[hashlib.sha256(body).digest()[0] % len(questions)]
+        data = json.dumps({{"text": " " + text}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+# One inference at a time, like whisper-server.
+HTTPServer(("127.0.0.1", port), Handler).serve_forever()
+'''
+
+_ESPEAK = '''\
+#!{python}
+import sys, struct, time
+text = sys.argv[-1]
+rate = 22050
+# ~70 ms of audio per character, written in 100 ms chunks like a live synthesizer.
+frames = max(1, len(text)) * rate * 70 // 1000
+sys.stdout.buffer.write(b"RIFF" + struct.pack("<I", 0x7FFFF000) + b"WAVEfmt "
+                        + struct.pack("<IHHIIHH", 16, 1, 1, rate, rate * 2, 2, 16)
+                        + b"data" + struct.pack("<I", 0x7FFFF000))
+sys.stdout.buffer.flush()
+time.sleep({latency_ms} / 1000)
+chunk = rate // 10
+sent = 0
+while sent < frames:
+    n = min(chunk, frames - sent)
+    sys.stdout.buffer.write(bytes(2 * n))
+    sys.stdout.buffer.flush()
+    sent += n
+    time.sleep({per_chunk_ms} / 1000)
+'''
+
+def _write_exe(path: str, source: str) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(textwrap.dedent(source))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+def write_fake_binaries(root: str, stt_latency_ms: float, tts_latency_ms: float, model_load_ms: float = 200) -> dict:
+    """Write fake whisper-cli, whisper-server and espeak-ng into root/bin."""
+    bin_dir = os.path.join(root, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    common = {"python": sys.executable, "questions": QUESTIONS, "model_load_ms": model_load_ms}
+    model = os.path.join(root, "ggml-fake.bin")
+    open(model, "wb").close()
+    return {
+        "WHISPER_CPP_BIN": _write_exe(os.path.join(bin_dir, "whisper-cli"),
+                                      _WHISPER_CLI.format(latency_ms=stt_latency_ms, **common)),
+        "WHISPER_SERVER_BIN": _write_exe(os.path.join(bin_dir, "whisper-server"),
+                                         _WHISPER_SERVER.format(latency_ms=stt_latency_ms, **common)),
+        "WHISPER_MODEL_PATH": model,
+        "ESPEAK_BIN": _write_exe(os.path.join(bin_dir, "espeak-ng"),
+                                 _ESPEAK.format(python=sys.executable, latency_ms=tts_latency_ms, per_chunk_ms=5)),
+    }
+
+class HashEmbeddings(Embeddings):
+    """Deterministic bag-of-words hashing embedder standing in for E5: same
+    dimension, similar texts land close together, no model download."""
+
+    def __init__(self, dim: int = 768, latency_ms: float = 0.0) -> None:
+        self.dim = dim
+        self.latency_ms = latency_ms
+
+    def _one(self, text: str) -> list[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for word in text.casefold().split():
+            h = hashlib.blake2b(word.strip("?.,!").encode("utf-8"), digest_size=8).digest()
+            vec[int.from_bytes(h[:4], "little") % self.dim] += 1.0 if h[4] & 1 else -1.0
+        norm = float(np.linalg.norm(vec))
+        return (vec / norm if norm else vec).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [self._one(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+def make_tiny_vit(model_dir: str, labels: Optional[list[str]] = None, hidden: int = 192, layers: int = 4) -> str:
+    """Save a randomly initialised ViT classifier (real forward pass, no download)."""
+    from transformers import ViTConfig, ViTForImageClassification, ViTImageProcessor
+    labels = labels or ["healthy", "leaf_blight", "leaf_rust", "powdery_mildew", "leaf_spot"]
+    config = ViTConfig(image_size=224, patch_size=16, hidden_size=hidden, num_hidden_layers=layers,
+                       num_attention_heads=max(1, hidden // 64), intermediate_size=hidden * 4,
+                       num_labels=len(labels), id2label=dict(enumerate(labels)),
+                       label2id={l: i for i, l in enumerate(labels)})
+    os.makedirs(model_dir, exist_ok=True)
+    ViTForImageClassification(config).eval().save_pretrained(model_dir)
+    ViTImageProcessor(size={"height": 224, "width": 224}).save_pretrained(model_dir)
+    return model_dir
+
+def make_random_encoder(model_dir: str, hidden: int = 768, layers: int = 12, vocab_size: int = 30522) -> str:
+    """Save a randomly initialised BERT encoder that HuggingFaceEmbeddings loads
+    like E5 (mean pooling); the defaults give base-size weights. For
+    EMBEDDING_MODEL when real forward passes and weight memory matter."""
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+    os.makedirs(model_dir, exist_ok=True)
+    chars = "abcdefghijklmnopqrstuvwxyz0123456789"
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *chars, *(f"##{c}" for c in chars)]
+    with open(os.path.join(model_dir, "vocab.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(vocab))
+    BertTokenizerFast(vocab_file=os.path.join(model_dir, "vocab.txt")).save_pretrained(model_dir)
+    config = BertConfig(vocab_size=max(vocab_size, len(vocab)), hidden_size=hidden, num_hidden_layers=layers,
+                        num_attention_heads=max(1, hidden // 64), intermediate_size=hidden * 4)
+    BertModel(config).eval().save_pretrained(model_dir)
+    return model_dir
+
+def configure(root: str, stt_latency_ms: float = 150, tts_latency_ms: float = 50, llm_latency_ms: float = 300,
+              llm_tokens_per_s: float = 50, weather_url: Optional[str] = None, overrides: Optional[dict] = None) -> dict:
+    """Point the app's settings at the stand-ins under root. Returns the env applied."""
+    env = {
+        "USE_LLM": "fake",
+        "FAKE_LLM_LATENCY_MS": str(llm_latency_ms),
+        "FAKE_LLM_TOKENS_PER_S": str(llm_tokens_per_s),
+        "VECTOR_BACKEND": "local",
+        "LOCAL_INDEX_DIR": os.path.join(root, "index"),
+        "RAG_CACHE_DIR": os.path.join(root, "rag_cache"),
+        "STT_PROVIDER": "local",
+        "TTS_PROVIDER": "espeak",
+        "TTS_CACHE_DIR": os.path.join(root, "tts_cache"),
+        "VIT_MODEL_DIR": os.path.join(root, "vit"),
+        "VIT_LABELS_JSON": os.path.join(root, "vit", "labels.json"),  # absent: labels come from the config
+        "SESSION_STORE": "memory",
+        "WEATHER_GEOCODE_CACHE_PATH": os.path.join(root, "geocode.db"),
+        "WEATHER_PREFETCH_INTERVAL_S": "0",
+        **write_fake_binaries(root, stt_latency_ms, tts_latency_ms),
+    }
+    if weather_url:
+        env["WEATHER_GEOCODE_URL"] = f"{weather_url}/v1/search"
+        env["WEATHER_FORECAST_URL"] = f"{weather_url}/v1/forecast"
+    env.update(overrides or {})
+    os.environ.update(env)
+    return env
+
+def install_embeddings(embedder: Optional[Embeddings] = None) -> None:
+    """Swap the app's embedding model for the hashing stand-in (call after configure())."""
+    from app.services import rag
+    rag._emb = embedder or HashEmbeddings()
+
+def seed_index(n_docs: int = 500) -> int:
+    """Fill the local index with synthetic agronomy passages."""
+    from langchain_core.documents import Document
+    from app.services import rag
+    crops = ["wheat", "paddy", "mustard", "cotton", "sugarcane", "soybean", "maize", "tomato", "onion", "chickpea"]
+    topics = ["sowing time", "fertilizer dose", "irrigation schedule", "pest control", "seed rate", "disease management"]
+    docs = [Document(page_content=f"{crops[i % len(crops)].title()} {topics[i % len(topics)]}: passage {i}. "
+                                  f"{QUESTIONS[i % len(QUESTIONS)]} Advice number {i} for farmers in district {i % 37}.",
+                     metadata={"source": f"bench://doc/{i}"}) for i in range(n_docs)]
+    rag.add_documents(docs, ids=[f"bench-{i}" for i in range(n_docs)])
+    return n_docs
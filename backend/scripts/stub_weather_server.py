@@ -0,0 +1,89 @@
+"""Local stand-in for the Open-Meteo geocoding and forecast APIs.
+
+Answers any city name with deterministic coordinates and supports the
+multi-coordinate forecast form (comma-separated latitude/longitude). Request
+counts are served at /stats so callers can check what was cached.
+
+Usage: python -m scripts.stub_weather_server --port 8765 --latency-ms 50
+  then WEATHER_GEOCODE_URL=http://127.0.0.1:8765/v1/search
+       WEATHER_FORECAST_URL=http://127.0.0.1:8765/v1/forecast
+"""
+from __future__ import annotations
+import argparse, hashlib, json, threading, time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+def _coords(name: str) -> tuple[float, float]:
+    h = hashlib.sha256(name.casefold().encode("utf-8")).digest()
+    return round(8 + h[0] / 255 * 28, 4), round(68 + h[1] / 255 * 29, 4)
+
+def _current(lat: float, lon: float, fahrenheit: bool) -> dict:
+    temp = round(20 + (lat + lon) % 15, 1)
+    return {
+        "temperature_2m": round(temp * 9 / 5 + 32, 1) if fahrenheit else temp,
+        "relative_humidity_2m": int(40 + (lat * lon) % 50),
+        "weather_code": 3,
+    }
+
+def make_server(host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0) -> ThreadingHTTPServer:
+    counts: Counter = Counter()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _json(self, body, status: int = 200) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            q = {k: v[0] for k, v in parse_qs(url.query).items()}
+            counts[url.path] += 1
+            if url.path == "/stats":
+                return self._json(dict(counts))
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            if url.path == "/v1/search":
+                name = q.get("name", "")
+                if not name or name.casefold().startswith("nowhere"):
+                    return self._json({"generationtime_ms": 0.1})
+                lat, lon = _coords(name)
+                return self._json({"results": [{"name": name.title(), "country": "India", "latitude": lat, "longitude": lon}]})
+            if url.path == "/v1/forecast":
+                lats = [float(x) for x in q.get("latitude", "").split(",") if x]
+                lons = [float(x) for x in q.get("longitude", "").split(",") if x]
+                if not lats or len(lats) != len(lons):
+                    return self._json({"error": True, "reason": "latitude/longitude mismatch"}, 400)
+                fahrenheit = q.get("temperature_unit") == "fahrenheit"
+                rows = [{"latitude": a, "longitude": b, "current": _current(a, b, fahrenheit)} for a, b in zip(lats, lons)]
+                return self._json(rows if len(rows) > 1 else rows[0])
+            self._json({"error": True, "reason": "not found"}, 404)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.counts = counts  # type: ignore[attr-defined]
+    return server
+
+def start_in_thread(latency_ms: float = 0.0) -> tuple[ThreadingHTTPServer, str]:
+    server = make_server(latency_ms=latency_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    args = ap.parse_args()
+    server = make_server(args.host, args.port, args.latency_ms)
+    print(f"stub weather API on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
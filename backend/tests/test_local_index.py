@@ -0,0 +1,63 @@
+"""LocalVectorIndex reads while another instance keeps committing."""
+from __future__ import annotations
+import threading
+
+import numpy as np
+
+from app.services.local_index import LocalVectorIndex
+
+_DIM = 8
+
+def _rows(rng: np.random.Generator, n: int, gen: int) -> tuple[list[str], np.ndarray, list[str], list[dict]]:
+    ids = [f"doc-{i}" for i in range(n)]
+    return ids, rng.normal(size=(n, _DIM)), [f"text {i} " + "x" * (gen % 50) for i in range(n)], [{"gen": gen}] * n
+
+def test_search_returns_records_and_scores(tmp_path):
+    rng = np.random.default_rng(0)
+    index = LocalVectorIndex(str(tmp_path), dtype="int8")
+    ids, vecs, texts, metas = _rows(rng, 20, 0)
+    index.upsert(ids, vecs, texts, metas)
+    assert index.commit() == 20
+    (rec, score), *_ = index.search(vecs[7], k=3)
+    assert rec == {"id": "doc-7", "text": texts[7], "metadata": {"gen": 0}}
+    assert score > 0.99
+    index.delete(["doc-7"])
+    index.commit()
+    assert len(index) == 19
+    assert all(r["id"] != "doc-7" for r, _ in index.search(vecs[7], k=5))
+
+def test_concurrent_search_during_commits(tmp_path):
+    rng = np.random.default_rng(1)
+    writer = LocalVectorIndex(str(tmp_path))
+    writer.upsert(*_rows(rng, 200, 0))
+    writer.commit()
+    reader = LocalVectorIndex(str(tmp_path))
+    queries = rng.normal(size=(16, _DIM))
+    stop = threading.Event()
+    errors: list[BaseException] = []
+    searches = [0]
+
+    def search() -> None:
+        try:
+            while not stop.is_set():
+                for q in queries:
+                    for rec, _ in reader.search(q, k=5):
+                        assert rec["id"].startswith("doc-") and rec["text"].startswith("text ")
+                        assert rec["text"].endswith("x" * (rec["metadata"]["gen"] % 50))
+                    searches[0] += 1
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(8)]
+    for t in threads:
+        t.start()
+    try:
+        for gen in range(1, 41):
+            writer.upsert(*_rows(rng, 200, gen))
+            writer.commit()
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    assert not errors, errors[:3]
+    assert searches[0] > 0
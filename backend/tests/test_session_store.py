@@ -0,0 +1,44 @@
+"""Sliding per-session TTL of the session stores."""
+from __future__ import annotations
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from app.services.session_store import MemorySessionStore, SQLiteSessionStore
+
+@pytest.fixture(params=["memory", "sqlite", "sqlite-buffered"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore(100, 1 << 20, ttl=0.5, max_messages=100)
+    interval = 0 if request.param == "sqlite" else 60_000  # buffered: never flushed by the timer here
+    return SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=0.5, flush_interval_ms=interval)
+
+def _texts(store, session_id: str, limit=None) -> list[str]:
+    return [m.content for m in store.get_messages(session_id, limit=limit)]
+
+def _add(store, session_id: str, text: str) -> None:
+    store.add_messages(session_id, [HumanMessage(content=text)])
+
+def test_activity_keeps_the_whole_session_alive(store):
+    for i in range(4):
+        _add(store, "s", f"turn {i}")
+        time.sleep(0.3)
+    assert _texts(store, "s") == [f"turn {i}" for i in range(4)]
+    assert _texts(store, "s", limit=2) == ["turn 2", "turn 3"]
+
+def test_idle_session_expires_as_a_whole(store):
+    _add(store, "s", "old turn")
+    time.sleep(0.7)
+    assert _texts(store, "s") == []
+
+def test_message_after_expiry_starts_a_new_session(store):
+    _add(store, "s", "old turn")
+    time.sleep(0.7)
+    assert _texts(store, "s") == []
+    _add(store, "s", "new turn")
+    assert _texts(store, "s") == ["new turn"]
+    if isinstance(store, SQLiteSessionStore):
+        store.flush()
+        assert _texts(store, "s") == ["new turn"]
+        assert store.stats()["messages"] == 1
@@ -0,0 +1,103 @@
+"""get_weather caching against scripts.stub_weather_server (no network)."""
+from __future__ import annotations
+import asyncio, threading, time
+
+import pytest
+
+from app.config import settings
+from app.tools import weather
+from scripts.stub_weather_server import start_in_thread
+
+@pytest.fixture(scope="module")
+def stub():
+    server, base = start_in_thread(latency_ms=50)
+    yield server, base
+    server.shutdown()
+
+@pytest.fixture
+def upstream(stub, tmp_path, monkeypatch):
+    """Request counts of the stub, with the weather caches emptied."""
+    server, base = stub
+    monkeypatch.setattr(settings, "WEATHER_GEOCODE_URL", f"{base}/v1/search")
+    monkeypatch.setattr(settings, "WEATHER_FORECAST_URL", f"{base}/v1/forecast")
+    monkeypatch.setattr(settings, "WEATHER_GEOCODE_CACHE_PATH", str(tmp_path / "geocode.db"))
+    monkeypatch.setattr(weather, "_db_local", threading.local())
+    weather._geocode_mem.clear()
+    weather._forecast_cache.clear()
+    weather._demand.clear()
+    server.counts.clear()
+    yield server.counts
+    weather.stop_prefetcher()
+
+def _lookup(city: str, unit: str = "c") -> dict:
+    out = weather.get_weather.invoke({"city": city, "unit": unit})
+    assert "error" not in out, out
+    return out
+
+def test_repeat_lookup_is_served_from_cache(upstream):
+    first = _lookup("Nashik")
+    assert _lookup("  nashik ") == first
+    assert upstream["/v1/search"] == 1
+    assert upstream["/v1/forecast"] == 1
+    assert weather.cache_stats()["forecast"]["hits"] >= 1
+
+def test_geocode_survives_a_memory_cache_clear(upstream):
+    _lookup("Indore")
+    weather._geocode_mem.clear()
+    _lookup("Indore")
+    assert upstream["/v1/search"] == 1
+
+def test_unknown_city_miss_is_cached(upstream):
+    for _ in range(2):
+        assert "error" in weather.get_weather.invoke({"city": "Nowhere Town"})
+    assert upstream["/v1/search"] == 1
+    assert upstream["/v1/forecast"] == 0
+
+def test_units_are_cached_separately(upstream):
+    c, f = _lookup("Pune"), _lookup("Pune", "f")
+    assert (c["unit"], f["unit"]) == ("C", "F")
+    assert f["temperature"] == pytest.approx(c["temperature"] * 9 / 5 + 32, abs=0.1)
+    assert upstream["/v1/forecast"] == 2
+
+def test_forecast_expires_after_ttl(upstream, monkeypatch):
+    monkeypatch.setattr(weather._forecast_cache, "ttl", 0.2)
+    _lookup("Ludhiana")
+    _lookup("Ludhiana")
+    assert upstream["/v1/forecast"] == 1
+    time.sleep(0.3)
+    _lookup("Ludhiana")
+    assert upstream["/v1/forecast"] == 2
+    assert upstream["/v1/search"] == 1  # coordinates have their own, much longer TTL
+
+def test_concurrent_misses_share_one_request(upstream):
+    assert weather._run(weather._geocode("Guntur")).result() is not None
+
+    async def burst():
+        return await asyncio.gather(*(weather.get_weather.ainvoke({"city": "Guntur"}) for _ in range(20)))
+
+    results = asyncio.run(burst())
+    assert all(r == results[0] and "error" not in r for r in results)
+    assert upstream["/v1/forecast"] == 1
+
+@pytest.mark.parametrize("batch, requests", [(25, 1), (2, 3)])
+def test_prefetch_refreshes_hot_locations_in_batches(upstream, monkeypatch, batch, requests):
+    cities = [f"village-{i}" for i in range(5)]
+    for city in cities:
+        _lookup(city)
+    keys = list(weather._demand)
+    assert len(keys) == 5
+    weather._forecast_cache.clear()
+    upstream.clear()
+
+    monkeypatch.setattr(settings, "WEATHER_PREFETCH_INTERVAL_S", 0.2)
+    monkeypatch.setattr(settings, "WEATHER_PREFETCH_BATCH", batch)
+    weather.start_prefetcher()
+    deadline = time.monotonic() + 5
+    while not all(weather._forecast_cache.get(k) for k in keys) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    weather.stop_prefetcher()
+
+    assert upstream["/v1/forecast"] == requests
+    for city in cities:
+        _lookup(city)
+    assert upstream["/v1/forecast"] == requests
@@ -1,7 +1,13 @@
 import os
 import io
+import sys
+import json
+import time
+import random
 import argparse
 import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import requests
 import pdfplumber
 import tiktoken
@@ -9,6 +15,17 @@ from google import genai  # Gemini embeddings SDK
 from google.genai.types import EmbedContentConfig
 from pinecone import Pinecone, ServerlessSpec
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from app.services.cache import bump_generation  # invalidates the backend's retrieval cache
+from app.services.local_index import LocalVectorIndex
+
+# The pipeline streams: pages are extracted in a process pool a few at a time
+# (running ahead into the next PDFs while the current one drains), chunked as
+# they arrive, embedded in batches with several requests in flight,
+# and upserted in fixed-size batches. Memory stays bounded by the lookahead,
+# not by the size of the PDF. A checkpoint records how many chunks of each
+# PDF are stored, so an interrupted run resumes without re-embedding them.
+
 # 1. PDF download
 def download_pdf(url: str) -> str:
     r = requests.get(url, stream=True, timeout=60)
@@ -20,72 +37,286 @@ def download_pdf(url: str) -> str:
                 f.write(chunk)
     return path
 
-# 2. Extract text + tables
-def extract_pdf_text(path: str) -> str:
-    text = ""
+# 2. Extract text page by page (runs in worker processes)
+def page_count(path: str) -> int:
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+def extract_pages(path: str, start: int, end: int) -> list:
     with pdfplumber.open(path) as pdf:
-        for i, p in enumerate(pdf.pages, start=1):
-            page_text = p.extract_text() or ""
-            text += f"\n\n--- Page {i} ---\n\n{page_text}"
-    return text
-
-# 3. Chunk text using token-based splitting
-def chunk_text(text: str, model_name: str, max_tokens=800, overlap=80):
-    enc = tiktoken.encoding_for_model(model_name)
-    tokens = enc.encode(text)
-    chunks = []
-    i = 0
-    while i < len(tokens):
-        j = min(i + max_tokens, len(tokens))
-        chunk = enc.decode(tokens[i:j])
-        chunks.append(chunk)
-        if j == len(tokens): break
-        i = j - overlap
-    return chunks
+        out = []
+        for i in range(start, end):
+            page = pdf.pages[i]
+            out.append(page.extract_text() or "")
+            page.close()  # drop pdfminer's cached layout for the page
+        return out
+
+class PageFeeder:
+    """Keeps `lookahead` extraction tasks in flight across PDF boundaries.
+
+    While the pages of one PDF are chunked and embedded, the first pages of
+    the next ones are already being extracted (and downloaded, for URLs), so
+    the workers do not sit idle at every file boundary. Pages still come out
+    one PDF at a time and in order, which keeps the checkpoint a single chunk
+    count per PDF and memory bounded by the lookahead.
+    """
+
+    def __init__(self, pool, pdf_inputs, pages_per_task: int, lookahead: int):
+        self.pool = pool
+        self.pages_per_task = pages_per_task
+        self.lookahead = lookahead
+        self.waiting = deque(pdf_inputs)  # not opened yet
+        self.paths = {}  # pdf_input -> (local path, downloaded)
+        self.ranges = iter(())  # page ranges of the last opened PDF not submitted yet
+        self.tasks = deque()  # (pdf_input, first page index, future), in order
+
+    def _open(self, pdf_input: str) -> None:
+        downloaded = pdf_input.startswith(("http://", "https://"))
+        path = download_pdf(pdf_input) if downloaded else pdf_input
+        self.paths[pdf_input] = (path, downloaded)
+        n = page_count(path)
+        self.ranges = iter([(pdf_input, path, s, min(s + self.pages_per_task, n))
+                            for s in range(0, n, self.pages_per_task)])
+
+    def _fill(self) -> None:
+        while len(self.tasks) < self.lookahead:
+            nxt = next(self.ranges, None)
+            if nxt is None:
+                if not self.waiting:
+                    return
+                self._open(self.waiting.popleft())
+                continue
+            pdf_input, path, start, end = nxt
+            self.tasks.append((pdf_input, start, self.pool.submit(extract_pages, path, start, end)))
+
+    def pages(self, pdf_input: str):
+        """Yield (page_number, text) of pdf_input, the next PDF in order."""
+        try:
+            self._fill()
+            while self.tasks and self.tasks[0][0] == pdf_input:
+                _, start, fut = self.tasks.popleft()
+                self._fill()
+                for offset, text in enumerate(fut.result()):
+                    yield start + offset + 1, text
+        finally:
+            self.release(pdf_input)
+
+    def release(self, pdf_input: str) -> None:
+        path, downloaded = self.paths.pop(pdf_input, (None, False))
+        if downloaded:
+            os.remove(path)
+
+    def close(self) -> None:
+        for pdf_input in list(self.paths):
+            self.release(pdf_input)
+
+# 3. Chunk incrementally using token-based splitting
+def get_encoding(model_name: str):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        # tiktoken only knows OpenAI models; token counts are an estimate either way.
+        return tiktoken.get_encoding("cl100k_base")
+
+def iter_chunks(pages, enc, max_tokens=800, overlap=80):
+    """Yield (chunk_text, first_page, last_page) as soon as enough tokens have arrived."""
+    tokens, token_pages = [], []
+    emitted = False
+    for page_no, page_text in pages:
+        piece = enc.encode(f"\n\n--- Page {page_no} ---\n\n{page_text}")
+        tokens.extend(piece)
+        token_pages.extend([page_no] * len(piece))
+        while len(tokens) > max_tokens:
+            yield enc.decode(tokens[:max_tokens]), token_pages[0], token_pages[max_tokens - 1]
+            emitted = True
+            del tokens[:max_tokens - overlap]
+            del token_pages[:max_tokens - overlap]
+    # The last `overlap` tokens are already in the previous chunk.
+    if tokens and (not emitted or len(tokens) > overlap):
+        yield enc.decode(tokens), token_pages[0], token_pages[-1]
+
+# 4. Embeddings with retries
+def embed_batch(client, model: str, texts: list, retries: int = 5) -> list:
+    for attempt in range(retries):
+        try:
+            response = client.models.embed_content(
+                model=model,
+                contents=texts,
+                config=EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT")
+            )
+            return [e.values for e in response.embeddings]
+        except Exception:
+            if attempt == retries - 1:
+                raise
+            time.sleep(min(30, 2 ** attempt) + random.random())
+
+# 5. Checkpoint
+def load_checkpoint(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_checkpoint(path: str, state: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+class Sink:
+    """Writes vector rows to Pinecone (each batch is durable once upserted) or
+    to the local index (durable once committed, every `commit_every` rows)."""
+
+    def __init__(self, index=None, local=None, namespace="default", commit_every=2000):
+        self.index = index
+        self.local = local
+        self.namespace = namespace
+        self.commit_every = commit_every
+        self.uncommitted = 0
+
+    def write(self, source: str, rows: list) -> bool:
+        ids = [f"{source}-c{r['chunk_index']}" for r in rows]
+        metas = [{"source": source, "chunk_index": r["chunk_index"],
+                  "page_start": r["page_start"], "page_end": r["page_end"]} for r in rows]
+        if self.local is None:
+            self.index.upsert(vectors=[{"id": i, "values": r["values"], "metadata": {**m, "text": r["text"]}}
+                                       for i, r, m in zip(ids, rows, metas)], namespace=self.namespace)
+            return True
+        self.local.upsert(ids, [r["values"] for r in rows], [r["text"] for r in rows], metas)
+        self.uncommitted += len(rows)
+        if self.uncommitted >= self.commit_every:
+            return self.commit()
+        return False
+
+    def commit(self) -> bool:
+        # Every local commit rewrites the index, so batch them.
+        if self.local is not None and self.uncommitted:
+            self.local.commit()
+            self.uncommitted = 0
+        return True
+
+class Progress:
+    def __init__(self, every: float = 5.0):
+        self.start = self.last = time.perf_counter()
+        self.every = every
+        self.pages = self.chunks = 0
+
+    def report(self, label: str = "", force: bool = False) -> None:
+        now = time.perf_counter()
+        if not force and now - self.last < self.every:
+            return
+        self.last = now
+        elapsed = max(now - self.start, 1e-9)
+        print(f"  {label}{self.pages} pages ({self.pages / elapsed:.1f}/s), "
+              f"{self.chunks} chunks ({self.chunks / elapsed:.1f}/s), {elapsed:.1f}s")
+
+def process_pdf(pdf_input, source, args, feeder, embedder, genai_client, sink, state, progress):
+    entry = state.setdefault(pdf_input, {"chunks_done": 0, "complete": False})
+    print(f"\nProcessing: {pdf_input}")
+    enc = get_encoding("gemini-embedding-001")
+    resume_from = entry["chunks_done"]
+    if resume_from:
+        print(f"  resuming after {resume_from} stored chunks")
+
+    def counted_pages():
+        for page in feeder.pages(pdf_input):
+            progress.pages += 1
+            yield page
+
+    inflight = deque()  # (rows, embedding future), in chunk order
+    ready = []  # rows with vectors, waiting for a full upsert batch
+    stored = resume_from  # chunks written, not necessarily durable yet
+
+    def flush(final: bool = False) -> None:
+        nonlocal stored
+        while len(ready) >= args.upsert_batch or (final and ready):
+            rows, ready[:] = ready[:args.upsert_batch], ready[args.upsert_batch:]
+            durable = sink.write(source, rows)
+            stored = rows[-1]["chunk_index"] + 1
+            if durable:
+                entry["chunks_done"] = stored
+                save_checkpoint(args.checkpoint, state)
+
+    def collect_oldest() -> None:
+        rows, fut = inflight.popleft()
+        for row, emb in zip(rows, fut.result()):
+            row["values"] = emb
+            ready.append(row)
+        progress.chunks += len(rows)
+        flush()
+
+    def submit(rows) -> None:
+        inflight.append((rows, embedder.submit(embed_batch, genai_client, args.model, [r["text"] for r in rows])))
+        while len(inflight) >= args.embed_concurrency:
+            collect_oldest()
+
+    batch = []
+    for i, (text, first_page, last_page) in enumerate(iter_chunks(counted_pages(), enc)):
+        if i < resume_from:
+            continue
+        batch.append({"chunk_index": i, "text": text, "page_start": first_page, "page_end": last_page})
+        if len(batch) == args.embed_batch:
+            submit(batch)
+            batch = []
+        progress.report()
+    if batch:
+        submit(batch)
+    while inflight:
+        collect_oldest()
+    flush(final=True)
+    sink.commit()
+    entry.update(chunks_done=stored, complete=True)
+    save_checkpoint(args.checkpoint, state)
+    bump_generation(args.namespace)
+    progress.report(label=f"{source}: ", force=True)
 
 def main(args):
     # Setup clients
     genai_client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
 
     index_name = args.index_name
     namespace = args.namespace
+    args.checkpoint = args.checkpoint or f".upload_checkpoint.{index_name}.{namespace}.json"
+
+    if args.backend == "local":
+        # One directory per index/namespace; Gemini vectors are 3072-d, so keep
+        # them apart from the backend's E5 index.
+        local = LocalVectorIndex(os.path.join(args.local_dir, index_name, namespace), dtype=args.local_dtype)
+    else:
+        pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+        # Create Pinecone index if not exists
+        dims = 3072  # For gemini-embedding-001 or experimental
+        if index_name not in [idx["name"] for idx in pc.list_indexes()]:
+            pc.create_index(
+                name=index_name,
+                dimension=dims,
+                metric="cosine",
+                spec=ServerlessSpec(cloud="aws", region="us-east-1")
+            )
+        index = pc.Index(index_name)
 
-    # Create Pinecone index if not exists
-    dims = 3072  # For gemini-embedding-001 or experimental
-    if index_name not in [idx["name"] for idx in pc.list_indexes()]:
-        pc.create_index(
-            name=index_name,
-            dimension=dims,
-            metric="cosine",
-            spec=ServerlessSpec(cloud="aws", region="us-east-1")
-        )
-    index = pc.Index(index_name)
-
-    for pdf_input in args.pdfs:
-        print(f"\nProcessing: {pdf_input}")
-        path = download_pdf(pdf_input) if pdf_input.startswith(("http://", "https://")) else pdf_input
-
-        content = extract_pdf_text(path)
-        chunks = chunk_text(content, model_name="gemini-embedding-001")
-
-        # Generate embeddings via Gemini
-        response = genai_client.models.embed_content(
-            model=args.model,
-            contents=chunks,
-            config=EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT")
-        )
-        embeddings = [e.values for e in response.embeddings]
-
-        vectors = []
-        for i, (chunk, emb) in enumerate(zip(chunks, embeddings)):
-            vectors.append({
-                "id": f"{os.path.basename(path)}-c{i}",
-                "metadata": {"source": os.path.basename(path), "chunk_index": i},
-                "values": emb
-            })
-        index.upsert(vectors=vectors, namespace=namespace)
-        print(f"Upserted {len(vectors)} chunks.")
+    sink = Sink(index=None if args.backend == "local" else index,
+                local=local if args.backend == "local" else None, namespace=namespace)
+    state = load_checkpoint(args.checkpoint)
+    todo = []
+    for pdf_input in dict.fromkeys(args.pdfs):
+        if state.get(pdf_input, {}).get("complete"):
+            print(f"Skipping (already complete): {pdf_input}")
+        else:
+            todo.append(pdf_input)
+    progress = Progress()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool, \
+         ThreadPoolExecutor(max_workers=args.embed_concurrency) as embedder:
+        feeder = PageFeeder(pool, todo, args.pages_per_task, args.lookahead)
+        try:
+            for pdf_input in todo:
+                is_url = pdf_input.startswith(("http://", "https://"))
+                source = os.path.basename(pdf_input.split("?")[0]) if is_url else os.path.basename(pdf_input)
+                process_pdf(pdf_input, source, args, feeder, embedder, genai_client, sink, state, progress)
+        finally:
+            feeder.close()
+    progress.report(label="total: ", force=True)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -93,10 +324,31 @@ if __name__ == "__main__":
                         help="PDF file paths or URLs")
     parser.add_argument("--index-name", required=True,
                         help="Name of Pinecone index")
+    parser.add_argument("--backend", default="pinecone", choices=["pinecone", "local"],
+                        help="Write to Pinecone or to a local memory-mapped index")
+    parser.add_argument("--local-dir", default="./data/local_index",
+                        help="Root directory for --backend local")
+    parser.add_argument("--local-dtype", default="float32", choices=["float32", "int8"],
+                        help="Vector storage type for --backend local")
     parser.add_argument("--namespace", default="default",
                         help="Pinecone namespace")
     parser.add_argument("--model", default="gemini-embedding-001",
                         choices=["gemini-embedding-001", "gemini-embedding-exp-03-07"],
                         help="Gemini embedding model to use")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2,
+                        help="Processes extracting PDF pages")
+    parser.add_argument("--pages-per-task", type=int, default=8,
+                        help="Pages extracted per worker task")
+    parser.add_argument("--lookahead", type=int, default=0,
+                        help="Extraction tasks in flight, running ahead into the next PDFs (default: 2x workers)")
+    parser.add_argument("--embed-batch", type=int, default=64,
+                        help="Chunks per embedding request (Gemini allows up to 100)")
+    parser.add_argument("--embed-concurrency", type=int, default=4,
+                        help="Embedding requests in flight")
+    parser.add_argument("--upsert-batch", type=int, default=100,
+                        help="Vectors per upsert request")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Resume state file (default: .upload_checkpoint.<index>.<namespace>.json)")
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    args.lookahead = args.lookahead or 2 * args.workers
+    main(args)